@@ -1,29 +1,63 @@
+import asyncio
+import bisect
+import gc
+import json
+import operator
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import weakref
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 from unittest import mock  # Import the mock module for simulating payment failures in tests.
 
+from Payment_Processing import DEFAULT_ROUNDING, Money
+
 # CartItem Class
 class CartItem:
     """
     Represents an individual item in the shopping cart.
     
+    The price is held as an exact number of cents; `price` exposes it in dollars. Instances use
+    __slots__ and interned names, so a resident cart item carries no per-instance dictionary.
+    
     Attributes:
         name (str): The name of the item.
-        price (float): The price of the item.
+        price_cents (int): The price of the item in cents.
         quantity (int): The quantity of the item in the cart.
     """
+    __slots__ = ("name", "price_cents", "quantity")
+
     def __init__(self, name, price, quantity):
         """
         Initializes a CartItem object with the given name, price, and quantity.
         
         Args:
             name (str): Name of the item.
-            price (float): Price of the item.
+            price (float, str, Decimal, or Money): Price of the item, in dollars.
             quantity (int): Quantity of the item in the cart.
         """
-        self.name = name
-        self.price = price
+        self.name = sys.intern(name)
+        self.price_cents = Money.to_cents(price)
         self.quantity = quantity
 
+    @property
+    def price(self):
+        """
+        float: The price of the item in dollars.
+        """
+        return self.price_cents / 100
+
+    @price.setter
+    def price(self, price):
+        self.price_cents = Money.to_cents(price)
+
     def update_quantity(self, new_quantity):
         """
         Updates the quantity of the item in the cart.
@@ -40,7 +74,16 @@ class CartItem:
         Returns:
             float: The subtotal price for this item.
         """
-        return self.price * self.quantity
+        return self.price_cents * self.quantity / 100
+
+    def get_subtotal_cents(self):
+        """
+        Calculates the exact subtotal for this item in cents.
+        
+        Returns:
+            int: The subtotal in cents.
+        """
+        return self.price_cents * self.quantity
 
 
 # Cart Class
@@ -48,14 +91,53 @@ class Cart:
     """
     Represents a shopping cart that can contain multiple CartItem objects.
     
+    Items are indexed by name and the cart keeps a running subtotal that every change updates, so adding,
+    updating, or removing an item and calculating the total all take constant time. Amounts are kept
+    in whole cents, so the running subtotal is exact.
+    
     Attributes:
-        items (list): A list of CartItem objects in the cart.
+        items (list): Copies of the CartItem objects in the cart, in the order they were added.
+        tax_rate (Decimal): The tax rate applied to the subtotal.
+        delivery_fee (Money): The flat delivery fee.
+        rounding (str): The decimal rounding mode used when the tax comes to a fraction of a cent.
     """
-    def __init__(self):
+    TAX_RATE = Decimal("0.10")  # Assume 10% tax rate.
+    DELIVERY_FEE = Money(500)  # Flat delivery fee.
+
+    def __init__(self, tax_rate=TAX_RATE, delivery_fee=DELIVERY_FEE, rounding=DEFAULT_ROUNDING):
         """
         Initializes an empty Cart with no items.
+        
+        Args:
+            tax_rate (Decimal or str, optional): The tax rate applied to the subtotal.
+            delivery_fee (Money or float, optional): The flat delivery fee.
+            rounding (str, optional): The decimal rounding mode used for the tax.
+        """
+        self._items = {}  # Item name -> CartItem, in the order items were added.
+        self._subtotal_cents = 0
+        self.tax_rate = tax_rate
+        self.delivery_fee = Money.from_amount(delivery_fee)
+        self.rounding = rounding
+
+    @property
+    def tax_rate(self):
         """
-        self.items = []
+        Decimal: The tax rate applied to the subtotal.
+        """
+        return self._tax_rate
+
+    @tax_rate.setter
+    def tax_rate(self, tax_rate):
+        self._tax_rate = tax_rate if isinstance(tax_rate, Decimal) else Decimal(str(tax_rate))
+        self._tax_ratio = self._tax_rate.as_integer_ratio()  # Lets the tax be rounded in integer arithmetic.
+
+    @property
+    def items(self):
+        """
+        list: Copies of the CartItem objects in the cart, in the order they were added. Changing a copy
+              does not change the cart; use update_item_quantity instead.
+        """
+        return [CartItem(item.name, Money(item.price_cents), item.quantity) for item in self._items.values()]
 
     def add_item(self, name, price, quantity):
         """
@@ -69,15 +151,17 @@ class Cart:
         Returns:
             str: A message indicating whether the item was added or updated.
         """
-        for item in self.items:
-            if item.name == name:
-                # If the item is already in the cart, update its quantity.
-                item.update_quantity(item.quantity + quantity)
-                return f"Updated {name} quantity to {item.quantity}"
+        item = self._items.get(name)
+        if item is not None:
+            # If the item is already in the cart, update its quantity.
+            item.update_quantity(item.quantity + quantity)
+            self._subtotal_cents += item.price_cents * quantity
+            return f"Updated {name} quantity to {item.quantity}"
         
         # If the item is not in the cart, add it as a new item.
         new_item = CartItem(name, price, quantity)
-        self.items.append(new_item)
+        self._items[name] = new_item
+        self._subtotal_cents += new_item.get_subtotal_cents()
         return f"Added {name} to cart"
 
     def remove_item(self, name):
@@ -90,7 +174,9 @@ class Cart:
         Returns:
             str: A message indicating the item was removed.
         """
-        self.items = [item for item in self.items if item.name != name]
+        item = self._items.pop(name, None)
+        if item is not None:
+            self._subtotal_cents -= item.get_subtotal_cents()
         return f"Removed {name} from cart"
 
     def update_item_quantity(self, name, new_quantity):
@@ -104,24 +190,54 @@ class Cart:
         Returns:
             str: A message indicating whether the item's quantity was updated or if the item was not found.
         """
-        for item in self.items:
-            if item.name == name:
-                item.update_quantity(new_quantity)
-                return f"Updated {name} quantity to {new_quantity}"
-        return f"{name} not found in cart"
+        item = self._items.get(name)
+        if item is None:
+            return f"{name} not found in cart"
+        self._subtotal_cents += item.price_cents * (new_quantity - item.quantity)
+        item.update_quantity(new_quantity)
+        return f"Updated {name} quantity to {new_quantity}"
 
     def calculate_total(self):
         """
         Calculates the total cost of the items in the cart, including tax and delivery fee.
         
         Returns:
-            dict: A dictionary containing the subtotal, tax, delivery fee, and total cost.
+            dict: A dictionary containing the subtotal, tax, delivery fee, and total cost, in dollars.
+        """
+        return {key: cents / 100 for key, cents in self.calculate_total_cents().items()}
+
+    def get_subtotal_cents(self):
+        """
+        Returns:
+            int: The exact subtotal of every item in the cart, in cents.
+        """
+        return self._subtotal_cents
+
+    def calculate_total_cents(self):
+        """
+        Calculates the exact total cost of the items in the cart in whole cents.
+        
+        Everything is plain integer arithmetic, including rounding the tax, so this is the path to use
+        when totalling many carts; wrap only the final figure in Money.
+        
+        Returns:
+            dict: A dictionary containing the subtotal, tax, delivery fee, and total cost, in cents.
         """
-        subtotal = sum(item.get_subtotal() for item in self.items)
-        tax = subtotal * 0.10  # Assume 10% tax rate.
-        delivery_fee = 5.00  # Flat delivery fee.
-        total = subtotal + tax + delivery_fee
-        return {"subtotal": subtotal, "tax": tax, "delivery_fee": delivery_fee, "total": total}
+        subtotal = self.get_subtotal_cents()
+        numerator, denominator = self._tax_ratio
+        tax = Money.round_ratio(subtotal * numerator, denominator, self.rounding)
+        delivery_fee = self.delivery_fee.cents
+        return {"subtotal": subtotal, "tax": tax, "delivery_fee": delivery_fee,
+                "total": subtotal + tax + delivery_fee}
+
+    def calculate_total_money(self):
+        """
+        Calculates the exact total cost of the items in the cart, including tax and delivery fee.
+        
+        Returns:
+            dict: A dictionary containing the subtotal, tax, delivery fee, and total cost as Money objects.
+        """
+        return {key: Money(cents) for key, cents in self.calculate_total_cents().items()}
 
     def view_cart(self):
         """
@@ -130,7 +246,502 @@ class Cart:
         Returns:
             list: A list of dictionaries with each item's name, quantity, and subtotal price.
         """
-        return [{"name": item.name, "quantity": item.quantity, "subtotal": item.get_subtotal()} for item in self.items]
+        return [{"name": item.name, "quantity": item.quantity, "subtotal": item.get_subtotal()}
+                for item in self._items.values()]
+
+    def get_quantities(self):
+        """
+        Returns:
+            dict: The quantity of every item in the cart, keyed by item name.
+        """
+        return {name: item.quantity for name, item in self._items.items()}
+
+    def get_line_items(self):
+        """
+        Returns:
+            list: A (name, price in cents, quantity) tuple for every item in the cart, without copying the items.
+        """
+        return [(item.name, item.price_cents, item.quantity) for item in self._items.values()]
+
+
+# ArrayCart Class
+class ArrayCart(Cart):
+    """
+    A Cart laid out as a struct of arrays: item prices and quantities live in two `array` buffers of
+    machine integers, with the names in a parallel list and a name -> position index.
+    
+    Nothing is allocated per item beyond its name, which suits processes that keep many carts resident.
+    The subtotal is computed in a single pass over the two buffers, with no per-item attribute lookups.
+    Removing an item moves the last item into its place, so the item order can change after a removal.
+    """
+    def __init__(self, tax_rate=Cart.TAX_RATE, delivery_fee=Cart.DELIVERY_FEE, rounding=DEFAULT_ROUNDING):
+        """
+        Initializes an empty ArrayCart with no items.
+        
+        Args:
+            tax_rate (Decimal or str, optional): The tax rate applied to the subtotal.
+            delivery_fee (Money or float, optional): The flat delivery fee.
+            rounding (str, optional): The decimal rounding mode used for the tax.
+        """
+        super().__init__(tax_rate=tax_rate, delivery_fee=delivery_fee, rounding=rounding)
+        self._names = []
+        self._prices = array('q')  # Price of each item in cents.
+        self._quantities = array('q')
+        self._positions = {}  # Item name -> position in the arrays.
+
+    @property
+    def items(self):
+        """
+        list: CartItem objects built from the arrays, in their current order.
+        """
+        return [CartItem(name, Money(price), quantity)
+                for name, price, quantity in zip(self._names, self._prices, self._quantities)]
+
+    def add_item(self, name, price, quantity):
+        """
+        Adds a new item to the cart or updates the quantity of an existing item.
+        
+        Args:
+            name (str): Name of the item.
+            price (float): Price of the item.
+            quantity (int): Quantity to be added to the cart.
+        
+        Returns:
+            str: A message indicating whether the item was added or updated.
+        """
+        position = self._positions.get(name)
+        if position is not None:
+            self._quantities[position] += quantity
+            return f"Updated {name} quantity to {self._quantities[position]}"
+
+        self._positions[name] = len(self._names)
+        self._names.append(sys.intern(name))
+        self._prices.append(Money.to_cents(price))
+        self._quantities.append(quantity)
+        return f"Added {name} to cart"
+
+    def remove_item(self, name):
+        """
+        Removes an item from the cart by its name.
+        
+        Args:
+            name (str): Name of the item to be removed.
+        
+        Returns:
+            str: A message indicating the item was removed.
+        """
+        position = self._positions.pop(name, None)
+        if position is not None:
+            last_name = self._names.pop()
+            last_price = self._prices.pop()
+            last_quantity = self._quantities.pop()
+            if last_name != name:
+                self._names[position] = last_name
+                self._prices[position] = last_price
+                self._quantities[position] = last_quantity
+                self._positions[last_name] = position
+        return f"Removed {name} from cart"
+
+    def update_item_quantity(self, name, new_quantity):
+        """
+        Updates the quantity of an item in the cart by its name.
+        
+        Args:
+            name (str): Name of the item.
+            new_quantity (int): The new quantity for the item.
+        
+        Returns:
+            str: A message indicating whether the item's quantity was updated or if the item was not found.
+        """
+        position = self._positions.get(name)
+        if position is None:
+            return f"{name} not found in cart"
+        self._quantities[position] = new_quantity
+        return f"Updated {name} quantity to {new_quantity}"
+
+    def get_quantities(self):
+        """
+        Returns:
+            dict: The quantity of every item in the cart, keyed by item name.
+        """
+        return dict(zip(self._names, self._quantities))
+
+    def get_line_items(self):
+        """
+        Returns:
+            list: A (name, price in cents, quantity) tuple for every item in the cart, in their current order.
+        """
+        return list(zip(self._names, self._prices, self._quantities))
+
+    def get_subtotal_cents(self):
+        """
+        Returns:
+            int: The exact subtotal of every item in the cart, in cents, computed in one pass over the arrays.
+        """
+        return sum(map(operator.mul, self._prices, self._quantities))
+
+    def view_cart(self):
+        """
+        Provides a view of the items in the cart.
+        
+        Returns:
+            list: A list of dictionaries with each item's name, quantity, and subtotal price.
+        """
+        return [{"name": name, "quantity": quantity, "subtotal": price * quantity / 100}
+                for name, price, quantity in zip(self._names, self._prices, self._quantities)]
+
+
+CROCKFORD_BASE32 = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # Its characters sort in the order of their values.
+
+
+# OrderIdGenerator Class
+class OrderIdGenerator:
+    """
+    Generates unique, time-ordered order IDs in the ULID layout, without any lock.
+    
+    Each ID is a 128-bit number: the creation time in milliseconds in the top 48 bits and 80 bits that
+    start at a random value every millisecond and count up within it. The number is written in Crockford
+    base32 after a prefix, at a fixed width, so IDs sort as strings in the order they were created (to the
+    millisecond across threads and processes, and strictly within one thread).
+    
+    Every thread keeps its own clock reading and counter, so threads never contend. The random start
+    values make collisions between threads and processes vanishingly unlikely, and a forked child
+    starts from fresh random state rather than repeating its parent's sequence.
+    
+    Attributes:
+        prefix (str): The text every ID starts with.
+    """
+    ALPHABET = CROCKFORD_BASE32
+    RANDOM_BITS = 80
+    _PAIRS = [high + low for high in CROCKFORD_BASE32 for low in CROCKFORD_BASE32]  # Every 10-bit value.
+    _SHIFTS = range(120, -1, -10)  # 13 pairs of characters cover 130 bits.
+    _generators = weakref.WeakSet()  # Every live generator, for the fork hook registered below the class.
+
+    def __init__(self, prefix="ORD", clock=time.time_ns):
+        """
+        Initializes an OrderIdGenerator.
+        
+        Args:
+            prefix (str, optional): The text every ID starts with.
+            clock (callable, optional): Returns the current time in nanoseconds.
+        """
+        self.prefix = prefix
+        self._clock = clock
+        self._local = threading.local()
+        OrderIdGenerator._generators.add(self)
+
+    def next_int(self):
+        """
+        Generates the next ID as an integer.
+        
+        Returns:
+            int: A 128-bit ID, larger than any ID this thread generated before.
+        """
+        state = self._local
+        now = self._clock() // 1_000_000
+        try:
+            last, counter = state.last, state.counter
+        except AttributeError:
+            state.rng = random.Random(os.urandom(16))
+            last, counter = -1, 0
+        if now > last:
+            # A fresh random start, with the top bit clear so the count cannot overflow within the millisecond.
+            counter = state.rng.getrandbits(self.RANDOM_BITS - 1)
+        else:
+            now = last  # Never step back, even if the system clock does.
+            counter += 1
+        state.last, state.counter = now, counter
+        return (now << self.RANDOM_BITS) | counter
+
+    def next_id(self):
+        """
+        Generates the next order ID.
+        
+        Returns:
+            str: The prefix followed by 26 base32 characters.
+        """
+        return self.prefix + self.encode(self.next_int())
+
+    def lower_bound(self, timestamp_ms):
+        """
+        Returns the smallest ID that can be created at a given time, for range scans over ID-sorted orders.
+        
+        Args:
+            timestamp_ms (int): A Unix time in milliseconds.
+        
+        Returns:
+            str: An ID that sorts before every ID created at or after that time, and after every earlier one.
+        """
+        return self.prefix + self.encode(timestamp_ms << self.RANDOM_BITS)
+
+    def timestamp_of(self, order_id):
+        """
+        Reads the creation time back out of an ID.
+        
+        Args:
+            order_id (str): An ID created by a generator with the same prefix.
+        
+        Returns:
+            int: The Unix time in milliseconds at which the ID was created.
+        """
+        return self.decode(order_id[len(self.prefix):]) >> self.RANDOM_BITS
+
+    @classmethod
+    def encode(cls, value):
+        """
+        Writes a 128-bit number as 26 Crockford base32 characters.
+        """
+        pairs = cls._PAIRS
+        return "".join([pairs[(value >> shift) & 0x3FF] for shift in cls._SHIFTS])
+
+    @classmethod
+    def decode(cls, text):
+        """
+        Reads a number back from Crockford base32 characters.
+        """
+        value = 0
+        for character in text:
+            value = value * 32 + cls.ALPHABET.index(character)
+        return value
+
+    def _reset(self):
+        """
+        Drops every thread's state, so a forked child does not repeat its parent's IDs.
+        """
+        self._local = threading.local()
+
+    @classmethod
+    def _reset_all(cls):
+        """
+        Resets every live generator. Runs in a forked child.
+        """
+        for generator in list(cls._generators):
+            generator._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    # One hook for all generators; a hook per generator would keep every generator alive forever.
+    os.register_at_fork(after_in_child=OrderIdGenerator._reset_all)
+
+
+default_order_ids = OrderIdGenerator()  # Shared by every OrderPlacement that is not given its own generator.
+
+
+# OrderStore Class
+class OrderStore:
+    """
+    Persists confirmed orders in an append-only write-ahead log, with indexes by order id, user email, and time.
+    
+    Each order is written as one line: a CRC-32 of the JSON record, then the record. A writer thread
+    commits in groups: every order queued while the previous write was being synced to disk goes out
+    in the next write, followed by a single fsync. append returns only once its orders are durable,
+    so concurrent callers share fsyncs instead of paying for one each.
+    
+    On opening, the log is replayed to rebuild the indexes. A torn last line, left by a crash part-way
+    through a write, fails its checksum and is cut off.
+    
+    Attributes:
+        path (str): The log file.
+        fsync (bool): False to skip fsync, e.g. in tests; writes then survive a process crash but not a power loss.
+        commits (int): The number of group commits written so far.
+    """
+    def __init__(self, path, fsync=True, max_batch=1024):
+        """
+        Opens an OrderStore, replaying its log if the file exists.
+        
+        Args:
+            path (str): The log file.
+            fsync (bool, optional): False to skip fsync.
+            max_batch (int, optional): The most orders written in one group commit.
+        """
+        self.path = path
+        self.fsync = fsync
+        self.max_batch = max_batch
+        self.commits = 0
+        self._orders = {}  # order id -> record.
+        self._ids_by_email = {}  # email -> order ids, oldest first.
+        self._by_time = []  # (created_at, order id), sorted.
+        self._pending = []  # (record, encoded line) pairs waiting for the writer.
+        self._unsettled_ids = set()  # Ids of orders queued but not yet durable and indexed.
+        self._queued = 0  # Orders queued since opening.
+        self._durable = 0  # Orders written and synced since opening.
+        self._error = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._recover()
+        self._file = open(path, "ab")
+        self._writer = threading.Thread(target=self._write_loop, daemon=True, name="order-store-writer")
+        self._writer.start()
+
+    def append(self, record):
+        """
+        Writes one order and waits until it is durable.
+        
+        Args:
+            record (dict): The order, with at least 'order_id' and 'created_at' (Unix time in milliseconds);
+                           'email' is indexed when present.
+        
+        Raises:
+            ValueError: If the order has no id or timestamp, its id is already stored, or the store is closed.
+            OSError: If the log could not be written.
+        """
+        self.append_many([record])
+
+    def append_many(self, records):
+        """
+        Writes several orders and waits until they are all durable.
+        
+        Args:
+            records (list): The orders, each shaped as for append.
+        
+        Raises:
+            ValueError: If an order has no id or timestamp, its id is already stored or queued or appears
+                        twice in the batch, or the store is closed. Nothing is written then.
+            OSError: If the log could not be written.
+        """
+        lines = []
+        for record in records:
+            if "order_id" not in record or "created_at" not in record:
+                raise ValueError("Orders need an order_id and a created_at time")
+            lines.append(self._encode(record))
+        with self._condition:
+            if self._closed:
+                raise ValueError("Order store is closed")
+            order_ids = set()
+            for record in records:
+                order_id = record["order_id"]
+                if order_id in self._orders or order_id in self._unsettled_ids or order_id in order_ids:
+                    raise ValueError(f"Order {order_id} is already stored")
+                order_ids.add(order_id)
+            self._unsettled_ids |= order_ids
+            self._pending.extend(zip(records, lines))
+            self._queued += len(records)
+            target = self._queued
+            self._condition.notify_all()
+            while self._durable < target:
+                if self._error is not None:
+                    raise OSError("Order could not be written") from self._error
+                self._condition.wait()
+
+    def get(self, order_id):
+        """
+        Returns the order with the given id, or None.
+        """
+        with self._condition:
+            return self._orders.get(order_id)
+
+    def recent_orders(self, email, limit=20):
+        """
+        Returns a user's most recent orders, newest first.
+        
+        Args:
+            email (str): The user's email address.
+            limit (int, optional): The most orders returned.
+        """
+        with self._condition:
+            order_ids = self._ids_by_email.get(email, [])
+            return [self._orders[order_id] for order_id in reversed(order_ids[-limit:])] if limit > 0 else []
+
+    def orders_between(self, start_ms, end_ms=None):
+        """
+        Returns the orders created in a time range, oldest first.
+        
+        Args:
+            start_ms (int): The start of the range, inclusive, as Unix time in milliseconds.
+            end_ms (int, optional): The end of the range, exclusive. Open-ended if None.
+        """
+        with self._condition:
+            start = bisect.bisect_left(self._by_time, (start_ms,))
+            end = len(self._by_time) if end_ms is None else bisect.bisect_left(self._by_time, (end_ms,))
+            return [self._orders[order_id] for _, order_id in self._by_time[start:end]]
+
+    def __len__(self):
+        with self._condition:
+            return len(self._orders)
+
+    def close(self):
+        """
+        Writes the orders still queued, then stops the writer and closes the log.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        self._file.close()
+
+    @staticmethod
+    def _encode(record):
+        """
+        Encodes an order as one checksummed log line.
+        """
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+    def _index(self, record):
+        """
+        Adds a durable order to the indexes. Call with the condition held.
+        """
+        order_id = record["order_id"]
+        self._orders[order_id] = record
+        if record.get("email") is not None:
+            self._ids_by_email.setdefault(record["email"], []).append(order_id)
+        entry = (record["created_at"], order_id)
+        if not self._by_time or self._by_time[-1] <= entry:
+            self._by_time.append(entry)
+        else:
+            bisect.insort(self._by_time, entry)  # Only if the clock stepped back.
+
+    def _recover(self):
+        """
+        Replays the log into the indexes and cuts off a torn or corrupt tail.
+        """
+        if not os.path.exists(self.path):
+            return
+        valid_bytes = 0
+        with open(self.path, "rb") as log:
+            for line in log:
+                checksum, _, payload = line.rstrip(b"\n").partition(b" ")
+                try:
+                    if not line.endswith(b"\n") or int(checksum, 16) != zlib.crc32(payload):
+                        break
+                    record = json.loads(payload)
+                except ValueError:
+                    break
+                self._index(record)
+                valid_bytes += len(line)
+        if valid_bytes < os.path.getsize(self.path):
+            os.truncate(self.path, valid_bytes)
+
+    def _write_loop(self):
+        """
+        Writes queued orders in group commits until the store is closed.
+        """
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                self._file.write(b"".join([line for _, line in batch]))
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError as error:
+                with self._condition:
+                    self._error = error
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                for record, _ in batch:
+                    self._index(record)
+                    self._unsettled_ids.discard(record["order_id"])
+                self.commits += 1
+                self._durable += len(batch)
+                self._condition.notify_all()
 
 
 # OrderPlacement Class
@@ -142,8 +753,10 @@ class OrderPlacement:
         cart (Cart): The shopping cart containing the items for the order.
         user_profile (UserProfile): The user's profile, including delivery address.
         restaurant_menu (RestaurantMenu): The menu containing available restaurant items.
+        id_generator (OrderIdGenerator): The generator that assigns order IDs to confirmed orders.
+        order_store (OrderStore): Where confirmed orders are persisted, or None to not persist them.
     """
-    def __init__(self, cart, user_profile, restaurant_menu):
+    def __init__(self, cart, user_profile, restaurant_menu, id_generator=None, order_store=None):
         """
         Initializes an OrderPlacement object with the cart, user profile, and restaurant menu.
         
@@ -151,25 +764,43 @@ class OrderPlacement:
             cart (Cart): The shopping cart.
             user_profile (UserProfile): The user's profile.
             restaurant_menu (RestaurantMenu): The restaurant menu with available items.
+            id_generator (OrderIdGenerator, optional): The generator for order IDs. Defaults to a shared one.
+            order_store (OrderStore, optional): Where confirmed orders are persisted.
         """
         self.cart = cart
         self.user_profile = user_profile
         self.restaurant_menu = restaurant_menu
+        self.id_generator = id_generator or default_order_ids
+        self.order_store = order_store
 
-    def validate_order(self):
+    def validate_order(self, report_all=False):
         """
         Validates the order by checking if the cart is empty and if all items are available in the restaurant menu.
         
+        Args:
+            report_all (bool, optional): If True, check the whole cart in one pass and report every unavailable
+                                         item, instead of stopping at the first one.
+        
         Returns:
-            dict: A dictionary indicating whether the order is valid and an accompanying message.
+            dict: A dictionary indicating whether the order is valid and an accompanying message. With report_all,
+                  a failed validation also lists the names under "unavailable_items".
         """
-        if not self.cart.items:
+        quantities = self.cart.get_quantities()
+        if not quantities:
             return {"success": False, "message": "Cart is empty"}
 
+        if report_all:
+            unavailable = self.restaurant_menu.find_unavailable_items(quantities)
+            if unavailable:
+                verb = "is" if len(unavailable) == 1 else "are"
+                return {"success": False, "message": f"{', '.join(unavailable)} {verb} not available",
+                        "unavailable_items": unavailable}
+            return {"success": True, "message": "Order is valid"}
+
         # Validate the availability of each item in the cart.
-        for item in self.cart.items:
-            if not self.restaurant_menu.is_item_available(item.name):
-                return {"success": False, "message": f"{item.name} is not available"}
+        for name, quantity in quantities.items():
+            if not self.restaurant_menu.is_item_available(name, quantity):
+                return {"success": False, "message": f"{name} is not available"}
         return {"success": True, "message": "Order is valid"}
 
     def proceed_to_checkout(self):
@@ -195,22 +826,195 @@ class OrderPlacement:
         
         Returns:
             dict: A dictionary indicating whether the order was confirmed and an order ID if successful.
+                  If items in the cart are not available, they are listed under "unavailable_items". If the
+                  order was paid for but could not be saved, "persisted" is False and "persist_error" says why.
+        """
+        validation = self.validate_order(report_all=True)
+        if not validation["success"]:
+            return self._rejection(validation)
+
+        # Process payment using the given payment method, for the exact total.
+        amount = self.cart.calculate_total_money()["total"]
+        payment_success = payment_method.process_payment(amount)
+        confirmation = self._confirmation(payment_success, self.id_generator)
+        if confirmation["success"] and self.order_store is not None:
+            record = self._order_record(confirmation, amount)
+            self._persist(confirmation, lambda: self.order_store.append(record))
+        return confirmation
+
+    async def confirm_order_async(self, payment_method):
+        """
+        Confirms the order like confirm_order, awaiting the payment instead of blocking on it.
+        
+        A payment method with `process_payment_async` is awaited directly; a blocking one is run on a
+        worker thread so it does not stall the event loop.
+        
+        Args:
+            payment_method (PaymentMethod): The method of payment to be used.
+        
+        Returns:
+            dict: A dictionary indicating whether the order was confirmed and an order ID if successful,
+                  shaped like the result of confirm_order.
+        """
+        validation = self.validate_order(report_all=True)
+        if not validation["success"]:
+            return self._rejection(validation)
+
+        amount = self.cart.calculate_total_money()["total"]
+        if hasattr(payment_method, "process_payment_async"):
+            payment_success = await payment_method.process_payment_async(amount)
+        else:
+            payment_success = await asyncio.to_thread(payment_method.process_payment, amount)
+        confirmation = self._confirmation(payment_success, self.id_generator)
+        if confirmation["success"] and self.order_store is not None:
+            # Waiting for the write to be durable blocks, so it happens on a worker thread.
+            record = self._order_record(confirmation, amount)
+            await asyncio.to_thread(self._persist, confirmation, lambda: self.order_store.append(record))
+        return confirmation
+
+    @classmethod
+    def confirm_orders(cls, batch, max_workers=8, chunk_size=16):
+        """
+        Confirms a batch of orders: validates every cart, then processes the payments concurrently.
+        
+        Payments are grouped per gateway: a payment method's `gateway` attribute when it has one, otherwise
+        its class name and `method` attribute. Each group is split into chunks of at most chunk_size
+        payments, and the chunks of every group run concurrently on a thread pool. Within a chunk, the
+        payments that share a payment method that offers `process_payments` go in one call; the rest are
+        made one by one. If a call fails, or returns a different number of outcomes than it was given
+        payments, every order in it fails.
+        
+        Args:
+            batch (list): (OrderPlacement, PaymentMethod) pairs, one per order.
+            max_workers (int, optional): The maximum number of chunks in flight at once.
+            chunk_size (int, optional): The most payments of one gateway handled by one worker.
+        
+        Returns:
+            list: One confirmation dictionary per order, in the same order as the batch, shaped like the
+                  result of confirm_order. An order that was paid for but could not be saved is still
+                  confirmed, with "persisted" set to False.
+        """
+        results = [None] * len(batch)
+        amounts = [None] * len(batch)
+        groups = {}  # Gateway key -> [(position, payment method, amount), ...].
+        for position, (order, payment_method) in enumerate(batch):
+            validation = order.validate_order(report_all=True)
+            if not validation["success"]:
+                results[position] = cls._rejection(validation)
+                continue
+            amount = amounts[position] = order.cart.calculate_total_money()["total"]
+            groups.setdefault(cls._gateway_key(payment_method), []).append((position, payment_method, amount))
+
+        chunks = [payments[start:start + chunk_size]
+                  for payments in groups.values() for start in range(0, len(payments), chunk_size)]
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                for outcomes in executor.map(cls._pay_chunk, chunks):
+                    for position, payment_success in outcomes:
+                        results[position] = cls._confirmation(payment_success, batch[position][0].id_generator)
+
+        # Persist the confirmed orders with one durable write per store. If a store rejects the write, each
+        # of its orders is retried on its own, so one bad record does not lose the others.
+        stores = {}  # id(order store) -> (order store, [(record, confirmation), ...]).
+        for position, ((order, _), confirmation) in enumerate(zip(batch, results)):
+            if confirmation["success"] and order.order_store is not None:
+                record = order._order_record(confirmation, amounts[position])
+                stores.setdefault(id(order.order_store), (order.order_store, []))[1].append((record, confirmation))
+        for order_store, entries in stores.values():
+            try:
+                order_store.append_many([record for record, _ in entries])
+            except (OSError, ValueError):
+                for record, confirmation in entries:
+                    cls._persist(confirmation, lambda store=order_store, record=record: store.append(record))
+        return results
+
+    @staticmethod
+    def _gateway_key(payment_method):
+        """
+        Returns the key confirm_orders groups a payment method's payments by.
+        """
+        gateway = getattr(payment_method, "gateway", None)
+        if gateway is not None:
+            return gateway
+        return (type(payment_method).__name__, getattr(payment_method, "method", None))
+
+    @staticmethod
+    def _pay_chunk(payments):
+        """
+        Makes a chunk of (position, payment method, amount) payments and returns (position, success) pairs.
+        A failing call fails its own payments only, not the rest of the chunk.
         """
-        if not self.validate_order()["success"]:
-            return {"success": False, "message": "Order validation failed"}
+        calls = {}  # id(payment method) -> (payment method, [(position, amount), ...]).
+        for position, payment_method, amount in payments:
+            calls.setdefault(id(payment_method), (payment_method, []))[1].append((position, amount))
 
-        # Process payment using the given payment method.
-        payment_success = payment_method.process_payment(self.cart.calculate_total()["total"])
+        outcomes = []
+        for payment_method, entries in calls.values():
+            batched = hasattr(payment_method, "process_payments")
+            for entries in ([entries] if batched else [[entry] for entry in entries]):
+                amounts = [amount for _, amount in entries]
+                try:
+                    if batched:
+                        successes = payment_method.process_payments(amounts)
+                    else:
+                        successes = [payment_method.process_payment(amounts[0])]
+                    if len(successes) != len(entries):
+                        raise RuntimeError(f"Expected {len(entries)} payment outcomes, got {len(successes)}")
+                except Exception:
+                    successes = [False] * len(entries)
+                outcomes.extend((position, success) for (position, _), success in zip(entries, successes))
+        return outcomes
 
+    @staticmethod
+    def _rejection(validation):
+        """
+        Builds the result for an order that failed validation, listing any unavailable items.
+        """
+        rejection = {"success": False, "message": "Order validation failed"}
+        if "unavailable_items" in validation:
+            rejection["unavailable_items"] = validation["unavailable_items"]
+        return rejection
+
+    @staticmethod
+    def _confirmation(payment_success, id_generator):
+        """
+        Builds the confirmation result for an order whose payment has been processed.
+        """
         if payment_success:
             return {
                 "success": True,
                 "message": "Order confirmed",
-                "order_id": "ORD123456",  # Simulate an order ID.
+                "order_id": id_generator.next_id(),
                 "estimated_delivery": "45 minutes"
             }
         return {"success": False, "message": "Payment failed"}
 
+    @staticmethod
+    def _persist(confirmation, write):
+        """
+        Runs a write of a paid order to the order store. The payment has already been taken, so a failed
+        write is recorded on the confirmation instead of raised.
+        """
+        try:
+            write()
+        except (OSError, ValueError) as e:
+            confirmation["persisted"] = False
+            confirmation["persist_error"] = str(e)
+
+    def _order_record(self, confirmation, amount):
+        """
+        Builds the record of a confirmed order that is kept in the order store, for the amount that was charged.
+        """
+        return {
+            "order_id": confirmation["order_id"],
+            "email": getattr(self.user_profile, "email", None),
+            "created_at": int(time.time() * 1000),
+            "delivery_address": self.user_profile.delivery_address,
+            "items": [{"name": name, "price_cents": price_cents, "quantity": quantity}
+                      for name, price_cents, quantity in self.cart.get_line_items()],
+            "total_cents": amount.cents,
+        }
+
 
 # PaymentMethod Class
 class PaymentMethod:
@@ -222,15 +1026,39 @@ class PaymentMethod:
         Processes the payment for the given amount.
         
         Args:
-            amount (float): The amount to be paid.
+            amount (Money or float): The amount to be paid.
         
         Returns:
             bool: True if the payment is successful, False otherwise.
         """
-        if amount > 0:
+        if Money.to_cents(amount) > 0:
             return True
         return False
 
+    def process_payments(self, amounts):
+        """
+        Processes a batch of payments in one call.
+        
+        Args:
+            amounts (list): The amounts to be paid.
+        
+        Returns:
+            list: One success flag per amount, in the same order.
+        """
+        return [self.process_payment(amount) for amount in amounts]
+
+    async def process_payment_async(self, amount):
+        """
+        Processes the payment for the given amount without blocking the event loop.
+        
+        Args:
+            amount (Money or float): The amount to be paid.
+        
+        Returns:
+            bool: True if the payment is successful, False otherwise.
+        """
+        return self.process_payment(amount)
+
 
 # UserProfile Class (for simulating the user's details)
 class UserProfile:
@@ -239,15 +1067,18 @@ class UserProfile:
     
     Attributes:
         delivery_address (str): The user's delivery address.
+        email (str): The user's email address, which the order store indexes orders by.
     """
-    def __init__(self, delivery_address):
+    def __init__(self, delivery_address, email=None):
         """
         Initializes a UserProfile object with a delivery address.
         
         Args:
             delivery_address (str): The user's delivery address.
+            email (str, optional): The user's email address.
         """
         self.delivery_address = delivery_address
+        self.email = email
 
 
 # RestaurantMenu Class (for simulating available menu items)
@@ -255,29 +1086,80 @@ class RestaurantMenu:
     """
     Represents the restaurant's menu, including available items.
     
+    Availability is answered from a frozenset of item names, optionally narrowed by per-item stock
+    counts, so a lookup takes constant time however long the menu is.
+    
     Attributes:
-        available_items (list): A list of items available on the restaurant's menu.
+        available_items (tuple): The items available on the restaurant's menu. It cannot be changed in place;
+                                 assigning a new sequence rebuilds the lookup set.
+        stock (dict): The number of portions left, by item name. Items without an entry are not limited.
     """
-    def __init__(self, available_items):
+    def __init__(self, available_items, stock=None, prices=None):
         """
         Initializes a RestaurantMenu with a list of available items.
         
         Args:
             available_items (list): A list of available menu items.
+            stock (dict, optional): The number of portions left, by item name.
+            prices (dict, optional): The price of each item in dollars, by item name.
         """
         self.available_items = available_items
+        self.stock = dict(stock or {})
+        self._prices = {name: Money.from_amount(price) for name, price in (prices or {}).items()}
 
-    def is_item_available(self, item_name):
+    @property
+    def available_items(self):
+        """
+        tuple: The items available on the restaurant's menu.
+        """
+        return self._available_items
+
+    @available_items.setter
+    def available_items(self, available_items):
+        self._available_items = tuple(available_items)
+        self._item_set = frozenset(self._available_items)
+
+    def is_item_available(self, item_name, quantity=1):
         """
         Checks if a specific item is available in the restaurant's menu.
         
         Args:
             item_name (str): The name of the item to check.
+            quantity (int, optional): The number of portions needed.
         
         Returns:
             bool: True if the item is available, False otherwise.
         """
-        return item_name in self.available_items
+        if item_name not in self._item_set:
+            return False
+        remaining = self.stock.get(item_name)
+        return remaining is None or remaining >= quantity
+
+    def find_unavailable_items(self, quantities):
+        """
+        Checks a whole order against the menu in one pass.
+        
+        Args:
+            quantities (dict): The number of portions needed, by item name.
+        
+        Returns:
+            list: The names of the items that are not on the menu or not in stock, in the order given.
+        """
+        item_set, stock = self._item_set, self.stock
+        return [name for name, quantity in quantities.items()
+                if name not in item_set or stock.get(name, quantity) < quantity]
+
+    def get_price(self, item_name):
+        """
+        Looks up the menu price of an item.
+        
+        Args:
+            item_name (str): The name of the item.
+        
+        Returns:
+            Money: The price, or None if the menu has no price for the item.
+        """
+        return self._prices.get(item_name)
 
 
 # Unit tests for OrderPlacement class
@@ -320,6 +1202,119 @@ class TestOrderPlacement(unittest.TestCase):
         self.assertTrue(result["success"])
         self.assertEqual(result["message"], "Order is valid")
 
+    def test_cart_keeps_running_totals(self):
+        """
+        Test case for the cart's running subtotal as items are added, updated, and removed.
+        """
+        self.cart.add_item("Burger", 8.50, 2)
+        self.cart.add_item("Salad", 6.00, 1)
+        self.assertEqual(self.cart.add_item("Burger", 8.50, 1), "Updated Burger quantity to 3")
+        self.assertEqual(self.cart.calculate_total()["subtotal"], 31.50)
+
+        self.cart.update_item_quantity("Salad", 3)
+        self.assertEqual(self.cart.calculate_total()["subtotal"], 43.50)
+        self.assertEqual(self.cart.update_item_quantity("Pizza", 1), "Pizza not found in cart")
+
+        self.cart.remove_item("Burger")
+        self.assertEqual([item.name for item in self.cart.items], ["Salad"])
+        self.assertEqual(self.cart.calculate_total()["total"], 18.00 + 1.80 + 5.00)
+
+        self.cart.remove_item("Salad")
+        self.assertEqual(self.cart.calculate_total()["subtotal"], 0.0)
+
+    def test_cart_items_are_snapshots(self):
+        """
+        Test that changing an item returned by Cart.items leaves the cart and its running subtotal alone.
+        """
+        for cart in (Cart(), ArrayCart()):
+            cart.add_item("Burger", 8.50, 2)
+            item = cart.items[0]
+            item.update_quantity(10)
+            item.price = 1.00
+            self.assertEqual(cart.get_quantities(), {"Burger": 2})
+            self.assertEqual(cart.calculate_total()["subtotal"], 17.00)
+            self.assertEqual(cart.get_subtotal_cents(), sum(item.get_subtotal_cents() for item in cart.items))
+
+    def test_cart_totals_are_exact(self):
+        """
+        Test case for exact cent totals and configurable rounding of the tax.
+        """
+        for _ in range(10):
+            self.cart.add_item("Salad", 0.10, 1)
+        totals = self.cart.calculate_total_money()
+        self.assertEqual(totals["subtotal"], Money(100))
+        self.assertEqual(totals["total"], Money(610))
+
+        cart = Cart(rounding="ROUND_HALF_EVEN")
+        cart.add_item("Burger", 0.25, 1)  # 10% tax is 2.5 cents.
+        self.assertEqual(cart.calculate_total_money()["tax"], Money(2))
+        self.assertEqual(Cart().calculate_total_money()["tax"], Money(0))
+        self.assertEqual(self.cart.calculate_total()["total"], 6.10)
+        self.assertEqual(self.cart.calculate_total_cents(), {"subtotal": 100, "tax": 10, "delivery_fee": 500,
+                                                             "total": 610})
+        cart.tax_rate = "0.0825"
+        self.assertEqual(cart.calculate_total_cents()["tax"], 2)  # 2.0625 cents.
+
+    def test_array_cart_matches_cart(self):
+        """
+        Test case for the struct-of-arrays cart giving the same results as the default cart.
+        """
+        array_cart = ArrayCart()
+        for cart in (self.cart, array_cart):
+            cart.add_item("Burger", 8.99, 2)
+            cart.add_item("Pizza", 12.99, 1)
+            cart.add_item("Salad", 6.50, 1)
+            cart.add_item("Burger", 8.99, 1)
+            cart.update_item_quantity("Salad", 2)
+            cart.remove_item("Pizza")
+        self.assertEqual(array_cart.calculate_total_money(), self.cart.calculate_total_money())
+        self.assertEqual(sorted(item["name"] for item in array_cart.view_cart()), ["Burger", "Salad"])
+        self.assertEqual(array_cart.update_item_quantity("Pizza", 1), "Pizza not found in cart")
+
+        order = OrderPlacement(array_cart, self.user_profile, self.restaurant_menu)
+        self.assertTrue(order.validate_order()["success"])
+
+    def test_cart_item_has_no_instance_dict(self):
+        """
+        Test case for CartItem using __slots__ rather than a per-instance dictionary.
+        """
+        item = CartItem("Burger", 8.99, 1)
+        self.assertFalse(hasattr(item, "__dict__"))
+        self.assertEqual(item.price, 8.99)
+
+    def test_validate_order_report_all(self):
+        """
+        Test case for validating the whole cart at once and reporting every unavailable item.
+        """
+        menu = RestaurantMenu(available_items=["Burger", "Pizza", "Salad"], stock={"Pizza": 1},
+                              prices={"Burger": 8.99})
+        order = OrderPlacement(self.cart, self.user_profile, menu)
+        self.cart.add_item("Pasta", 15.99, 1)
+        self.cart.add_item("Burger", 8.99, 3)
+        self.cart.add_item("Pizza", 12.99, 2)
+        self.cart.add_item("Soup", 4.99, 1)
+
+        result = order.validate_order(report_all=True)
+        self.assertFalse(result["success"])
+        self.assertEqual(result["unavailable_items"], ["Pasta", "Pizza", "Soup"])
+        self.assertEqual(result["message"], "Pasta, Pizza, Soup are not available")
+        self.assertEqual(order.validate_order()["message"], "Pasta is not available")
+
+        self.cart.remove_item("Pasta")
+        self.cart.remove_item("Soup")
+        self.cart.update_item_quantity("Pizza", 1)
+        self.assertEqual(order.validate_order(report_all=True), {"success": True, "message": "Order is valid"})
+        self.assertEqual(menu.get_price("Burger"), Money(899))
+        self.assertIsNone(menu.get_price("Salad"))
+
+        # The item list cannot drift from the lookup set: it is a tuple, and assigning a new one rebuilds the set.
+        with self.assertRaises(AttributeError):
+            menu.available_items.append("Pasta")
+        menu.available_items = ["Burger", "Pasta"]
+        self.assertEqual(menu.available_items, ("Burger", "Pasta"))
+        self.assertTrue(menu.is_item_available("Pasta"))
+        self.assertFalse(menu.is_item_available("Salad"))
+
     def test_confirm_order_success(self):
         """
         Test case for confirming an order with successful payment.
@@ -329,7 +1324,166 @@ class TestOrderPlacement(unittest.TestCase):
         result = self.order.confirm_order(payment_method)
         self.assertTrue(result["success"])
         self.assertEqual(result["message"], "Order confirmed")
-        self.assertEqual(result["order_id"], "ORD123456")
+        self.assertRegex(result["order_id"], r"^ORD[0-9A-HJKMNP-TV-Z]{26}$")
+
+        second = self.order.confirm_order(payment_method)
+        self.assertGreater(second["order_id"], result["order_id"])  # IDs are unique and sort by creation.
+
+    def test_confirm_orders_batch(self):
+        """
+        Test case for confirming a batch of orders across payment methods, with results in input order.
+        """
+        def order_with(*items):
+            cart = Cart()
+            for name, price in items:
+                cart.add_item(name, price, 1)
+            return OrderPlacement(cart, self.user_profile, self.restaurant_menu)
+
+        card = PaymentMethod()
+        wallet = mock.Mock(spec=["process_payments"],
+                           **{"process_payments.side_effect": lambda amounts: [True] * len(amounts)})
+        batch = [
+            (order_with(("Burger", 8.99)), card),
+            (order_with(("Pasta", 15.99)), card),  # Not on the menu.
+            (order_with(("Pizza", 12.99)), wallet),
+            (order_with(("Salad", 6.50)), card),
+            (order_with(), wallet),  # Empty cart.
+        ]
+        with mock.patch.object(card, "process_payments", wraps=card.process_payments) as card_batch:
+            results = OrderPlacement.confirm_orders(batch)
+        card_batch.assert_called_once()  # One call for both of the card's payments.
+        self.assertEqual(len(card_batch.call_args.args[0]), 2)
+        self.assertEqual([result["success"] for result in results], [True, False, True, True, False])
+        self.assertEqual(results[1], {"success": False, "message": "Order validation failed",
+                                      "unavailable_items": ["Pasta"]})
+        self.assertEqual(results[1], batch[1][0].confirm_order(PaymentMethod()))  # The same shape as one by one.
+
+        wallet.process_payments.side_effect = RuntimeError("gateway down")
+        results = OrderPlacement.confirm_orders(batch)
+        self.assertEqual([result["message"] for result in results],
+                         ["Order confirmed", "Order validation failed", "Payment failed", "Order confirmed",
+                          "Order validation failed"])
+
+        wallet.process_payments.side_effect = lambda amounts: [True]  # One outcome short.
+        results = OrderPlacement.confirm_orders([(order_with(("Burger", 8.99)), wallet)] * 2)
+        self.assertEqual(results, [{"success": False, "message": "Payment failed"}] * 2)
+
+        single = mock.Mock(spec=["process_payment"], **{"process_payment.return_value": True})
+        results = OrderPlacement.confirm_orders([(order_with(("Burger", 8.99)), single)] * 3)
+        self.assertTrue(all(result["success"] for result in results))
+        self.assertEqual(single.process_payment.call_count, 3)  # No batch method, so one call per payment.
+
+        # Chunks of one gateway's payments run at the same time: each payment waits for the other.
+        barrier = threading.Barrier(2, timeout=5)
+        both = [mock.Mock(spec=["process_payment"],
+                          **{"process_payment.side_effect": lambda amount: barrier.wait() >= 0})
+                for _ in range(2)]
+        results = OrderPlacement.confirm_orders([(order_with(("Burger", 8.99)), method) for method in both],
+                                                chunk_size=1)
+        self.assertTrue(all(result["success"] for result in results))
+        self.assertNotEqual(PaymentMethod(), PaymentMethod())  # Payment methods compare by identity.
+
+    def test_confirm_order_async(self):
+        """
+        Test case for confirming orders on an event loop with asynchronous and blocking payment methods.
+        """
+        self.cart.add_item("Burger", 10.00, 2)
+        blocking = mock.Mock(spec=["process_payment"], **{"process_payment.return_value": True})
+
+        async def confirm_all():
+            return await asyncio.gather(self.order.confirm_order_async(PaymentMethod()),
+                                        self.order.confirm_order_async(blocking))
+
+        paid, paid_blocking = asyncio.run(confirm_all())
+        self.assertTrue(paid["success"])
+        self.assertTrue(paid_blocking["success"])
+        self.assertNotEqual(paid["order_id"], paid_blocking["order_id"])
+        blocking.process_payment.assert_called_once_with(Money(2700))  # $20 + 10% tax + $5 delivery.
+
+        empty = OrderPlacement(Cart(), self.user_profile, self.restaurant_menu)
+        self.assertEqual(asyncio.run(empty.confirm_order_async(PaymentMethod()))["message"], "Order validation failed")
+
+    def test_confirmed_orders_are_persisted(self):
+        """
+        Test case for confirmed orders, single and batched, being written to the order store.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            store = OrderStore(os.path.join(directory, "orders.log"), fsync=False)
+            user = UserProfile("123 Main St", email="ada@example.com")
+            self.cart.add_item("Burger", 10.00, 2)
+            order = OrderPlacement(self.cart, user, self.restaurant_menu, order_store=store)
+
+            result = order.confirm_order(PaymentMethod())
+            self.assertEqual(store.get(result["order_id"])["total_cents"], 2700)
+            self.assertEqual(store.get(result["order_id"])["items"],
+                             [{"name": "Burger", "price_cents": 1000, "quantity": 2}])
+
+            results = OrderPlacement.confirm_orders([(order, PaymentMethod()), (order, PaymentMethod())])
+            self.assertEqual([record["order_id"] for record in store.recent_orders("ada@example.com")],
+                             [results[1]["order_id"], results[0]["order_id"], result["order_id"]])
+            store.close()
+
+    def test_paid_orders_are_confirmed_when_the_store_fails(self):
+        """
+        Test case for a paid order keeping its confirmation when it cannot be written to the order store.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            store = OrderStore(os.path.join(directory, "orders.log"), fsync=False)
+            store.close()
+            user = mock.Mock(spec=["delivery_address"], delivery_address="123 Main St")  # No email attribute.
+            self.cart.add_item("Burger", 10.00, 2)
+            order = OrderPlacement(self.cart, user, self.restaurant_menu, order_store=store)
+
+            result = order.confirm_order(PaymentMethod())
+            self.assertTrue(result["success"])
+            self.assertIn("order_id", result)
+            self.assertFalse(result["persisted"])
+
+            results = OrderPlacement.confirm_orders([(order, PaymentMethod()), (order, PaymentMethod())])
+            self.assertEqual([result["success"] for result in results], [True, True])
+            self.assertEqual([result["persisted"] for result in results], [False, False])
+            self.assertEqual(len({result["order_id"] for result in results}), 2)
+
+    def test_order_ids_are_unique_and_time_ordered(self):
+        """
+        Test case for order IDs staying unique across threads and sorting by creation time.
+        """
+        generator = OrderIdGenerator()
+        per_thread = []
+
+        def generate():
+            per_thread.append([generator.next_id() for _ in range(2000)])
+
+        threads = [threading.Thread(target=generate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for ids in per_thread:
+            self.assertEqual(ids, sorted(ids))  # Strictly increasing within a thread.
+        self.assertEqual(len({order_id for ids in per_thread for order_id in ids}), 8000)
+
+        clock = mock.Mock(side_effect=[5_000_000_000, 4_000_000_000, 6_000_000_000])
+        generator = OrderIdGenerator(prefix="T", clock=clock)
+        first, second, third = generator.next_id(), generator.next_id(), generator.next_id()
+        self.assertLess(first, second)  # Still increasing although the clock stepped back.
+        self.assertEqual(generator.timestamp_of(first), 5000)
+        self.assertTrue(generator.lower_bound(5001) < third)
+        self.assertTrue(second < generator.lower_bound(5001))
+
+    def test_order_id_generators_are_reset_after_fork_and_not_kept_alive(self):
+        """
+        Test case for the shared fork hook resetting live generators without holding on to dropped ones.
+        """
+        generator = OrderIdGenerator()
+        generator.next_id()
+        OrderIdGenerator._reset_all()  # What a forked child runs.
+        self.assertFalse(hasattr(generator._local, "last"))
+
+        dropped = weakref.ref(OrderIdGenerator())
+        gc.collect()
+        self.assertIsNone(dropped())
+        self.assertIn(generator, OrderIdGenerator._generators)
 
     def test_confirm_order_failed_payment(self):
         """
@@ -345,5 +1499,111 @@ class TestOrderPlacement(unittest.TestCase):
             self.assertEqual(result["message"], "Payment failed")
 
 
+# Unit tests for OrderStore class
+class TestOrderStore(unittest.TestCase):
+    """
+    Unit tests for the write-ahead-logged order store and its indexes.
+    """
+    def setUp(self):
+        """
+        Sets up an order store in a temporary directory.
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "orders.log")
+        self.store = OrderStore(self.path)
+
+    def tearDown(self):
+        """
+        Closes the store and removes its directory.
+        """
+        self.store.close()
+        self.directory.cleanup()
+
+    def order(self, number, email="ada@example.com", created_at=None):
+        """
+        Builds a minimal order record.
+        """
+        created_at = 1000 * number if created_at is None else created_at
+        return {"order_id": f"ORD{number:04d}", "email": email, "created_at": created_at}
+
+    def test_indexed_reads(self):
+        """
+        Test case for reading orders by id, by user (newest first), and by time range.
+        """
+        for number in range(1, 31):
+            self.store.append(self.order(number, email="ada@example.com" if number % 3 else "bob@example.com"))
+        self.assertEqual(self.store.get("ORD0007")["created_at"], 7000)
+        self.assertIsNone(self.store.get("ORD9999"))
+        recent = self.store.recent_orders("ada@example.com", limit=3)
+        self.assertEqual([record["order_id"] for record in recent], ["ORD0029", "ORD0028", "ORD0026"])
+        self.assertEqual(len(self.store.recent_orders("bob@example.com")), 10)
+        self.assertEqual([record["order_id"] for record in self.store.orders_between(5000, 8000)],
+                         ["ORD0005", "ORD0006", "ORD0007"])
+        self.assertEqual(len(self.store.orders_between(29000)), 2)
+
+        self.store.append(self.order(31, created_at=6500))  # Out of time order, e.g. after a clock step.
+        self.assertEqual([record["order_id"] for record in self.store.orders_between(6000, 7000)],
+                         ["ORD0006", "ORD0031"])
+        with self.assertRaises(ValueError):
+            self.store.append(self.order(31))
+
+    def test_recovery_after_restart_and_torn_write(self):
+        """
+        Test case for reopening the log, and for dropping a half-written last line.
+        """
+        self.store.append_many([self.order(1), self.order(2)])
+        self.store.close()
+        with open(self.path, "ab") as log:
+            log.write(OrderStore._encode(self.order(3))[:-10])  # A crash part-way through a write.
+
+        self.store = OrderStore(self.path)
+        self.assertEqual(len(self.store), 2)
+        self.store.append(self.order(3))
+        self.store.close()
+
+        self.store = OrderStore(self.path)
+        self.assertEqual([record["order_id"] for record in self.store.orders_between(0)],
+                         ["ORD0001", "ORD0002", "ORD0003"])
+
+    def test_concurrent_writers_share_commits(self):
+        """
+        Test case for orders written at the same time being committed together.
+        """
+        threads = [threading.Thread(target=self.store.append, args=(self.order(number),)) for number in range(1, 65)]
+        with mock.patch.object(os, "fsync", side_effect=lambda fd: time.sleep(0.005)):  # A disk-like sync time.
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(self.store), 64)
+        self.assertLess(self.store.commits, 64)
+
+    def test_duplicate_ids_in_a_batch_or_queue_are_rejected(self):
+        """
+        Test case for an order id repeated within a batch, or matching an order still being written, being rejected.
+        """
+        with self.assertRaises(ValueError):
+            self.store.append_many([self.order(1), self.order(2), self.order(1)])
+        self.assertEqual(len(self.store), 0)
+
+        syncing, release = threading.Event(), threading.Event()
+
+        def slow_fsync(fd):
+            syncing.set()
+            release.wait(5)
+
+        with mock.patch.object(os, "fsync", side_effect=slow_fsync):
+            writer = threading.Thread(target=self.store.append, args=(self.order(1),))
+            writer.start()
+            self.assertTrue(syncing.wait(5))  # ORD0001 is written but not yet durable.
+            with self.assertRaises(ValueError):
+                self.store.append_many([self.order(2), self.order(1)])
+            release.set()
+            writer.join()
+        self.assertEqual([record["order_id"] for record in self.store.orders_between(0)], ["ORD0001"])
+        self.store.append(self.order(2))
+        self.assertEqual(len(self.store), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
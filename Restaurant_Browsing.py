@@ -1,140 +1,1618 @@
+import bisect
+import heapq
+import itertools
+import math
+import re
+import sys
+import time
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; VectorizedFilterEngine falls back to pure Python without it.
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088  # Mean Earth radius.
+KM_PER_DEGREE_LATITUDE = math.pi * EARTH_RADIUS_KM / 180
+
+
+TEXT_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Split text into lower-cased alphanumeric search terms.
+    
+    Args:
+        text (str): The text to split (e.g., a restaurant name or a search query).
+    
+    Returns:
+        list: The terms in the order they appear.
+    """
+    return TEXT_TOKEN_PATTERN.findall(text.lower())
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great-circle distance between two points given in degrees.
+    
+    Args:
+        lat1 (float): Latitude of the first point.
+        lon1 (float): Longitude of the first point.
+        lat2 (float): Latitude of the second point.
+        lon2 (float): Longitude of the second point.
+    
+    Returns:
+        float: The distance in kilometres.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    half_dphi = (phi2 - phi1) / 2
+    half_dlambda = math.radians(lon2 - lon1) / 2
+    a = math.sin(half_dphi) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(half_dlambda) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
 class RestaurantBrowsing:
     """
-    A class for browsing restaurants in a database based on various criteria like cuisine type, location, and rating.
+    A class for browsing restaurants in a database based on various criteria like cuisine type, location, and rating.
+    
+    Attributes:
+        database (RestaurantDatabase): An instance of RestaurantDatabase that holds restaurant data.
+        engine (VectorizedFilterEngine): An optional engine that evaluates search_by_filters as a full scan.
+    """
+
+    def __init__(self, database, engine=None):
+        """
+        Initialize RestaurantBrowsing with a reference to a restaurant database.
+        
+        Args:
+            database (RestaurantDatabase): The database object containing restaurant information.
+            engine (VectorizedFilterEngine, optional): An engine to answer search_by_filters with, suited to
+                                                       bulk queries that touch most of the catalog.
+        """
+        self.database = database
+        self.engine = engine
+
+    def search_by_cuisine(self, cuisine_type, limit=None, cursor=None):
+        """
+        Search for restaurants based on their cuisine type.
+        
+        Args:
+            cuisine_type (str): The type of cuisine to filter by (e.g., "Italian").
+            limit (int, optional): The page size. When given, a single page is returned (see search_by_filters).
+            cursor (int, optional): The cursor returned with the previous page.
+        
+        Returns:
+            list: A list of restaurants that match the given cuisine type, or a page dictionary when limit is given.
+        """
+        if limit is not None:
+            return self.search_by_filters(cuisine_type=cuisine_type, limit=limit, cursor=cursor)
+        row_ids = self.database.get_ids_by_cuisine(cuisine_type)
+        return self.database.get_restaurants_by_ids(row_ids)
+
+    def search_by_location(self, location, limit=None, cursor=None):
+        """
+        Search for restaurants based on their location.
+        
+        Args:
+            location (str): The location to filter by (e.g., "Downtown").
+            limit (int, optional): The page size. When given, a single page is returned (see search_by_filters).
+            cursor (int, optional): The cursor returned with the previous page.
+        
+        Returns:
+            list: A list of restaurants that are located in the specified area, or a page dictionary when limit is given.
+        """
+        if limit is not None:
+            return self.search_by_filters(location=location, limit=limit, cursor=cursor)
+        row_ids = self.database.get_ids_by_location(location)
+        return self.database.get_restaurants_by_ids(row_ids)
+
+    def search_by_rating(self, min_rating, limit=None, cursor=None):
+        """
+        Search for restaurants based on their minimum rating.
+        
+        Args:
+            min_rating (float): The minimum acceptable rating to filter by (e.g., 4.0).
+            limit (int, optional): The page size. When given, a single page is returned (see search_by_filters).
+            cursor (int, optional): The cursor returned with the previous page.
+        
+        Returns:
+            list: A list of restaurants that have a rating greater than or equal to the specified rating, or a page
+                  dictionary when limit is given.
+        """
+        if limit is not None:
+            return self.search_by_filters(min_rating=min_rating, limit=limit, cursor=cursor)
+        row_ids = self.database.get_ids_by_rating(min_rating=min_rating)
+        return self.database.get_restaurants_by_ids(row_ids)
+
+    def search_by_rating_range(self, min_rating, max_rating):
+        """
+        Search for restaurants whose rating falls within an inclusive range.
+        
+        Args:
+            min_rating (float): The lowest acceptable rating (e.g., 4.0).
+            max_rating (float): The highest acceptable rating (e.g., 4.5).
+        
+        Returns:
+            list: A list of restaurants rated between min_rating and max_rating, inclusive.
+        """
+        row_ids = self.database.get_ids_by_rating(min_rating=min_rating, max_rating=max_rating)
+        return self.database.get_restaurants_by_ids(row_ids)
+
+    def search_top_rated(self, limit, cuisine_type=None, location=None):
+        """
+        Find the best rated restaurants, optionally restricted to a cuisine type and/or location.
+        
+        The rating index is walked from the highest rating down and the walk stops as soon as enough
+        matches are found, so the catalog is never sorted as a whole.
+        
+        Args:
+            limit (int): The maximum number of restaurants to return.
+            cuisine_type (str, optional): The type of cuisine to filter by.
+            location (str, optional): The location to filter by.
+        
+        Returns:
+            list: Up to `limit` restaurants ordered from the highest rating to the lowest.
+        """
+        candidates = None
+        if cuisine_type:
+            candidates = self.database.get_ids_by_cuisine(cuisine_type)
+        if location:
+            location_ids = self.database.get_ids_by_location(location)
+            candidates = location_ids if candidates is None else candidates & location_ids
+
+        row_ids = []
+        if limit > 0 and candidates != set():
+            for row_id in self.database.iter_ids_by_rating_desc():
+                if candidates is None or row_id in candidates:
+                    row_ids.append(row_id)
+                    if len(row_ids) == limit:
+                        break
+        return [self.database.get_restaurant(row_id) for row_id in row_ids]
+
+    def search_text(self, query, limit=10):
+        """
+        Search restaurant names, cuisines, and dishes for the words in a query, best matches first.
+        
+        Every word must match. The last word also matches as a prefix, so results can be shown while
+        the user is still typing it. Matches in the name rank above matches in the cuisine, which rank
+        above matches in a dish, and whole-word matches rank above prefix matches.
+        
+        Args:
+            query (str): The search text (e.g., "chicken quesa").
+            limit (int, optional): The maximum number of restaurants to return.
+        
+        Returns:
+            list: Up to `limit` matching restaurants, ordered from the best match to the worst.
+        """
+        return [self.database.get_restaurant(row_id) for _, row_id in self.database.get_text_matches(query, limit)]
+
+    def suggest_terms(self, prefix, limit=10):
+        """
+        Suggest indexed words that start with a prefix, for typeahead.
+        
+        Args:
+            prefix (str): The start of a word.
+            limit (int, optional): The maximum number of suggestions.
+        
+        Returns:
+            list: Up to `limit` lower-cased words, in alphabetical order.
+        """
+        return self.database.get_terms_with_prefix(prefix, limit)
+
+    def search_nearby(self, lat, lon, radius_km, limit=None):
+        """
+        Search for restaurants within a distance of a point, closest first.
+        
+        Only restaurants that carry "lat" and "lon" coordinates are considered.
+        
+        Args:
+            lat (float): Latitude of the point, in degrees.
+            lon (float): Longitude of the point, in degrees.
+            radius_km (float): The maximum distance, in kilometres.
+            limit (int, optional): The maximum number of restaurants to return.
+        
+        Returns:
+            list: The restaurants within the radius, ordered from the closest to the farthest.
+        """
+        matches = self.database.get_ids_within(lat, lon, radius_km)
+        if limit is not None:
+            matches = matches[:limit]
+        return [self.database.get_restaurant(row_id) for _, row_id in matches]
+
+    def search_nearest(self, lat, lon, k):
+        """
+        Find the k restaurants closest to a point, however far away they are.
+        
+        Args:
+            lat (float): Latitude of the point, in degrees.
+            lon (float): Longitude of the point, in degrees.
+            k (int): The number of restaurants to return.
+        
+        Returns:
+            list: Up to k restaurants, ordered from the closest to the farthest.
+        """
+        return [self.database.get_restaurant(row_id) for _, row_id in self.database.get_nearest_ids(lat, lon, k)]
+
+    def search_by_filters(self, cuisine_type=None, location=None, min_rating=None, limit=None, cursor=None):
+        """
+        Search for restaurants based on multiple filters: cuisine type, location, and/or rating.
+        
+        The most selective filter, as estimated by plan_filters, picks the candidate restaurants from its
+        index. The remaining filters are then checked in a single pass over those candidates. When an
+        engine was given, unpaged searches are delegated to it instead.
+        
+        When a limit is given, only one page of results is built and scanning stops as soon as it is full.
+        Passing the returned cursor back in resumes the search where the page ended.
+        
+        Args:
+            cuisine_type (str, optional): The type of cuisine to filter by.
+            location (str, optional): The location to filter by.
+            min_rating (float, optional): The minimum acceptable rating to filter by.
+            limit (int, optional): The page size.
+            cursor (int, optional): The cursor returned with the previous page.
+        
+        Returns:
+            list: A list of restaurants that match all specified filters, when no limit is given.
+            dict: {"results": [...], "next_cursor": ...} when a limit is given. "next_cursor" is None on the
+                  last page.
+        
+        Raises:
+            ValueError: If the limit is not a positive number.
+        """
+        if limit is None:
+            if self.engine is not None:
+                return self.engine.search(cuisine_type=cuisine_type, location=location, min_rating=min_rating)
+            if not (cuisine_type or location or min_rating):
+                # No filters, so every restaurant matches; iter_rows keeps add order even after swap-removals.
+                return [restaurant for _, restaurant in self.database.iter_rows()]
+            return [restaurant for _, restaurant in self._iter_matches(cuisine_type, location, min_rating)]
+
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+        matches = self._iter_matches(cuisine_type, location, min_rating, after=cursor)
+        page = list(itertools.islice(matches, limit))
+        # Only look one match ahead, to tell whether another page exists.
+        next_cursor = page[-1][0] if page and next(matches, None) is not None else None
+        return {"results": [restaurant for _, restaurant in page], "next_cursor": next_cursor}
+
+    def iter_by_filters(self, cuisine_type=None, location=None, min_rating=None, cursor=None):
+        """
+        Stream the restaurants that match every given filter, one at a time, without building a result list.
+        
+        Args:
+            cuisine_type (str, optional): The type of cuisine to filter by.
+            location (str, optional): The location to filter by.
+            min_rating (float, optional): The minimum acceptable rating to filter by.
+            cursor (int, optional): A cursor from search_by_filters to resume after.
+        
+        Yields:
+            dict: The next matching restaurant, in the order restaurants were added.
+        """
+        for _, restaurant in self._iter_matches(cuisine_type, location, min_rating, after=cursor):
+            yield restaurant
+
+    def _iter_matches(self, cuisine_type, location, min_rating, after=None):
+        """
+        Yield (row id, restaurant) pairs that match every filter, in row id order, after the given row id.
+        """
+        plan = self.plan_filters(cuisine_type=cuisine_type, location=location, min_rating=min_rating)
+        if not plan:
+            for row_id in self.database.iter_row_ids(after=after):
+                yield row_id, self.database.get_restaurant(row_id)
+            return
+
+        estimate, driver = plan[0]
+        if estimate == 0:
+            return  # The most selective filter matches nothing, so neither can the combination.
+
+        # Seek straight to the cursor and produce candidates lazily, so a page only pays for the rows it reads.
+        if driver == "cuisine":
+            row_ids = self.database.iter_ids_by_cuisine(cuisine_type, after=after)
+        elif driver == "location":
+            row_ids = self.database.iter_ids_by_location(location, after=after)
+        else:
+            row_ids = self.database.iter_ids_by_rating(min_rating, after=after)
+
+        # Lower-case the remaining search terms once, rather than once per candidate.
+        cuisine_key = cuisine_type.lower() if cuisine_type and driver != "cuisine" else None
+        location_key = location.lower() if location and driver != "location" else None
+        rating_bound = min_rating if min_rating and driver != "rating" else None
+
+        for row_id in row_ids:
+            restaurant = self.database.get_restaurant(row_id)
+            if cuisine_key is not None and restaurant['cuisine'].lower() != cuisine_key:
+                continue
+            if location_key is not None and restaurant['location'].lower() != location_key:
+                continue
+            if rating_bound is not None and restaurant['rating'] < rating_bound:
+                continue
+            yield row_id, restaurant
+
+    def plan_filters(self, cuisine_type=None, location=None, min_rating=None):
+        """
+        Estimate how many restaurants each given filter matches and order the filters by selectivity.
+        
+        Args:
+            cuisine_type (str, optional): The type of cuisine to filter by.
+            location (str, optional): The location to filter by.
+            min_rating (float, optional): The minimum acceptable rating to filter by.
+        
+        Returns:
+            list: (estimated matches, filter name) pairs, most selective first. Filter names are
+                  "cuisine", "location", and "rating".
+        """
+        plan = []
+        if cuisine_type:
+            plan.append((self.database.count_by_cuisine(cuisine_type), "cuisine"))
+        if location:
+            plan.append((self.database.count_by_location(location), "location"))
+        if min_rating:
+            plan.append((self.database.count_by_rating(min_rating=min_rating), "rating"))
+        plan.sort()
+        return plan
+
+
+class SortedIndexList:
+    """
+    A sorted list split into bounded chunks, so inserts and removals only shift one chunk.
+    
+    Items are located with a binary search over the chunk maxima followed by one inside the chunk,
+    which keeps additions and removals close to O(log n) rather than the O(n) shift of a flat list.
+    
+    Attributes:
+        CHUNK_SIZE (int): The target number of items per chunk. A chunk is split when it doubles.
+    """
+
+    CHUNK_SIZE = 512
+
+    def __init__(self):
+        """
+        Initialize an empty SortedIndexList.
+        """
+        self._chunks = []
+        self._maxes = []  # The last (largest) item of every chunk.
+        self._len = 0
+
+    def __len__(self):
+        """
+        Returns:
+            int: The number of items.
+        """
+        return self._len
+
+    def __iter__(self):
+        """
+        Yields:
+            The items in ascending order.
+        """
+        for chunk in self._chunks:
+            yield from chunk
+
+    def add(self, item):
+        """
+        Insert an item in sorted position.
+        
+        Args:
+            item: The item to insert. It must be comparable with the other items.
+        """
+        if not self._chunks:
+            self._chunks.append([item])
+            self._maxes.append(item)
+            self._len = 1
+            return
+        index = min(bisect.bisect_left(self._maxes, item), len(self._chunks) - 1)
+        chunk = self._chunks[index]
+        bisect.insort(chunk, item)
+        self._maxes[index] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            tail = chunk[self.CHUNK_SIZE:]
+            del chunk[self.CHUNK_SIZE:]
+            self._chunks.insert(index + 1, tail)
+            self._maxes[index] = chunk[-1]
+            self._maxes.insert(index + 1, tail[-1])
+        self._len += 1
+
+    def discard(self, item):
+        """
+        Remove one occurrence of an item, if present.
+        
+        Args:
+            item: The item to remove.
+        
+        Returns:
+            bool: True if the item was found and removed.
+        """
+        index = bisect.bisect_left(self._maxes, item)
+        if index == len(self._chunks):
+            return False
+        chunk = self._chunks[index]
+        position = bisect.bisect_left(chunk, item)
+        if chunk[position] != item:
+            return False
+        del chunk[position]
+        if chunk:
+            self._maxes[index] = chunk[-1]
+        else:
+            del self._chunks[index]
+            del self._maxes[index]
+        self._len -= 1
+        return True
+
+    def bisect_left(self, item):
+        """
+        Returns:
+            int: The position of the first item that is not less than the given item.
+        """
+        index = bisect.bisect_left(self._maxes, item)
+        if index == len(self._chunks):
+            return self._len
+        return self._offset(index) + bisect.bisect_left(self._chunks[index], item)
+
+    def bisect_right(self, item):
+        """
+        Returns:
+            int: The position of the first item that is greater than the given item.
+        """
+        index = bisect.bisect_right(self._maxes, item)
+        if index == len(self._chunks):
+            return self._len
+        return self._offset(index) + bisect.bisect_right(self._chunks[index], item)
+
+    def islice(self, start=0, stop=None):
+        """
+        Iterate over the items between two positions.
+        
+        Args:
+            start (int, optional): The position of the first item.
+            stop (int, optional): The position to stop before. Defaults to the end of the list.
+        
+        Yields:
+            The items from position start up to, but excluding, position stop.
+        """
+        stop = self._len if stop is None else min(stop, self._len)
+        offset = 0
+        for chunk in self._chunks:
+            if offset >= stop:
+                return
+            if offset + len(chunk) > start:
+                yield from chunk[max(0, start - offset):stop - offset]
+            offset += len(chunk)
+
+    def iter_after(self, item=None):
+        """
+        Iterate over the items greater than a given item, seeking to the first one by binary search.
+        
+        Args:
+            item (optional): The item to start after. Iterates over every item when omitted.
+        
+        Yields:
+            The items greater than the given item, in ascending order.
+        """
+        index = 0 if item is None else bisect.bisect_right(self._maxes, item)
+        if index < len(self._chunks) and item is not None:
+            chunk = self._chunks[index]
+            yield from chunk[bisect.bisect_right(chunk, item):]
+            index += 1
+        for chunk in itertools.islice(self._chunks, index, None):
+            yield from chunk
+
+    def _offset(self, index):
+        """
+        Count the items in the chunks before a chunk.
+        """
+        return sum(map(len, itertools.islice(self._chunks, index)))
+
+
+class RestaurantDatabase:
+    """
+    A simulated in-memory database that stores restaurant information.
+    
+    Every restaurant is assigned an integer row id when it is added. Case-folded secondary indexes map
+    each cuisine and location to the row ids that carry it, so equality lookups do not scan the catalog.
+    A rating index kept sorted from the highest rating to the lowest answers rating range and top-k
+    queries with a binary search. Restaurants that carry "lat" and "lon" coordinates are also placed in
+    a grid of GEO_CELL_DEGREES-wide cells, so proximity queries only visit the cells around the point.
+    Longitudes are not wrapped at the antimeridian. An inverted index maps every word of a restaurant's
+    name, cuisine, and dishes to the row ids it appears in, alongside an alphabetical list of those words
+    for prefix lookups.
+    
+    Every index is maintained incrementally: adding, updating, or removing a restaurant only touches
+    the index entries of that restaurant, and an update only touches the indexes of the fields that
+    changed. apply_changes applies a batch of changes the same way.
+    
+    Two storage modes are supported. "rows" keeps one dictionary per restaurant. "columnar" keeps the
+    data in a ColumnarRestaurantStore and only builds dictionaries for the restaurants that are read.
+    In "rows" mode a removed restaurant's slot in the list is filled by the last restaurant, so that
+    removal does not shift the list and get_restaurants no longer follows the order restaurants were
+    added. Searches, paged or not, and iter_rows always return restaurants in the order they were added.
+    
+    Attributes:
+        restaurants (list or ColumnarRestaurantStore): The stored restaurants. In "rows" mode this is a list of
+                            dictionaries with fields like name, cuisine, location, rating, price range, and
+                            delivery status. In "columnar" mode it is a store that yields the same dictionaries
+                            when iterated.
+        version (int): A counter that is incremented on every add, update, and removal, so that
+                       derived results can tell whether they are still current.
+        GEO_CELL_DEGREES (float): The width and height of a geospatial grid cell, in degrees.
+        TEXT_FIELD_WEIGHTS (dict): How much a word counts towards a text match, by the field it appears in.
+        PREFIX_MATCH_FACTOR (float): The share of the weight a word earns when it only matches as a prefix.
+        REQUIRED_FIELDS (tuple): The fields every stored restaurant must carry.
+        RATING_SCAN_SELECTIVITY (int): Rating filters matching at least one restaurant in this many are paged by
+                                       walking row ids; rarer ones by sorting their slice of the rating index.
+    """
+
+    GEO_CELL_DEGREES = 0.02  # About 2.2 km north to south.
+    TEXT_FIELD_WEIGHTS = {"name": 3.0, "cuisine": 2.0, "dishes": 1.0}
+    PREFIX_MATCH_FACTOR = 0.5
+    REQUIRED_FIELDS = ("name", "cuisine", "location", "rating")
+    RATING_SCAN_SELECTIVITY = 64
+
+    def __init__(self, storage="rows"):
+        """
+        Initialize the RestaurantDatabase with a predefined set of restaurant data.
+        
+        Args:
+            storage (str, optional): The storage mode, either "rows" (default) or "columnar".
+        
+        Raises:
+            ValueError: If the storage mode is not supported.
+        """
+        if storage == "rows":
+            self.restaurants = []
+            self._rows = {}  # Row id -> restaurant dictionary.
+            self._positions = {}  # Row id -> position in self.restaurants.
+            self._position_ids = []  # Position in self.restaurants -> row id.
+        elif storage == "columnar":
+            self.restaurants = ColumnarRestaurantStore()
+            self._rows = self.restaurants  # The store is addressed by row id as well.
+        else:
+            raise ValueError(f"Unsupported storage mode: {storage}")
+        self._columnar = storage == "columnar"
+        self._next_row_id = 0
+        self._cuisine_index = {}  # Lower-cased cuisine -> SortedIndexList of row ids.
+        self._location_index = {}  # Lower-cased location -> SortedIndexList of row ids.
+        self._rating_index = SortedIndexList()  # Sorted (-rating, row id) pairs, highest rating first.
+        self._rating_keys = {}  # Row id -> the exact pair it was added to the rating index under.
+        self._geo_grid = {}  # (latitude cell, longitude cell) -> set of row ids.
+        self._coordinates = {}  # Row id -> (lat, lon), so distance checks need not read the row.
+        self._postings = {}  # Word -> {row id: weight of the best field it appears in}.
+        self._terms = SortedIndexList()  # Every indexed word, in alphabetical order.
+        self._geo_bounds = None  # (lowest lat cell, highest lat cell, lowest lon cell, highest lon cell) ever used.
+        self.version = 0
+
+        for restaurant in [
+            {"name": "Italian Bistro", "cuisine": "Italian", "location": "Downtown", "rating": 4.5, 
+             "price_range": "$$", "delivery": True, "dishes": ["Spaghetti Carbonara", "Margherita Pizza"]},
+            {"name": "Sushi House", "cuisine": "Japanese", "location": "Midtown", "rating": 4.8, 
+             "price_range": "$$$", "delivery": False, "dishes": ["Sashimi Platter", "California Roll"]},
+            {"name": "Burger King", "cuisine": "Fast Food", "location": "Uptown", "rating": 4.0, 
+             "price_range": "$", "delivery": True, "dishes": ["Whopper", "Crispy Chicken Sandwich"]},
+            {"name": "Taco Town", "cuisine": "Mexican", "location": "Downtown", "rating": 4.2, 
+             "price_range": "$", "delivery": True, "dishes": ["Beef Tacos", "Chicken Quesadilla"]},
+            {"name": "Pizza Palace", "cuisine": "Italian", "location": "Uptown", "rating": 3.9, 
+             "price_range": "$$", "delivery": True, "dishes": ["Pepperoni Pizza", "Veggie Delight"]}
+        ]:
+            self.add_restaurant(restaurant)
+
+    def get_restaurants(self):
+        """
+        Retrieve the list of restaurants in the database.
+        
+        Returns:
+            list: A list of dictionaries, where each dictionary contains restaurant information. In "rows" mode,
+                  removals move the last restaurant into the freed slot; use iter_rows for the order they were added.
+        """
+        return self.restaurants
+
+    def add_restaurant(self, restaurant):
+        """
+        Add a restaurant to the database and register it in every secondary index.
+        
+        Args:
+            restaurant (dict): The restaurant information to store.
+        
+        Returns:
+            int: The row id assigned to the new restaurant.
+        
+        Raises:
+            ValueError: If the restaurant is missing a required field or a field has the wrong type.
+        """
+        self._check_restaurant(restaurant)
+        row_id = self._add(restaurant)
+        self.version += 1
+        return row_id
+
+    def update_restaurant(self, row_id, changes):
+        """
+        Update the fields of a stored restaurant and keep the secondary indexes in step.
+        
+        Args:
+            row_id (int): The row id of the restaurant to update.
+            changes (dict): The fields to overwrite (e.g., {"rating": 4.7}).
+        
+        Raises:
+            KeyError: If no restaurant is stored under the given row id.
+            ValueError: If a changed field has the wrong type.
+        """
+        if row_id not in self._rows:
+            raise KeyError(row_id)
+        self._check_restaurant(changes, partial=True)
+        self._update(row_id, changes)
+        self.version += 1
+
+    def remove_restaurant(self, row_id):
+        """
+        Remove a restaurant from the database and from every secondary index.
+        
+        Args:
+            row_id (int): The row id of the restaurant to remove.
+        
+        Raises:
+            KeyError: If no restaurant is stored under the given row id.
+        """
+        self._remove(row_id)
+        self.version += 1
+
+    def apply_changes(self, changes):
+        """
+        Apply a batch of additions, updates, and removals in order.
+        
+        The whole batch is checked before anything is applied, so a batch that refers to a missing
+        restaurant or carries a malformed record leaves the database untouched. The version is
+        incremented once for the batch.
+        
+        Args:
+            changes (list): Changes given as tuples: ("add", restaurant), ("update", row_id, changes),
+                            or ("remove", row_id).
+        
+        Returns:
+            list: One entry per change: the new row id for an addition, None otherwise.
+        
+        Raises:
+            KeyError: If an update or removal refers to a row id that will not exist at that point.
+            ValueError: If a change is not one of the supported kinds, or a record in it is malformed.
+        """
+        next_row_id = self._next_row_id
+        added, removed = set(), set()
+        arity = {"add": 2, "update": 3, "remove": 2}
+        for change in changes:
+            kind = change[0] if isinstance(change, (tuple, list)) and change else None
+            if kind not in arity or len(change) != arity[kind]:
+                raise ValueError(f"Unsupported change: {change!r}")
+            if kind == "add":
+                self._check_restaurant(change[1])
+                added.add(next_row_id)
+                next_row_id += 1
+            else:
+                row_id = change[1]
+                if row_id in removed or (row_id not in added and row_id not in self._rows):
+                    raise KeyError(row_id)
+                if kind == "update":
+                    self._check_restaurant(change[2], partial=True)
+                else:
+                    removed.add(row_id)
+
+        results = []
+        for change in changes:
+            if change[0] == "add":
+                results.append(self._add(change[1]))
+            elif change[0] == "update":
+                self._update(change[1], change[2])
+                results.append(None)
+            else:
+                self._remove(change[1])
+                results.append(None)
+        if changes:
+            self.version += 1
+        return results
+
+    def get_ids_by_cuisine(self, cuisine_type):
+        """
+        Look up the row ids of restaurants serving a cuisine, ignoring case.
+        
+        Args:
+            cuisine_type (str): The type of cuisine to look up (e.g., "Italian").
+        
+        Returns:
+            set: The row ids of the matching restaurants.
+        """
+        return set(self._cuisine_index.get(cuisine_type.lower(), ()))
+
+    def get_ids_by_location(self, location):
+        """
+        Look up the row ids of restaurants in a location, ignoring case.
+        
+        Args:
+            location (str): The location to look up (e.g., "Downtown").
+        
+        Returns:
+            set: The row ids of the matching restaurants.
+        """
+        return set(self._location_index.get(location.lower(), ()))
+
+    def iter_ids_by_cuisine(self, cuisine_type, after=None):
+        """
+        Iterate over the row ids of restaurants serving a cuisine, ignoring case, in the order they were added.
+        
+        Args:
+            cuisine_type (str): The type of cuisine to look up (e.g., "Italian").
+            after (int, optional): Only yield row ids greater than this one. Found by binary search.
+        
+        Yields:
+            int: The next matching row id.
+        """
+        bucket = self._cuisine_index.get(cuisine_type.lower())
+        return iter(()) if bucket is None else bucket.iter_after(after)
+
+    def iter_ids_by_location(self, location, after=None):
+        """
+        Iterate over the row ids of restaurants in a location, ignoring case, in the order they were added.
+        
+        Args:
+            location (str): The location to look up (e.g., "Downtown").
+            after (int, optional): Only yield row ids greater than this one. Found by binary search.
+        
+        Yields:
+            int: The next matching row id.
+        """
+        bucket = self._location_index.get(location.lower())
+        return iter(()) if bucket is None else bucket.iter_after(after)
+
+    def count_by_cuisine(self, cuisine_type):
+        """
+        Count the restaurants serving a cuisine, ignoring case, without materializing them.
+        
+        Args:
+            cuisine_type (str): The type of cuisine to count.
+        
+        Returns:
+            int: The number of matching restaurants.
+        """
+        return len(self._cuisine_index.get(cuisine_type.lower(), ()))
+
+    def count_by_location(self, location):
+        """
+        Count the restaurants in a location, ignoring case, without materializing them.
+        
+        Args:
+            location (str): The location to count.
+        
+        Returns:
+            int: The number of matching restaurants.
+        """
+        return len(self._location_index.get(location.lower(), ()))
+
+    def count_by_rating(self, min_rating=None, max_rating=None):
+        """
+        Count the restaurants whose rating lies in an inclusive range, using two binary searches.
+        
+        Args:
+            min_rating (float, optional): The lowest acceptable rating. No lower bound when omitted.
+            max_rating (float, optional): The highest acceptable rating. No upper bound when omitted.
+        
+        Returns:
+            int: The number of matching restaurants.
+        """
+        start, end = self._rating_bounds(min_rating, max_rating)
+        return end - start
+
+    def get_ids_by_rating(self, min_rating=None, max_rating=None):
+        """
+        Look up the row ids of restaurants whose rating lies in an inclusive range.
+        
+        Args:
+            min_rating (float, optional): The lowest acceptable rating. No lower bound when omitted.
+            max_rating (float, optional): The highest acceptable rating. No upper bound when omitted.
+        
+        Returns:
+            list: The row ids of the matching restaurants, from the highest rating to the lowest.
+        """
+        start, end = self._rating_bounds(min_rating, max_rating)
+        return [row_id for _, row_id in self._rating_index.islice(start, end)]
+
+    def iter_ids_by_rating(self, min_rating, after=None):
+        """
+        Iterate over the row ids of restaurants rated at least min_rating, in the order they were added.
+        
+        When the rating matches at least one restaurant in RATING_SCAN_SELECTIVITY, row ids are walked from
+        the cursor and each one's indexed rating is checked on the way, so a page stops reading as soon as
+        it is full. Rarer ratings have their slice of the rating index sorted instead, which is cheaper than
+        walking past all the restaurants that do not match.
+        
+        Args:
+            min_rating (float): The lowest acceptable rating.
+            after (int, optional): Only yield row ids greater than this one.
+        
+        Yields:
+            int: The next matching row id.
+        """
+        start = 0 if after is None else after + 1
+        if self.count_by_rating(min_rating=min_rating) * self.RATING_SCAN_SELECTIVITY < len(self._rating_keys):
+            return iter(sorted(row_id for row_id in self.get_ids_by_rating(min_rating=min_rating) if row_id >= start))
+        return self._scan_ids_by_rating(-min_rating, start)
+
+    def _scan_ids_by_rating(self, negated_min_rating, start):
+        """
+        Walk the row ids from start, yielding those whose indexed rating is high enough.
+        """
+        rating_keys = self._rating_keys
+        for row_id in range(start, self._next_row_id):
+            key = rating_keys.get(row_id)
+            if key is not None and key[0] <= negated_min_rating:
+                yield row_id
+
+    def iter_ids_by_rating_desc(self):
+        """
+        Iterate over every row id from the highest rating to the lowest, ties in the order they were added.
+        
+        Yields:
+            int: The next row id.
+        """
+        for _, row_id in self._rating_index:
+            yield row_id
+
+    def get_restaurant(self, row_id):
+        """
+        Retrieve a single restaurant by its row id.
+        
+        Args:
+            row_id (int): The row id of the restaurant.
+        
+        Returns:
+            dict: The restaurant information.
+        
+        Raises:
+            KeyError: If no restaurant is stored under the given row id.
+        """
+        return self._rows[row_id]
+
+    def get_terms_with_prefix(self, prefix, limit=None):
+        """
+        Find the indexed words that start with a prefix, using a binary search over the sorted word list.
+        
+        Args:
+            prefix (str): The start of a word. It is lower-cased before the lookup.
+            limit (int, optional): The maximum number of words to return.
+        
+        Returns:
+            list: The matching words, in alphabetical order.
+        """
+        prefix = prefix.lower()
+        terms = []
+        for term in self._terms.islice(self._terms.bisect_left(prefix)):
+            if not term.startswith(prefix) or (limit is not None and len(terms) == limit):
+                break
+            terms.append(term)
+        return terms
+
+    def get_text_matches(self, query, limit=None):
+        """
+        Score the restaurants that contain every word of a query, treating the last word as a prefix.
+        
+        A restaurant's score is the sum, over the query words, of the best field weight among the
+        indexed words that match. Prefix-only matches earn PREFIX_MATCH_FACTOR of the weight.
+        
+        Args:
+            query (str): The search text.
+            limit (int, optional): The maximum number of matches to return.
+        
+        Returns:
+            list: (score, row id) pairs, highest score first and ties in the order restaurants were added.
+        """
+        words = tokenize(query)
+        scores = None
+        for position, word in enumerate(words):
+            if position == len(words) - 1:
+                terms = self.get_terms_with_prefix(word)
+            else:
+                terms = [word] if word in self._postings else []
+            word_scores = {}
+            for term in terms:
+                factor = 1.0 if term == word else self.PREFIX_MATCH_FACTOR
+                for row_id, weight in self._postings[term].items():
+                    if weight * factor > word_scores.get(row_id, 0.0):
+                        word_scores[row_id] = weight * factor
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {row_id: scores[row_id] + score for row_id, score in word_scores.items() if row_id in scores}
+            if not scores:
+                return []
+        if not scores:
+            return []
+
+        ranked = ((-score, row_id) for row_id, score in scores.items())
+        best = sorted(ranked) if limit is None else heapq.nsmallest(limit, ranked)
+        return [(-negated_score, row_id) for negated_score, row_id in best]
+
+    def get_ids_within(self, lat, lon, radius_km):
+        """
+        Look up the row ids of restaurants within a distance of a point, visiting only nearby grid cells.
+        
+        Args:
+            lat (float): Latitude of the point, in degrees.
+            lon (float): Longitude of the point, in degrees.
+            radius_km (float): The maximum distance, in kilometres.
+        
+        Returns:
+            list: (distance in km, row id) pairs, closest first.
+        """
+        if not self._geo_grid:
+            return []
+        lat_span = radius_km / KM_PER_DEGREE_LATITUDE
+        # Meridians converge towards the poles, so the same distance spans more degrees of longitude.
+        widest_cos = math.cos(math.radians(min(90.0, abs(lat) + lat_span)))
+        lon_span = 360.0 if widest_cos <= 1e-9 else min(360.0, lat_span / widest_cos)
+        size = self.GEO_CELL_DEGREES
+
+        # No restaurant lies outside the occupied bounds, so the cell ranges never need to reach past them.
+        low_lat, high_lat, low_lon, high_lon = self._geo_bounds
+        lat_cells = range(max(low_lat, math.floor((lat - lat_span) / size)),
+                          min(high_lat, math.floor((lat + lat_span) / size)) + 1)
+        lon_cells = range(max(low_lon, math.floor((lon - lon_span) / size)),
+                          min(high_lon, math.floor((lon + lon_span) / size)) + 1)
+        if len(lat_cells) * len(lon_cells) > len(self._geo_grid):
+            # A wide radius covers more cells than are populated, so visit the populated cells instead.
+            row_ids = (row_id for (lat_cell, lon_cell), cell in self._geo_grid.items()
+                       if lat_cell in lat_cells and lon_cell in lon_cells for row_id in cell)
+        else:
+            row_ids = (row_id for lat_cell in lat_cells for lon_cell in lon_cells
+                       for row_id in self._geo_grid.get((lat_cell, lon_cell), ()))
+
+        matches = []
+        for row_id in row_ids:
+            distance = haversine_km(lat, lon, *self._coordinates[row_id])
+            if distance <= radius_km:
+                matches.append((distance, row_id))
+        matches.sort()
+        return matches
+
+    def get_nearest_ids(self, lat, lon, k):
+        """
+        Find the k restaurants closest to a point by searching rings of grid cells outwards from it.
+        
+        The search stops once the k-th closest distance found is shorter than any distance a restaurant
+        in an unvisited ring could have.
+        
+        Args:
+            lat (float): Latitude of the point, in degrees.
+            lon (float): Longitude of the point, in degrees.
+            k (int): The number of restaurants to return.
+        
+        Returns:
+            list: Up to k (distance in km, row id) pairs, closest first.
+        """
+        if k <= 0 or not self._geo_grid:
+            return []
+        size = self.GEO_CELL_DEGREES
+        center_lat_cell, center_lon_cell = math.floor(lat / size), math.floor(lon / size)
+        # Beyond this many rings every occupied cell has been visited.
+        low_lat, high_lat, low_lon, high_lon = self._geo_bounds
+        max_ring = max(center_lat_cell - low_lat, high_lat - center_lat_cell,
+                       center_lon_cell - low_lon, high_lon - center_lon_cell, 0)
+
+        nearest = []  # Max-heap of the best k, as (-distance, -row id) pairs.
+        for ring in range(max_ring + 1):
+            for lat_cell in range(center_lat_cell - ring, center_lat_cell + ring + 1):
+                on_edge = abs(lat_cell - center_lat_cell) == ring
+                lon_cells = (range(center_lon_cell - ring, center_lon_cell + ring + 1) if on_edge
+                             else (center_lon_cell - ring, center_lon_cell + ring))
+                for lon_cell in lon_cells:
+                    for row_id in self._geo_grid.get((lat_cell, lon_cell), ()):
+                        entry = (-haversine_km(lat, lon, *self._coordinates[row_id]), -row_id)
+                        if len(nearest) < k:
+                            heapq.heappush(nearest, entry)
+                        elif entry > nearest[0]:
+                            heapq.heapreplace(nearest, entry)
+            if len(nearest) == k:
+                # Anything outside this ring is at least `ring` cells away in latitude or longitude,
+                # and a longitude cell is narrowest at the highest latitude the ring reaches.
+                far_lat = min(90.0, abs(lat) + (ring + 1) * size)
+                cell_km = size * KM_PER_DEGREE_LATITUDE * min(1.0, math.cos(math.radians(far_lat)))
+                if -nearest[0][0] <= ring * cell_km:
+                    break
+        return sorted((-distance, -row_id) for distance, row_id in nearest)
+
+    def iter_row_ids(self, after=None):
+        """
+        Iterate over the row ids of the stored restaurants, in the order they were added.
+        
+        Args:
+            after (int, optional): Only yield row ids greater than this one.
+        
+        Yields:
+            int: The next row id.
+        """
+        start = 0 if after is None else after + 1
+        for row_id in range(start, self._next_row_id):
+            if row_id in self._rows:
+                yield row_id
+
+    def iter_rows(self):
+        """
+        Iterate over every stored restaurant together with its row id, in the order they were added.
+        
+        Yields:
+            tuple: (row id, restaurant dictionary) pairs.
+        """
+        return iter(self._rows.items())
+
+    def get_restaurants_by_ids(self, row_ids):
+        """
+        Materialize restaurants from their row ids, in the order they were added to the database.
+        
+        Args:
+            row_ids (iterable): The row ids to look up.
+        
+        Returns:
+            list: A list of dictionaries, one per row id.
+        """
+        return [self._rows[row_id] for row_id in sorted(row_ids)]
+
+    @classmethod
+    def _check_restaurant(cls, restaurant, partial=False):
+        """
+        Check that a restaurant, or a set of changes to one when partial, can be stored and indexed.
+        
+        Raises:
+            ValueError: If a required field is missing or a field has the wrong type.
+        """
+        if not isinstance(restaurant, dict):
+            raise ValueError(f"A restaurant must be a dictionary, not {type(restaurant).__name__}")
+        if not partial:
+            missing = [field for field in cls.REQUIRED_FIELDS if field not in restaurant]
+            if missing:
+                raise ValueError(f"Restaurant is missing required fields: {', '.join(missing)}")
+        for field in ("name", "cuisine", "location", "price_range"):
+            if field in restaurant and not isinstance(restaurant[field], str):
+                raise ValueError(f"Restaurant field '{field}' must be a string")
+        for field in ("rating", "lat", "lon"):
+            if field not in restaurant or (restaurant[field] is None and field != "rating"):
+                continue  # Coordinates are optional and may be given as None.
+            value = restaurant[field]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+                raise ValueError(f"Restaurant field '{field}' must be a number")
+        dishes = restaurant.get("dishes")
+        if dishes is not None and not isinstance(dishes, str) and not (
+                isinstance(dishes, (list, tuple)) and all(isinstance(dish, str) for dish in dishes)):
+            raise ValueError("Restaurant field 'dishes' must be a string or a list of strings")
+
+    def _add(self, restaurant):
+        """
+        Store and index a restaurant without touching the version.
+        """
+        if self._columnar:
+            row_id = self.restaurants.append(restaurant)
+        else:
+            row_id = self._next_row_id
+            self._rows[row_id] = restaurant
+            self._positions[row_id] = len(self.restaurants)
+            self._position_ids.append(row_id)
+            self.restaurants.append(restaurant)
+        self._next_row_id = row_id + 1
+        self._index_restaurant(row_id, restaurant)
+        return row_id
+
+    def _update(self, row_id, changes):
+        """
+        Overwrite fields of a restaurant and re-index only the indexes those fields feed, without touching the version.
+        """
+        restaurant = self._rows[row_id]
+        fields = set(changes)
+        self._unindex_restaurant(row_id, restaurant, fields)
+        restaurant.update(changes)
+        if self._columnar:
+            self.restaurants.update(row_id, changes)  # The dictionary above is only a copy of the row.
+        self._index_restaurant(row_id, restaurant, fields)
+
+    def _remove(self, row_id):
+        """
+        Drop a restaurant from storage and from every index without touching the version.
+        """
+        restaurant = self._rows.pop(row_id)
+        self._unindex_restaurant(row_id, restaurant)
+        if self._columnar:
+            return
+        # Move the last restaurant into the freed slot so that nothing after it has to shift.
+        position = self._positions.pop(row_id)
+        last_row_id = self._position_ids.pop()
+        last_restaurant = self.restaurants.pop()
+        if last_row_id != row_id:
+            self.restaurants[position] = last_restaurant
+            self._position_ids[position] = last_row_id
+            self._positions[last_row_id] = position
+
+    def _rating_bounds(self, min_rating, max_rating):
+        """
+        Find the slice of the rating index that covers an inclusive rating range.
+        """
+        # Ratings are stored negated, so the upper rating bound is the start of the slice.
+        start = 0 if max_rating is None else self._rating_index.bisect_left((-max_rating, -1))
+        end = (len(self._rating_index) if min_rating is None
+               else self._rating_index.bisect_right((-min_rating, float("inf"))))
+        return start, max(start, end)
+
+    def _index_restaurant(self, row_id, restaurant, fields=None):
+        """
+        Register a restaurant in the secondary indexes fed by the given fields, or in all of them.
+        """
+        for field, index in (("cuisine", self._cuisine_index), ("location", self._location_index)):
+            if fields is None or field in fields:
+                key = restaurant[field].lower()
+                bucket = index.get(key)
+                if bucket is None:
+                    bucket = index[key] = SortedIndexList()
+                bucket.add(row_id)
+        if fields is None or "rating" in fields:
+            key = self._rating_keys[row_id] = (-restaurant['rating'], row_id)
+            self._rating_index.add(key)
+
+        if fields is None or not fields.isdisjoint(self.TEXT_FIELD_WEIGHTS):
+            for term, weight in self._text_terms(restaurant).items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._terms.add(term)
+                postings[row_id] = weight
+
+        coordinates = self._get_coordinates(restaurant)
+        if coordinates is not None and (fields is None or "lat" in fields or "lon" in fields):
+            self._coordinates[row_id] = coordinates
+            lat_cell, lon_cell = self._geo_cell(*coordinates)
+            self._geo_grid.setdefault((lat_cell, lon_cell), set()).add(row_id)
+            if self._geo_bounds is None:
+                self._geo_bounds = (lat_cell, lat_cell, lon_cell, lon_cell)
+            else:
+                # The bounds only ever grow, which keeps them cheap to maintain and still safe to stop on.
+                low_lat, high_lat, low_lon, high_lon = self._geo_bounds
+                self._geo_bounds = (min(low_lat, lat_cell), max(high_lat, lat_cell),
+                                    min(low_lon, lon_cell), max(high_lon, lon_cell))
+
+    def _unindex_restaurant(self, row_id, restaurant, fields=None):
+        """
+        Drop a restaurant from the secondary indexes fed by the given fields, or from all of them,
+        discarding buckets that become empty.
+        """
+        for field, index in (("cuisine", self._cuisine_index), ("location", self._location_index)):
+            if fields is not None and field not in fields:
+                continue
+            key = restaurant[field].lower()
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.discard(row_id)
+                if not bucket:
+                    del index[key]
+
+        if fields is None or "rating" in fields:
+            # Columnar rows read their rating back rounded, so look up the key the row was indexed under.
+            self._rating_index.discard(self._rating_keys.pop(row_id))
+
+        if fields is None or not fields.isdisjoint(self.TEXT_FIELD_WEIGHTS):
+            for term in self._text_terms(restaurant):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(row_id, None)
+                    if not postings:
+                        del self._postings[term]
+                        self._terms.discard(term)
+
+        if fields is None or "lat" in fields or "lon" in fields:
+            coordinates = self._coordinates.pop(row_id, None)
+            if coordinates is not None:
+                cell = self._geo_cell(*coordinates)
+                self._geo_grid[cell].discard(row_id)
+                if not self._geo_grid[cell]:
+                    del self._geo_grid[cell]
+
+    def _text_terms(self, restaurant):
+        """
+        Collect the words of a restaurant's text fields, each with the weight of the best field it appears in.
+        """
+        terms = {}
+        for field, weight in self.TEXT_FIELD_WEIGHTS.items():
+            value = restaurant.get(field)
+            if not value:
+                continue
+            for text in ([value] if isinstance(value, str) else value):
+                for term in tokenize(text):
+                    if weight > terms.get(term, 0.0):
+                        terms[term] = weight
+        return terms
+
+    def _geo_cell(self, lat, lon):
+        """
+        Return the grid cell that contains a point.
+        """
+        return math.floor(lat / self.GEO_CELL_DEGREES), math.floor(lon / self.GEO_CELL_DEGREES)
+
+    @staticmethod
+    def _get_coordinates(restaurant):
+        """
+        Return a restaurant's (lat, lon) pair, or None if it does not carry both coordinates.
+        """
+        lat, lon = restaurant.get('lat'), restaurant.get('lon')
+        if lat is None or lon is None:
+            return None
+        return float(lat), float(lon)
+
+
+class ColumnarRestaurantStore:
+    """
+    Column-oriented storage for restaurant data, addressed by row id.
+    
+    Ratings are kept in an array of 32-bit floats, coordinates in arrays of 64-bit floats (NaN when a
+    restaurant has none), delivery flags in a bitmap, and cuisine, location, and price range as small
+    integer codes into per-column dictionaries. Any other fields are kept per
+    row. Restaurant dictionaries are only built when a row is read, and iterating the store yields them
+    for every live row in the order they were added.
     
     Attributes:
-        database (RestaurantDatabase): An instance of RestaurantDatabase that holds restaurant data.
+        ENCODED_FIELDS (tuple): The fields stored as dictionary-encoded integer codes.
+        FIXED_FIELDS (tuple): The fields that have a column of their own.
+        RATING_DIGITS (int): The decimal places ratings are rounded to when read back from 32-bit floats.
     """
 
-    def __init__(self, database):
+    ENCODED_FIELDS = ("cuisine", "location", "price_range")
+    FIXED_FIELDS = ("name", "rating", "delivery", "lat", "lon") + ENCODED_FIELDS
+    RATING_DIGITS = 4
+
+    def __init__(self):
         """
-        Initialize RestaurantBrowsing with a reference to a restaurant database.
+        Initialize an empty ColumnarRestaurantStore.
+        """
+        self._names = []
+        self._ratings = array('f')
+        self._latitudes = array('d')
+        self._longitudes = array('d')
+        self._delivery = bytearray()  # Bitmap of delivery flags, one bit per row.
+        self._live = bytearray()  # Bitmap of rows that have not been removed.
+        self._codes = {field: array('I') for field in self.ENCODED_FIELDS}
+        self._dictionaries = {field: {} for field in self.ENCODED_FIELDS}  # Value -> code.
+        self._values = {field: [] for field in self.ENCODED_FIELDS}  # Code -> value.
+        self._extras = {}  # Row id -> fields outside the fixed columns.
+        self._live_count = 0
+
+    def __len__(self):
+        """
+        Returns:
+            int: The number of live rows.
+        """
+        return self._live_count
+
+    def __iter__(self):
+        """
+        Iterate over the live rows, building a dictionary for each one as it is reached.
         
-        Args:
-            database (RestaurantDatabase): The database object containing restaurant information.
+        Yields:
+            dict: The restaurant information for the next live row.
         """
-        self.database = database
+        for row_id in range(len(self._names)):
+            if self._get_bit(self._live, row_id):
+                yield self._materialize(row_id)
 
-    def search_by_cuisine(self, cuisine_type):
+    def __getitem__(self, row_id):
         """
-        Search for restaurants based on their cuisine type.
+        Build the dictionary for a single row.
         
         Args:
-            cuisine_type (str): The type of cuisine to filter by (e.g., "Italian").
+            row_id (int): The row id to read.
         
         Returns:
-            list: A list of restaurants that match the given cuisine type.
+            dict: The restaurant information.
+        
+        Raises:
+            KeyError: If the row id does not refer to a live row.
         """
-        return [restaurant for restaurant in self.database.get_restaurants() 
-                if restaurant['cuisine'].lower() == cuisine_type.lower()]
+        if not 0 <= row_id < len(self._names) or not self._get_bit(self._live, row_id):
+            raise KeyError(row_id)
+        return self._materialize(row_id)
 
-    def search_by_location(self, location):
+    def __contains__(self, row_id):
         """
-        Search for restaurants based on their location.
+        Returns:
+            bool: True if the row id refers to a live row.
+        """
+        return 0 <= row_id < len(self._names) and self._get_bit(self._live, row_id)
+
+    def items(self):
+        """
+        Iterate over the live rows together with their row ids.
+        
+        Yields:
+            tuple: (row id, restaurant dictionary) pairs.
+        """
+        for row_id in range(len(self._names)):
+            if self._get_bit(self._live, row_id):
+                yield row_id, self._materialize(row_id)
+
+    def column_buffers(self):
+        """
+        Expose the raw column buffers so they can be wrapped without copying (e.g., by NumPy).
+        
+        Callers must release any views before the store is modified again, because a buffer that is
+        being viewed cannot grow.
+        
+        Returns:
+            dict: The "rating" array, the "live" and "delivery" bitmaps, the code array of every
+                  dictionary-encoded field, and "size", the number of rows including removed ones.
+        """
+        buffers = {"rating": self._ratings, "live": self._live, "delivery": self._delivery, "size": len(self._names)}
+        buffers.update(self._codes)
+        return buffers
+
+    def matching_codes(self, field, value):
+        """
+        Find the codes of a dictionary-encoded field whose value equals the given value, ignoring case.
         
         Args:
-            location (str): The location to filter by (e.g., "Downtown").
+            field (str): One of ENCODED_FIELDS.
+            value (str): The value to match.
         
         Returns:
-            list: A list of restaurants that are located in the specified area.
+            list: The matching codes.
         """
-        return [restaurant for restaurant in self.database.get_restaurants() 
-                if restaurant['location'].lower() == location.lower()]
+        key = value.lower()
+        return [code for code, stored in enumerate(self._values[field]) if stored.lower() == key]
 
-    def search_by_rating(self, min_rating):
+    def append(self, restaurant):
         """
-        Search for restaurants based on their minimum rating.
+        Store a restaurant in a new row.
         
         Args:
-            min_rating (float): The minimum acceptable rating to filter by (e.g., 4.0).
+            restaurant (dict): The restaurant information to store.
         
         Returns:
-            list: A list of restaurants that have a rating greater than or equal to the specified rating.
+            int: The row id of the new row.
         """
-        return [restaurant for restaurant in self.database.get_restaurants() 
-                if restaurant['rating'] >= min_rating]
+        row_id = len(self._names)
+        self._names.append(sys.intern(restaurant['name']))
+        self._ratings.append(restaurant['rating'])
+        self._latitudes.append(self._coordinate(restaurant.get('lat')))
+        self._longitudes.append(self._coordinate(restaurant.get('lon')))
+        if row_id % 8 == 0:
+            self._delivery.append(0)
+            self._live.append(0)
+        self._set_bit(self._live, row_id, True)
+        self._set_bit(self._delivery, row_id, bool(restaurant.get('delivery', False)))
+        for field in self.ENCODED_FIELDS:
+            self._codes[field].append(self._encode(field, restaurant.get(field, "")))
+        extras = {key: value for key, value in restaurant.items() if key not in self.FIXED_FIELDS}
+        if extras:
+            self._extras[row_id] = extras
+        self._live_count += 1
+        return row_id
 
-    def search_by_filters(self, cuisine_type=None, location=None, min_rating=None):
+    def update(self, row_id, changes):
         """
-        Search for restaurants based on multiple filters: cuisine type, location, and/or rating.
+        Overwrite fields of an existing row, touching only the columns that changed.
         
         Args:
-            cuisine_type (str, optional): The type of cuisine to filter by.
-            location (str, optional): The location to filter by.
-            min_rating (float, optional): The minimum acceptable rating to filter by.
+            row_id (int): The row id to update.
+            changes (dict): The fields to overwrite.
+        
+        Raises:
+            KeyError: If the row id does not refer to a live row.
+        """
+        if not 0 <= row_id < len(self._names) or not self._get_bit(self._live, row_id):
+            raise KeyError(row_id)
+        for field, value in changes.items():
+            if field == "name":
+                self._names[row_id] = sys.intern(value)
+            elif field == "rating":
+                self._ratings[row_id] = value
+            elif field == "lat":
+                self._latitudes[row_id] = self._coordinate(value)
+            elif field == "lon":
+                self._longitudes[row_id] = self._coordinate(value)
+            elif field == "delivery":
+                self._set_bit(self._delivery, row_id, bool(value))
+            elif field in self._codes:
+                self._codes[field][row_id] = self._encode(field, value)
+            else:
+                self._extras.setdefault(row_id, {})[field] = value
+
+    def pop(self, row_id):
+        """
+        Remove a row, leaving its slot behind so that other row ids stay valid.
+        
+        Args:
+            row_id (int): The row id to remove.
         
         Returns:
-            list: A list of restaurants that match all specified filters.
+            dict: The restaurant information the row held.
+        
+        Raises:
+            KeyError: If the row id does not refer to a live row.
         """
-        results = self.database.get_restaurants()  # Start with all restaurants
+        restaurant = self[row_id]
+        self._set_bit(self._live, row_id, False)
+        self._extras.pop(row_id, None)
+        self._live_count -= 1
+        return restaurant
 
-        if cuisine_type:
-            results = [restaurant for restaurant in results 
-                       if restaurant['cuisine'].lower() == cuisine_type.lower()]
+    def _materialize(self, row_id):
+        """
+        Build the restaurant dictionary for a row from its columns.
+        """
+        restaurant = {
+            "name": self._names[row_id],
+            "cuisine": self._values["cuisine"][self._codes["cuisine"][row_id]],
+            "location": self._values["location"][self._codes["location"][row_id]],
+            "rating": round(self._ratings[row_id], self.RATING_DIGITS),
+            "price_range": self._values["price_range"][self._codes["price_range"][row_id]],
+            "delivery": self._get_bit(self._delivery, row_id),
+        }
+        lat, lon = self._latitudes[row_id], self._longitudes[row_id]
+        if not math.isnan(lat):
+            restaurant["lat"] = lat
+        if not math.isnan(lon):
+            restaurant["lon"] = lon
+        extras = self._extras.get(row_id)
+        if extras:
+            restaurant.update(extras)
+        return restaurant
 
-        if location:
-            results = [restaurant for restaurant in results 
-                       if restaurant['location'].lower() == location.lower()]
+    @staticmethod
+    def _coordinate(value):
+        """
+        Convert a coordinate for its column, storing a missing one as NaN.
+        """
+        return math.nan if value is None else float(value)
 
-        if min_rating:
-            results = [restaurant for restaurant in results 
-                       if restaurant['rating'] >= min_rating]
+    def _encode(self, field, value):
+        """
+        Return the integer code for a value in a dictionary-encoded column, assigning a new code if needed.
+        """
+        dictionary = self._dictionaries[field]
+        code = dictionary.get(value)
+        if code is None:
+            code = dictionary[value] = len(self._values[field])
+            self._values[field].append(value)
+        return code
 
-        return results
+    @staticmethod
+    def _get_bit(bitmap, position):
+        """
+        Read one bit from a bitmap.
+        """
+        return bool(bitmap[position >> 3] & (1 << (position & 7)))
 
+    @staticmethod
+    def _set_bit(bitmap, position, value):
+        """
+        Set or clear one bit in a bitmap.
+        """
+        if value:
+            bitmap[position >> 3] |= 1 << (position & 7)
+        else:
+            bitmap[position >> 3] &= ~(1 << (position & 7)) & 0xFF
 
-class RestaurantDatabase:
+
+class VectorizedFilterEngine:
     """
-    A simulated in-memory database that stores restaurant information.
+    Evaluates the cuisine, location, and rating filters of a search as one full scan of the catalog.
+    
+    When NumPy is installed and the database uses columnar storage, each filter becomes a boolean mask
+    over the raw columns and the masks are combined with `&`. Otherwise every row is checked in plain
+    Python. The engine pays off for bulk queries that match a large share of the catalog; selective
+    searches are better served by the indexes RestaurantBrowsing uses by default.
     
     Attributes:
-        restaurants (list): A list of dictionaries, where each dictionary represents a restaurant with
-                            fields like name, cuisine, location, rating, price range, and delivery status.
+        database (RestaurantDatabase): The database to scan.
     """
 
-    def __init__(self):
+    def __init__(self, database):
         """
-        Initialize the RestaurantDatabase with a predefined set of restaurant data.
+        Initialize the VectorizedFilterEngine with the database it scans.
+        
+        Args:
+            database (RestaurantDatabase): The database object containing restaurant information.
         """
-        self.restaurants = [
-            {"name": "Italian Bistro", "cuisine": "Italian", "location": "Downtown", "rating": 4.5, 
-             "price_range": "$$", "delivery": True},
-            {"name": "Sushi House", "cuisine": "Japanese", "location": "Midtown", "rating": 4.8, 
-             "price_range": "$$$", "delivery": False},
-            {"name": "Burger King", "cuisine": "Fast Food", "location": "Uptown", "rating": 4.0, 
-             "price_range": "$", "delivery": True},
-            {"name": "Taco Town", "cuisine": "Mexican", "location": "Downtown", "rating": 4.2, 
-             "price_range": "$", "delivery": True},
-            {"name": "Pizza Palace", "cuisine": "Italian", "location": "Uptown", "rating": 3.9, 
-             "price_range": "$$", "delivery": True}
-        ]
+        self.database = database
 
-    def get_restaurants(self):
+    @property
+    def uses_numpy(self):
         """
-        Retrieve the list of restaurants in the database.
+        bool: True if searches are evaluated with NumPy masks rather than in plain Python.
+        """
+        return np is not None and isinstance(self.database.restaurants, ColumnarRestaurantStore)
+
+    def match_row_ids(self, cuisine_type=None, location=None, min_rating=None):
+        """
+        Find the row ids of the restaurants that match every given filter.
+        
+        Args:
+            cuisine_type (str, optional): The type of cuisine to filter by.
+            location (str, optional): The location to filter by.
+            min_rating (float, optional): The minimum acceptable rating to filter by.
         
         Returns:
-            list: A list of dictionaries, where each dictionary contains restaurant information.
+            list: The matching row ids, in the order the restaurants were added.
         """
-        return self.restaurants
+        if self.uses_numpy:
+            return self._match_with_numpy(cuisine_type, location, min_rating)
+
+        rows = self.database.iter_rows()
+        if cuisine_type:
+            cuisine_key = cuisine_type.lower()
+            rows = [(row_id, restaurant) for row_id, restaurant in rows
+                    if restaurant['cuisine'].lower() == cuisine_key]
+        if location:
+            location_key = location.lower()
+            rows = [(row_id, restaurant) for row_id, restaurant in rows
+                    if restaurant['location'].lower() == location_key]
+        if min_rating:
+            rows = [(row_id, restaurant) for row_id, restaurant in rows
+                    if restaurant['rating'] >= min_rating]
+        return [row_id for row_id, _ in rows]
+
+    def search(self, cuisine_type=None, location=None, min_rating=None):
+        """
+        Search for the restaurants that match every given filter.
+        
+        Args:
+            cuisine_type (str, optional): The type of cuisine to filter by.
+            location (str, optional): The location to filter by.
+            min_rating (float, optional): The minimum acceptable rating to filter by.
+        
+        Returns:
+            list: A list of restaurants that match all specified filters.
+        """
+        row_ids = self.match_row_ids(cuisine_type=cuisine_type, location=location, min_rating=min_rating)
+        return [self.database.get_restaurant(row_id) for row_id in row_ids]
+
+    def _match_with_numpy(self, cuisine_type, location, min_rating):
+        """
+        Build one boolean mask per filter over the columnar store and return the row ids where all hold.
+        """
+        store = self.database.restaurants
+        buffers = store.column_buffers()
+        size = buffers["size"]
+        # The views below borrow the store's buffers, so they must not outlive this call.
+        mask = np.unpackbits(np.frombuffer(buffers["live"], dtype=np.uint8), bitorder="little")[:size].astype(bool)
+        for field, value in (("cuisine", cuisine_type), ("location", location)):
+            if value:
+                codes = np.frombuffer(buffers[field], dtype=np.uint32)
+                mask &= np.isin(codes, store.matching_codes(field, value))
+        if min_rating:
+            # Ratings are stored as 32-bit floats, so the bound is rounded the same way before comparing.
+            mask &= np.frombuffer(buffers["rating"], dtype=np.float32) >= np.float32(min_rating)
+        return np.flatnonzero(mask).tolist()
 
 
 class RestaurantSearch:
     """
     A class that interfaces with RestaurantBrowsing to perform restaurant searches based on user input.
     
+    Results are kept in a bounded least-recently-used cache keyed by the normalized filters. A cached
+    result is only served while the database version it was computed at is still current and, when a
+    TTL is set, while it is younger than the TTL.
+    
     Attributes:
         browsing (RestaurantBrowsing): An instance of RestaurantBrowsing used to perform searches.
+        cache_size (int): The maximum number of cached results. 0 disables caching.
+        ttl (float): The number of seconds a cached result may be served for, or None for no limit.
+        hits (int): The number of searches answered from the cache.
+        misses (int): The number of searches that had to be computed.
     """
 
-    def __init__(self, browsing):
+    def __init__(self, browsing, cache_size=128, ttl=None):
         """
         Initialize the RestaurantSearch with a reference to a RestaurantBrowsing instance.
         
         Args:
             browsing (RestaurantBrowsing): An instance of the RestaurantBrowsing class.
+            cache_size (int, optional): The maximum number of cached results. 0 disables caching.
+            ttl (float, optional): The number of seconds a cached result may be served for.
         """
         self.browsing = browsing
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # Filter key -> (database version, time stored, results).
 
     def search_restaurants(self, cuisine=None, location=None, rating=None):
         """
@@ -148,12 +1626,48 @@ class RestaurantSearch:
         Returns:
             list: A list of restaurants that match the provided search criteria.
         """
-        results = self.browsing.search_by_filters(cuisine_type=cuisine, location=location, min_rating=rating)
-        return results
+        key = (cuisine.lower() if cuisine else None,
+               location.lower() if location else None,
+               float(rating) if rating else None)
+        version = self.browsing.database.version
+        now = time.monotonic()
+
+        entry = self._cache.get(key)
+        if entry is not None:
+            cached_version, stored_at, results = entry
+            if cached_version == version and (self.ttl is None or now - stored_at < self.ttl):
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(results)
+            del self._cache[key]  # Stale, so it is dropped rather than left to be evicted.
+
+        self.misses += 1
+        results = list(self.browsing.search_by_filters(cuisine_type=cuisine, location=location, min_rating=rating))
+        if self.cache_size > 0:
+            self._cache[key] = (version, now, results)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(results)
+
+    def cache_info(self):
+        """
+        Report the cache counters.
+        
+        Returns:
+            dict: The number of hits and misses, the current number of cached results, and the cache size.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "max_size": self.cache_size}
+
+    def clear_cache(self):
+        """
+        Drop every cached result. The hit and miss counters are kept.
+        """
+        self._cache.clear()
 
 
 # Unit tests for RestaurantBrowsing class
 import unittest
+from unittest import mock
 
 class TestRestaurantBrowsing(unittest.TestCase):
     """
@@ -199,6 +1713,429 @@ class TestRestaurantBrowsing(unittest.TestCase):
         self.assertEqual(len(results), 1)  # Only one restaurant should match all the filters
         self.assertEqual(results[0]['name'], "Italian Bistro")  # The result should be "Italian Bistro"
 
+    def test_search_by_rating_range(self):
+        """
+        Test searching for restaurants whose rating falls within an inclusive range.
+        """
+        results = self.browsing.search_by_rating_range(4.0, 4.5)
+        self.assertEqual([restaurant['name'] for restaurant in results], ["Italian Bistro", "Burger King", "Taco Town"])
+
+    def test_search_top_rated(self):
+        """
+        Test retrieving the best rated restaurants, with and without a location filter.
+        """
+        results = self.browsing.search_top_rated(2)
+        self.assertEqual([restaurant['name'] for restaurant in results], ["Sushi House", "Italian Bistro"])
+
+        results = self.browsing.search_top_rated(5, location="Uptown")
+        self.assertEqual([restaurant['name'] for restaurant in results], ["Burger King", "Pizza Palace"])
+
+    def test_plan_filters_orders_by_selectivity(self):
+        """
+        Test that the planner starts with the filter that matches the fewest restaurants.
+        """
+        plan = self.browsing.plan_filters(cuisine_type="Italian", location="Midtown", min_rating=4.0)
+        self.assertEqual([name for _, name in plan], ["location", "cuisine", "rating"])
+        self.assertEqual(plan[0][0], 1)
+
+        results = self.browsing.search_by_filters(cuisine_type="Italian", location="Midtown", min_rating=4.0)
+        self.assertEqual(results, [])
+
+        results = self.browsing.search_by_filters(cuisine_type="Italian", min_rating=4.6)
+        self.assertEqual(results, [])
+
+    def test_columnar_storage_matches_row_storage(self):
+        """
+        Test that the columnar storage mode answers every search the same way as the default row storage.
+        """
+        columnar = RestaurantBrowsing(RestaurantDatabase(storage="columnar"))
+        self.assertEqual(columnar.search_by_filters(cuisine_type="Italian", location="Downtown", min_rating=4.0),
+                         self.browsing.search_by_filters(cuisine_type="Italian", location="Downtown", min_rating=4.0))
+        self.assertEqual(columnar.search_by_rating(4.0), self.browsing.search_by_rating(4.0))
+        self.assertEqual(list(columnar.database.get_restaurants()), self.database.get_restaurants())
+
+        row_id = columnar.database.add_restaurant({"name": "Curry Corner", "cuisine": "Indian", "location": "Midtown",
+                                                   "rating": 4.3, "price_range": "$$", "delivery": False})
+        columnar.database.update_restaurant(row_id, {"delivery": True, "price_range": "$"})
+        self.assertEqual(columnar.search_by_cuisine("Indian")[0]["delivery"], True)
+        self.assertEqual(columnar.search_by_cuisine("Indian")[0]["price_range"], "$")
+        columnar.database.remove_restaurant(row_id)
+        self.assertEqual(len(columnar.database.get_restaurants()), 5)
+
+    def test_columnar_rating_index_survives_rounded_ratings(self):
+        """
+        Test that a columnar rating that does not survive the 32-bit round trip can still be updated and
+        removed without leaving a stale entry in the rating index.
+        """
+        columnar = RestaurantBrowsing(RestaurantDatabase(storage="columnar"))
+        row_id = columnar.database.add_restaurant({"name": "Thali House", "cuisine": "Indian", "location": "Midtown",
+                                                   "rating": 4.666666, "delivery": True})
+        columnar.database.update_restaurant(row_id, {"rating": 3.333333})
+        self.assertEqual([r["name"] for r in columnar.search_by_rating_range(3.3, 3.4)], ["Thali House"])
+        self.assertEqual(columnar.search_by_rating_range(4.6, 4.7), [])
+        columnar.database.remove_restaurant(row_id)
+        self.assertEqual(columnar.search_by_rating_range(3.3, 3.4), [])
+        self.assertEqual(len(columnar.database._rating_index), 5)
+
+    def test_unfiltered_search_returns_a_list(self):
+        """
+        Test that a search without filters returns a list in both storage modes.
+        """
+        for storage in ("rows", "columnar"):
+            browsing = RestaurantBrowsing(RestaurantDatabase(storage=storage))
+            results = browsing.search_by_filters()
+            self.assertIsInstance(results, list)
+            self.assertEqual(len(results), 5)
+
+    def test_unsupported_storage_mode(self):
+        """
+        Test that an unknown storage mode is rejected.
+        """
+        with self.assertRaises(ValueError):
+            RestaurantDatabase(storage="parquet")
+
+    def test_vectorized_engine_matches_index_search(self):
+        """
+        Test that the vectorized engine returns the same restaurants as the index-based search, with
+        row and columnar storage alike.
+        """
+        for storage in ("rows", "columnar"):
+            database = RestaurantDatabase(storage=storage)
+            scanning = RestaurantBrowsing(database, engine=VectorizedFilterEngine(database))
+            for filters in ({"cuisine_type": "italian", "min_rating": 4.2}, {"location": "Downtown"},
+                            {"min_rating": 4.0}, {"cuisine_type": "Korean"}, {}):
+                self.assertEqual(list(scanning.search_by_filters(**filters)),
+                                 list(self.browsing.search_by_filters(**filters)))
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_vectorized_engine_uses_numpy_masks(self):
+        """
+        Test that the NumPy path skips removed rows and matches ratings stored as 32-bit floats.
+        """
+        database = RestaurantDatabase(storage="columnar")
+        engine = VectorizedFilterEngine(database)
+        self.assertTrue(engine.uses_numpy)
+        database.remove_restaurant(0)
+        self.assertEqual(engine.match_row_ids(location="Downtown", min_rating=4.2), [3])
+
+    def test_search_by_filters_pagination(self):
+        """
+        Test paging through results with a limit and the returned cursor.
+        """
+        page = self.browsing.search_by_filters(min_rating=4.0, limit=3)
+        self.assertEqual([restaurant['name'] for restaurant in page["results"]],
+                         ["Italian Bistro", "Sushi House", "Burger King"])
+        self.assertIsNotNone(page["next_cursor"])
+
+        page = self.browsing.search_by_filters(min_rating=4.0, limit=3, cursor=page["next_cursor"])
+        self.assertEqual([restaurant['name'] for restaurant in page["results"]], ["Taco Town"])
+        self.assertIsNone(page["next_cursor"])
+
+        page = self.browsing.search_by_location("Uptown", limit=1)
+        self.assertEqual(page["results"][0]['name'], "Burger King")
+        page = self.browsing.search_by_location("Uptown", limit=1, cursor=page["next_cursor"])
+        self.assertEqual(page, {"results": [self.database.get_restaurant(4)], "next_cursor": None})
+
+        with self.assertRaises(ValueError):
+            self.browsing.search_by_filters(limit=0)
+
+    def test_pages_seek_to_the_cursor(self):
+        """
+        Test that paging through a large result set returns every match once, in order, whichever filter
+        drives the search, and that a page only reads the rows it returns.
+        """
+        for i in range(3000):
+            self.database.add_restaurant({"name": f"Diner {i}", "cuisine": "Diner" if i % 3 else "Cafe",
+                                          "location": "Suburb", "rating": 3.0 + (i % 20) / 10})
+        expected = self.browsing.search_by_filters(cuisine_type="Diner", location="Suburb", min_rating=3.5)
+        for filters in ({"cuisine_type": "Diner", "location": "Suburb", "min_rating": 3.5},
+                        {"cuisine_type": "Diner", "min_rating": 3.5}, {"location": "Suburb", "min_rating": 4.8}):
+            results, cursor = [], None
+            while True:
+                page = self.browsing.search_by_filters(limit=250, cursor=cursor, **filters)
+                results.extend(page["results"])
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            self.assertEqual(results, self.browsing.search_by_filters(**filters))
+        self.assertEqual(len(expected), 1500)
+
+        with mock.patch.object(self.database, 'get_restaurant', wraps=self.database.get_restaurant) as reads:
+            page = self.browsing.search_by_filters(cuisine_type="Cafe", limit=10, cursor=2500)
+        self.assertEqual(len(page["results"]), 10)
+        self.assertEqual(reads.call_count, 11)  # The page, plus one look ahead for the next cursor.
+
+        # A rating-led page walks row ids from the cursor instead of sorting the whole rating slice.
+        for i in range(3):
+            self.database.add_restaurant({"name": f"Star {i}", "cuisine": "Bistro", "location": "Center",
+                                          "rating": 5.0})
+        with mock.patch.object(self.database, 'get_ids_by_rating', wraps=self.database.get_ids_by_rating) as slices:
+            page = self.browsing.search_by_rating(3.5, limit=10, cursor=2500)
+            rare = self.browsing.search_by_rating(4.95, limit=10)
+        self.assertEqual(slices.call_count, 1)  # Only the rare rating sorts its slice.
+        following = map(self.database.get_restaurant, range(2501, 2600))
+        self.assertEqual(page["results"], [restaurant for restaurant in following if restaurant['rating'] >= 3.5][:10])
+        self.assertEqual([restaurant['name'] for restaurant in rare["results"]], ["Star 0", "Star 1", "Star 2"])
+
+    def test_iter_by_filters_streams_lazily(self):
+        """
+        Test that streamed results match the full list and are produced on demand.
+        """
+        stream = self.browsing.iter_by_filters(cuisine_type="Italian")
+        self.assertEqual(next(stream)['name'], "Italian Bistro")
+        self.assertEqual([restaurant['name'] for restaurant in stream], ["Pizza Palace"])
+        self.assertEqual(list(self.browsing.iter_by_filters()), self.database.get_restaurants())
+
+    def test_search_nearby(self):
+        """
+        Test finding restaurants within a radius, closest first, as coordinates are added and changed.
+        """
+        for storage in ("rows", "columnar"):
+            database = RestaurantDatabase(storage=storage)
+            browsing = RestaurantBrowsing(database)
+            self.assertEqual(browsing.search_nearby(40.7128, -74.0060, 10), [])
+
+            near = database.add_restaurant({"name": "Corner Deli", "cuisine": "Deli", "location": "Downtown",
+                                            "rating": 4.1, "price_range": "$", "delivery": True,
+                                            "lat": 40.7130, "lon": -74.0070})
+            database.add_restaurant({"name": "Harbor Grill", "cuisine": "Seafood", "location": "Downtown",
+                                     "rating": 4.4, "price_range": "$$", "delivery": True,
+                                     "lat": 40.7000, "lon": -74.0150})
+            database.add_restaurant({"name": "Boston Chowder", "cuisine": "Seafood", "location": "Uptown",
+                                     "rating": 4.6, "price_range": "$$", "delivery": False,
+                                     "lat": 42.3601, "lon": -71.0589})
+
+            results = browsing.search_nearby(40.7128, -74.0060, 5)
+            self.assertEqual([restaurant['name'] for restaurant in results], ["Corner Deli", "Harbor Grill"])
+            self.assertEqual(len(browsing.search_nearby(40.7128, -74.0060, 5, limit=1)), 1)
+
+            database.update_restaurant(near, {"lat": 42.3600, "lon": -71.0600})
+            results = browsing.search_nearby(40.7128, -74.0060, 5)
+            self.assertEqual([restaurant['name'] for restaurant in results], ["Harbor Grill"])
+
+            # A radius that spans the globe visits the populated cells, not the 160 million cells it covers.
+            self.assertEqual(len(browsing.search_nearby(89.9, 0.0, 20000)), 3)
+
+    def test_search_nearest(self):
+        """
+        Test that the k-nearest search agrees with a full scan, including restaurants many cells away.
+        """
+        database = RestaurantDatabase()
+        points = [(40.0 + 0.37 * (i % 7), -74.0 + 0.53 * (i % 5)) for i in range(35)]
+        for i, (lat, lon) in enumerate(points):
+            database.add_restaurant({"name": f"Spot {i}", "cuisine": "Deli", "location": "Downtown",
+                                     "rating": 4.0, "price_range": "$", "delivery": True, "lat": lat, "lon": lon})
+        browsing = RestaurantBrowsing(database)
+
+        expected = sorted(range(35), key=lambda i: (haversine_km(41.0, -73.2, *points[i]), i))[:4]
+        results = browsing.search_nearest(41.0, -73.2, 4)
+        self.assertEqual([restaurant['name'] for restaurant in results], [f"Spot {i}" for i in expected])
+        self.assertEqual(len(browsing.search_nearest(41.0, -73.2, 100)), 35)
+
+    def test_search_text(self):
+        """
+        Test full-text search over names, cuisines, and dishes, with a prefix match on the last word.
+        """
+        results = self.browsing.search_text("pizza")
+        self.assertEqual([restaurant['name'] for restaurant in results], ["Pizza Palace", "Italian Bistro"])
+
+        results = self.browsing.search_text("Chicken Q")
+        self.assertEqual([restaurant['name'] for restaurant in results], ["Taco Town"])
+
+        self.assertEqual(self.browsing.search_text("itali", limit=1)[0]['name'], "Italian Bistro")
+        self.assertEqual(self.browsing.search_text("pizza sushi"), [])
+        self.assertEqual(self.browsing.search_text("  "), [])
+
+    def test_text_index_follows_mutations(self):
+        """
+        Test that the inverted index and typeahead suggestions stay correct as restaurants change.
+        """
+        self.assertEqual(self.browsing.suggest_terms("Pi"), ["pizza"])
+        row_id = self.database.add_restaurant({"name": "Pita Place", "cuisine": "Greek", "location": "Midtown",
+                                               "rating": 4.1, "price_range": "$", "delivery": True,
+                                               "dishes": ["Gyro Pita"]})
+        self.assertEqual(self.browsing.suggest_terms("pi"), ["pita", "pizza"])
+
+        self.database.update_restaurant(row_id, {"dishes": ["Souvlaki"]})
+        self.assertEqual(self.browsing.search_text("souv")[0]['name'], "Pita Place")
+
+        self.database.remove_restaurant(row_id)
+        self.assertEqual(self.browsing.suggest_terms("pi"), ["pizza"])
+        self.assertEqual(self.browsing.search_text("souvlaki"), [])
+
+    def test_apply_changes(self):
+        """
+        Test applying a batch of changes, and that an invalid batch leaves the database untouched.
+        """
+        version = self.database.version
+        row_ids = self.database.apply_changes([
+            ("add", {"name": "Curry Corner", "cuisine": "Indian", "location": "Midtown", "rating": 4.3,
+                     "price_range": "$$", "delivery": True}),
+            ("update", 0, {"rating": 3.5}),
+            ("update", 5, {"rating": 4.9}),
+            ("remove", 1),
+        ])
+        self.assertEqual(row_ids, [5, None, None, None])
+        self.assertEqual(self.database.version, version + 1)
+        self.assertEqual([restaurant['name'] for restaurant in self.browsing.search_top_rated(2)],
+                         ["Curry Corner", "Taco Town"])
+        self.assertEqual([restaurant['name'] for restaurant in self.browsing.search_by_location("Midtown")],
+                         ["Curry Corner"])
+        self.assertEqual(len(self.database.get_restaurants()), 5)
+
+        with self.assertRaises(KeyError):
+            self.database.apply_changes([("update", 2, {"rating": 1.0}), ("remove", 1)])
+        self.assertEqual(self.database.get_restaurant(2)['rating'], 4.0)
+        with self.assertRaises(ValueError):
+            self.database.apply_changes([("rename", 2)])
+
+    def test_malformed_record_in_batch_leaves_database_untouched(self):
+        """
+        Test that a malformed record in the middle of a batch is rejected before any change is applied.
+        """
+        good = {"name": "Curry Corner", "cuisine": "Indian", "location": "Midtown", "rating": 4.3}
+        bad_batches = [
+            [("add", good), ("add", {"name": "No Cuisine", "location": "Midtown", "rating": 4.0}), ("remove", 1)],
+            [("add", good), ("add", dict(good, rating="high")), ("remove", 1)],
+            [("update", 0, {"rating": 3.5}), ("update", 2, {"cuisine": None}), ("remove", 1)],
+            [("add", good), ("add", dict(good, dishes=[1, 2])), ("remove", 1)],
+        ]
+        for storage in ("rows", "columnar"):
+            database = RestaurantDatabase(storage=storage)
+            browsing = RestaurantBrowsing(database)
+            for batch in bad_batches:
+                with self.subTest(storage=storage, batch=batch):
+                    version = database.version
+                    with self.assertRaises(ValueError):
+                        database.apply_changes(batch)
+                    self.assertEqual(database.version, version)
+                    self.assertEqual(len(database.get_restaurants()), 5)
+                    self.assertEqual(browsing.search_by_cuisine("Indian"), [])
+                    self.assertEqual(database.get_restaurant(0)['rating'], 4.5)
+                    self.assertEqual(database.get_restaurant(1)['name'], "Sushi House")
+            with self.assertRaises(ValueError):
+                database.add_restaurant({"name": "Half a Row", "cuisine": "Thai"})
+            with self.assertRaises(ValueError):
+                database.update_restaurant(0, {"rating": None})
+            self.assertEqual(len(database.get_restaurants()), 5)
+            self.assertEqual(database.get_restaurant(0)['rating'], 4.5)
+
+    def test_remove_keeps_list_and_indexes_consistent(self):
+        """
+        Test that removing restaurants from the middle of the list keeps every lookup correct.
+        """
+        self.database.remove_restaurant(0)
+        self.database.remove_restaurant(3)
+        self.assertEqual(sorted(restaurant['name'] for restaurant in self.database.get_restaurants()),
+                         ["Burger King", "Pizza Palace", "Sushi House"])
+        # The list has the last restaurant in the freed slot, but every search keeps the order they were added.
+        self.assertEqual([restaurant['name'] for restaurant in self.database.get_restaurants()],
+                         ["Pizza Palace", "Sushi House", "Burger King"])
+        added_order = ["Sushi House", "Burger King", "Pizza Palace"]
+        self.assertEqual([restaurant['name'] for restaurant in self.browsing.search_by_filters()], added_order)
+        self.assertEqual([restaurant['name'] for restaurant in self.browsing.iter_by_filters()], added_order)
+        self.assertEqual([restaurant['name'] for restaurant in self.browsing.search_by_filters(limit=5)["results"]],
+                         added_order)
+        self.assertEqual([restaurant['name'] for restaurant in self.browsing.search_by_rating(0)],
+                         ["Sushi House", "Burger King", "Pizza Palace"])
+        self.database.remove_restaurant(4)
+        self.database.remove_restaurant(2)
+        self.database.remove_restaurant(1)
+        self.assertEqual(self.database.get_restaurants(), [])
+
+    def test_sorted_index_list(self):
+        """
+        Test that the chunked sorted list behaves like a flat sorted list across chunk splits.
+        """
+        values = [(i * 7919) % 2003 for i in range(2003)]
+        index = SortedIndexList()
+        for value in values:
+            index.add(value)
+        for value in values[::3]:
+            self.assertTrue(index.discard(value))
+        self.assertFalse(index.discard(5000))
+        expected = sorted(set(values) - set(values[::3]))
+        self.assertEqual(list(index), expected)
+        self.assertEqual(index.bisect_left(1000), bisect.bisect_left(expected, 1000))
+        self.assertEqual(index.bisect_right(1000), bisect.bisect_right(expected, 1000))
+        self.assertEqual(list(index.islice(500, 900)), expected[500:900])
+        self.assertEqual(list(index.iter_after(1000)), expected[bisect.bisect_right(expected, 1000):])
+        self.assertEqual(list(index.iter_after()), expected)
+
+    def test_search_is_case_insensitive(self):
+        """
+        Test that the cuisine and location indexes ignore the case of the search term.
+        """
+        results = self.browsing.search_by_filters(cuisine_type="iTaLiAn", location="UPTOWN")
+        self.assertEqual([restaurant['name'] for restaurant in results], ["Pizza Palace"])
+
+    def test_indexes_follow_mutations(self):
+        """
+        Test that the secondary indexes stay correct when restaurants are added, updated, and removed.
+        """
+        row_id = self.database.add_restaurant({"name": "Curry Corner", "cuisine": "Indian", "location": "Midtown",
+                                               "rating": 4.3, "price_range": "$$", "delivery": True})
+        self.assertEqual(len(self.browsing.search_by_location("Midtown")), 2)
+
+        self.database.update_restaurant(row_id, {"location": "Downtown", "rating": 4.9})
+        self.assertEqual(len(self.browsing.search_by_location("Midtown")), 1)
+        self.assertEqual(len(self.browsing.search_by_location("Downtown")), 3)
+        self.assertEqual(self.browsing.search_top_rated(1)[0]['name'], "Curry Corner")
+
+        self.database.remove_restaurant(row_id)
+        self.assertEqual(self.browsing.search_by_cuisine("Indian"), [])
+        self.assertEqual(len(self.browsing.search_by_location("Downtown")), 2)
+        self.assertEqual(len(self.database.get_restaurants()), 5)
+        self.assertEqual(len(self.browsing.search_by_rating(0)), 5)
+
+
+class TestRestaurantSearch(unittest.TestCase):
+    """
+    Unit tests for the RestaurantSearch class and its result cache.
+    """
+
+    def setUp(self):
+        """
+        Set up the test case by initializing a RestaurantDatabase, RestaurantBrowsing, and RestaurantSearch instance.
+        """
+        self.database = RestaurantDatabase()
+        self.search = RestaurantSearch(RestaurantBrowsing(self.database), cache_size=2)
+
+    def test_repeated_search_is_cached(self):
+        """
+        Test that searches differing only in letter case share one cache entry.
+        """
+        first = self.search.search_restaurants(cuisine="Italian", location="Downtown", rating=4.0)
+        second = self.search.search_restaurants(cuisine="italian", location="DOWNTOWN", rating=4)
+        self.assertEqual(first, second)
+        self.assertEqual(self.search.cache_info(), {"hits": 1, "misses": 1, "size": 1, "max_size": 2})
+
+    def test_mutation_invalidates_cache(self):
+        """
+        Test that a change to the database is never hidden by a cached result.
+        """
+        self.assertEqual(len(self.search.search_restaurants(location="Midtown")), 1)
+        self.database.add_restaurant({"name": "Curry Corner", "cuisine": "Indian", "location": "Midtown",
+                                      "rating": 4.3, "price_range": "$$", "delivery": True})
+        self.assertEqual(len(self.search.search_restaurants(location="Midtown")), 2)
+        self.assertEqual(self.search.hits, 0)
+
+    def test_lru_eviction_and_ttl(self):
+        """
+        Test that the least recently used entry is evicted first and that expired entries are recomputed.
+        """
+        self.search.search_restaurants(cuisine="Italian")
+        self.search.search_restaurants(cuisine="Mexican")
+        self.search.search_restaurants(cuisine="Italian")
+        self.search.search_restaurants(cuisine="Japanese")  # Evicts "Mexican", the least recently used.
+        self.search.search_restaurants(cuisine="Mexican")
+        self.assertEqual((self.search.hits, self.search.misses), (1, 4))
+
+        self.search.ttl = 60
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 120):
+            self.search.search_restaurants(cuisine="Mexican")
+        self.assertEqual(self.search.misses, 5)
+
 
 if __name__ == '__main__':
     unittest.main()
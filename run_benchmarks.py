@@ -0,0 +1,323 @@
+import asyncio
+import datetime
+import os
+import random
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+
+from Order_Placement import (ArrayCart, Cart, OrderIdGenerator, OrderPlacement, OrderStore, RestaurantMenu,
+                             UserProfile)
+from Payment_Processing import (CardValidator, FakeGatewayServer, GatewayRegistry, Money, PaymentBatcher,
+                                PaymentGateway, PaymentProcessing, SimulatedGateway)
+
+CARD_EXPIRY = f"12/{datetime.date.today().year + 5}"  # A few years ahead, so the card never expires.
+
+
+def benchmark_money_totals(line_items=1_000_000, items_per_cart=10, repeat=5):
+    """
+    Compares totalling carts in exact integer cents against the same totals worked out in binary floats.
+
+    Both paths start from carts that are already filled, so only the totalling is timed. The "float" path
+    is the original one: each cart's subtotal, tax and total are computed in floats, and the tax is
+    rounded to the cent. The "money" path calls Cart.calculate_total_cents, which reads the running
+    subtotal and rounds the tax in integer arithmetic, and the "array" path does the same on ArrayCart,
+    which sums its price and quantity buffers on every call. The money paths build a Money object only
+    once, for the grand total.
+
+    Args:
+        line_items (int, optional): The total number of line items across every cart.
+        items_per_cart (int, optional): The number of distinct items in each cart.
+        repeat (int, optional): How many times each path is timed; the best time is reported.
+
+    Returns:
+        dict: The best time in seconds for the "float", "money" and "array" paths.
+    """
+    rng = random.Random(0)
+    carts = line_items // items_per_cart
+    orders = [[(f"Item {i}", rng.randrange(100, 5000) / 100, rng.randrange(1, 5)) for i in range(items_per_cart)]
+              for _ in range(carts)]
+    float_carts = [[(price, quantity) for _, price, quantity in lines] for lines in orders]
+    money_carts, array_carts = [], []
+    for lines in orders:
+        cart, array_cart = Cart(), ArrayCart()
+        for name, price, quantity in lines:
+            cart.add_item(name, price, quantity)
+            array_cart.add_item(name, price, quantity)
+        money_carts.append(cart)
+        array_carts.append(array_cart)
+
+    def float_totals():
+        grand_total = 0.0
+        for lines in float_carts:
+            subtotal = sum(price * quantity for price, quantity in lines)
+            tax = round(subtotal * 0.10, 2)
+            grand_total += subtotal + tax + 5.0
+        return grand_total
+
+    def cents_totals(carts):
+        def run():
+            grand_total = 0
+            for cart in carts:
+                grand_total += cart.calculate_total_cents()["total"]
+            return Money(grand_total)
+        return run
+
+    results = {
+        "float": min(timeit.repeat(float_totals, number=1, repeat=repeat)),
+        "money": min(timeit.repeat(cents_totals(money_carts), number=1, repeat=repeat)),
+        "array": min(timeit.repeat(cents_totals(array_carts), number=1, repeat=repeat)),
+    }
+    print(f"Totalling {carts} carts with {carts * items_per_cart} line items: "
+          + ", ".join(f"{path} {seconds:.3f}s ({seconds / carts * 1e6:.2f} us per cart)"
+                      for path, seconds in results.items()))
+    return results
+
+
+def benchmark_cart_memory(carts=10_000, items_per_cart=20):
+    """
+    Compares the memory held by many resident carts in the default layout and the struct-of-arrays layout.
+
+    Args:
+        carts (int, optional): The number of carts to keep resident.
+        items_per_cart (int, optional): The number of distinct items in each cart.
+
+    Returns:
+        dict: The bytes allocated for the "Cart" and "ArrayCart" layouts.
+    """
+    menu = [(f"Menu item {i}", round(5 + i * 0.75, 2)) for i in range(items_per_cart)]
+    results = {}
+    for cart_class in (Cart, ArrayCart):
+        tracemalloc.start()
+        resident = []
+        for _ in range(carts):
+            cart = cart_class()
+            for name, price in menu:
+                cart.add_item(name, price, 2)
+            resident.append(cart)
+        results[cart_class.__name__] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del resident
+    print(f"{carts} carts of {items_per_cart} items: Cart {results['Cart'] / 2**20:.1f} MiB, "
+          f"ArrayCart {results['ArrayCart'] / 2**20:.1f} MiB")
+    return results
+
+
+def benchmark_order_ids(ids=1_000_000, threads=4):
+    """
+    Measures how many order IDs one thread, and several threads sharing a generator, produce per second.
+
+    Args:
+        ids (int, optional): The number of IDs each run generates in total.
+        threads (int, optional): The number of threads sharing the generator in the concurrent run.
+
+    Returns:
+        dict: IDs per second for the "int", "str" and "threaded" runs.
+    """
+    generator = OrderIdGenerator()
+    results = {
+        "int": ids / min(timeit.repeat(generator.next_int, number=ids, repeat=3)),
+        "str": ids / min(timeit.repeat(generator.next_id, number=ids, repeat=3)),
+    }
+
+    def generate():
+        next_id = generator.next_id
+        for _ in range(ids // threads):
+            next_id()
+
+    workers = [threading.Thread(target=generate) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results["threaded"] = ids / (time.perf_counter() - start)
+    print(f"Order IDs per second: {results['int']:,.0f} as integers, {results['str']:,.0f} as strings, "
+          f"{results['threaded']:,.0f} as strings across {threads} threads")
+    return results
+
+
+def benchmark_async_checkout(concurrency_levels=(1, 10, 100, 1000, 5000), checkouts=5000, latency=0.05):
+    """
+    Measures checkout throughput on one event loop as the number of checkouts in flight grows.
+
+    Each checkout confirms an order whose payment goes through PaymentProcessing.process_payment_async to a
+    simulated gateway with a fixed round-trip time.
+
+    Args:
+        concurrency_levels (tuple, optional): The numbers of checkouts allowed in flight at once.
+        checkouts (int, optional): The most checkouts run at each level (fewer at low levels, to keep runs short).
+        latency (float, optional): The simulated gateway round-trip time in seconds.
+
+    Returns:
+        dict: Checkouts per second for each concurrency level.
+    """
+    menu = RestaurantMenu(available_items=["Burger", "Pizza"])
+    processing = PaymentProcessing(async_gateway=SimulatedGateway(latency=latency))
+    card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+    class GatewayPayment:
+        async def process_payment_async(self, amount):
+            message = await processing.process_payment_async({"total_amount": amount}, "credit_card", card)
+            return message == "Payment successful, Order confirmed"
+
+    async def run(concurrency, count):
+        limit = asyncio.Semaphore(concurrency)
+        payment = GatewayPayment()
+
+        async def checkout():
+            async with limit:
+                cart = Cart()
+                cart.add_item("Burger", 8.99, 2)
+                return await OrderPlacement(cart, UserProfile("1 Main St"), menu).confirm_order_async(payment)
+
+        results = await asyncio.gather(*(checkout() for _ in range(count)))
+        assert all(result["success"] for result in results)
+
+    results = {}
+    for concurrency in concurrency_levels:
+        count = min(checkouts, concurrency * 20)
+        start = time.perf_counter()
+        asyncio.run(run(concurrency, count))
+        results[concurrency] = count / (time.perf_counter() - start)
+        print(f"{concurrency} checkouts in flight: {results[concurrency]:,.0f} checkouts/s "
+              f"(gateway round trip {latency * 1000:.0f} ms)")
+    return results
+
+
+def benchmark_gateway_pooling(payments=200, connect_latency=0.005, latency=0.001):
+    """
+    Compares paying over keep-alive pooled connections with opening a fresh connection for every payment.
+
+    Args:
+        payments (int, optional): The number of payments made in each run.
+        connect_latency (float, optional): Seconds the fake server takes to open a connection.
+        latency (float, optional): Seconds the fake server takes to answer a payment.
+
+    Returns:
+        dict: Mean seconds per payment for the "pooled" and "fresh" runs.
+    """
+    card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+    results = {}
+    for label, max_idle in (("pooled", 30.0), ("fresh", -1.0)):  # A negative idle limit never reuses a connection.
+        server = FakeGatewayServer(latency=latency, connect_latency=connect_latency)
+        gateway = PaymentGateway("credit_card", server.connect, max_idle=max_idle)
+        processing = PaymentProcessing(gateways=GatewayRegistry([gateway]))
+        start = time.perf_counter()
+        for _ in range(payments):
+            processing.process_payment({"total_amount": 12.5}, "credit_card", card)
+        results[label] = (time.perf_counter() - start) / payments
+    print(f"Payment over a pooled connection {results['pooled'] * 1000:.2f} ms, "
+          f"over a fresh connection {results['fresh'] * 1000:.2f} ms")
+    return results
+
+
+def benchmark_card_validation(cards=200_000, repeat=3):
+    """
+    Compares checking card numbers one at a time with checking them as one batch.
+
+    Args:
+        cards (int, optional): The number of card numbers to check.
+        repeat (int, optional): How many times each run is timed; the best time is reported.
+
+    Returns:
+        dict: The best time in seconds for the "per_card" and "batch" runs.
+    """
+    rng = random.Random(0)
+    validator = CardValidator()
+    card_numbers = ["".join(rng.choice("0123456789") for _ in range(16)) for _ in range(cards)]
+    results = {
+        "per_card": min(timeit.repeat(lambda: [validator.validate({"card_number": number, "cvv": "123",
+                                                                    "expiry_date": CARD_EXPIRY})["valid"]
+                                               for number in card_numbers], number=1, repeat=repeat)),
+        "batch": min(timeit.repeat(lambda: validator.validate_numbers(card_numbers), number=1, repeat=repeat)),
+    }
+    print(f"Validating {cards} card numbers: one at a time {results['per_card']:.3f}s, "
+          f"as a batch {results['batch']:.3f}s")
+    return results
+
+
+def benchmark_payment_batching(callers=64, payments_per_caller=20, latency=0.002, max_connections=8):
+    """
+    Compares payment throughput with and without micro-batching, with many callers paying at once.
+
+    Args:
+        callers (int, optional): The number of threads paying concurrently.
+        payments_per_caller (int, optional): The number of payments each thread makes.
+        latency (float, optional): Seconds the fake server takes per request, batched or not.
+        max_connections (int, optional): The size of the gateway's connection pool.
+
+    Returns:
+        dict: Payments per second for the "single" and "batched" runs.
+    """
+    card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+    results = {}
+    for label, batcher in (("single", None), ("batched", PaymentBatcher(max_batch_size=32, max_wait=0.002))):
+        server = FakeGatewayServer(latency=latency)
+        gateway = PaymentGateway("credit_card", server.connect, max_connections=max_connections)
+        processing = PaymentProcessing(gateways=GatewayRegistry([gateway]), batcher=batcher)
+
+        def pay():
+            for _ in range(payments_per_caller):
+                processing.process_payment({"total_amount": 12.5}, "credit_card", card)
+
+        threads = [threading.Thread(target=pay) for _ in range(callers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[label] = callers * payments_per_caller / (time.perf_counter() - start)
+        print(f"{label}: {results[label]:,.0f} payments/s in {server.requests} gateway requests")
+        if batcher is not None:
+            batcher.close()
+    return results
+
+
+def benchmark_order_store(writers=(1, 16, 64), orders=4000):
+    """
+    Measures durable order writes per second as the number of concurrent writers grows.
+
+    Every write waits for its fsync; concurrent writers share fsyncs through group commit.
+
+    Args:
+        writers (tuple, optional): The numbers of threads writing at once.
+        orders (int, optional): The number of orders written in each run.
+
+    Returns:
+        dict: Orders per second for each number of writers.
+    """
+    generator = OrderIdGenerator()
+    results = {}
+    for count in writers:
+        with tempfile.TemporaryDirectory() as directory:
+            store = OrderStore(os.path.join(directory, "orders.log"))
+
+            def write(per_writer=orders // count):
+                for _ in range(per_writer):
+                    store.append({"order_id": generator.next_id(), "email": "ada@example.com",
+                                  "created_at": int(time.time() * 1000), "total_cents": 2700})
+
+            threads = [threading.Thread(target=write) for _ in range(count)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[count] = len(store) / (time.perf_counter() - start)
+            print(f"{count} writers: {results[count]:,.0f} durable orders/s in {store.commits} fsyncs")
+            store.close()
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_money_totals()
+    benchmark_cart_memory()
+    benchmark_order_ids()
+    benchmark_async_checkout()
+    benchmark_gateway_pooling()
+    benchmark_card_validation()
+    benchmark_payment_batching()
+    benchmark_order_store()
@@ -1,114 +1,2277 @@
+import asyncio
+import datetime
+import functools
+import hashlib
+import json
+import os
+import random
+import shelve
+import tempfile
+import threading
+import time
+import queue
 import unittest
+import urllib.request
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import (ROUND_05UP, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_DOWN, ROUND_HALF_EVEN,
+                     ROUND_HALF_UP, ROUND_UP, Decimal)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock  # Import the mock module to simulate payment gateway responses.
 
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; CardValidator falls back to pure Python without it.
+    np = None
+
+DEFAULT_ROUNDING = ROUND_HALF_UP  # Any rounding mode from the decimal module can be used instead.
+_HALF_ROUNDINGS = frozenset({ROUND_HALF_UP, ROUND_HALF_DOWN, ROUND_HALF_EVEN})
+DECLINED_CARD_NUMBERS = frozenset({"1111222233334444"})  # Cards the simulated gateways always decline.
+
+
+# Money Class
+@functools.total_ordering
+class Money:
+    """
+    An exact amount of money, held as an integer number of cents.
+    
+    Sums of Money values never drift the way binary floats do, so totals reconcile to the cent without
+    a re-rounding pass. Rounding only happens when an amount is converted from another type or
+    multiplied by a rate, and the rounding mode can be chosen each time.
+    
+    Attributes:
+        cents (int): The amount in cents.
+    """
+    __slots__ = ("cents",)
+
+    def __init__(self, cents):
+        """
+        Initializes a Money object from a whole number of cents.
+        
+        Args:
+            cents (int): The amount in cents.
+        
+        Raises:
+            TypeError: If cents is not an integer.
+        """
+        if not isinstance(cents, int):
+            raise TypeError("Money must be created from an integer number of cents")
+        self.cents = cents
+
+    @classmethod
+    def from_amount(cls, amount, rounding=DEFAULT_ROUNDING):
+        """
+        Creates a Money object from an amount in dollars.
+        
+        Args:
+            amount (Money, int, float, str, or Decimal): The amount in dollars (e.g., 12.99 or "12.99").
+            rounding (str, optional): The decimal rounding mode for amounts with fractions of a cent.
+        
+        Returns:
+            Money: The amount, rounded to the cent.
+        """
+        if isinstance(amount, Money):
+            return amount
+        return cls(cls.to_cents(amount, rounding))
+
+    @staticmethod
+    def to_cents(amount, rounding=DEFAULT_ROUNDING):
+        """
+        Converts an amount in dollars to a whole number of cents.
+        
+        Floats are read by their shortest decimal representation, so 1.005 is treated as exactly
+        1.005 rather than the binary value just below it.
+        
+        Args:
+            amount (Money, int, float, str, or Decimal): The amount in dollars.
+            rounding (str, optional): The decimal rounding mode for amounts with fractions of a cent.
+        
+        Returns:
+            int: The amount in cents.
+        
+        Raises:
+            ValueError: If the amount cannot be read as a number.
+        """
+        if isinstance(amount, Money):
+            return amount.cents
+        if isinstance(amount, bool):
+            raise ValueError(f"Invalid amount: {amount!r}")
+        if isinstance(amount, int):
+            return amount * 100
+        if isinstance(amount, float):
+            # Fast path: prices with at most two decimals land within float error of a whole cent.
+            scaled = amount * 100
+            cents = round(scaled)
+            if abs(scaled - cents) < 1e-6:
+                return cents
+            amount = repr(amount)
+        try:
+            value = Decimal(amount)
+        except (ArithmeticError, TypeError, ValueError):
+            raise ValueError(f"Invalid amount: {amount!r}") from None
+        if not value.is_finite():
+            raise ValueError(f"Invalid amount: {amount!r}")
+        return int(value.scaleb(2).quantize(Decimal(1), rounding=rounding))
+
+    def apply_rate(self, rate, rounding=DEFAULT_ROUNDING):
+        """
+        Multiplies the amount by a rate (e.g., a tax rate) and rounds the result to the cent.
+        
+        Args:
+            rate (float, str, or Decimal): The rate to apply (e.g., 0.10 for 10%).
+            rounding (str, optional): The decimal rounding mode.
+        
+        Returns:
+            Money: The rounded product.
+        """
+        rate = rate if isinstance(rate, Decimal) else Decimal(str(rate))
+        numerator, denominator = rate.as_integer_ratio()
+        return Money(Money.round_ratio(self.cents * numerator, denominator, rounding))
+
+    @staticmethod
+    def round_ratio(numerator, denominator, rounding=DEFAULT_ROUNDING):
+        """
+        Divides two integers and rounds the quotient to a whole number, the way Decimal.quantize would.
+        
+        Works on plain integers only, so rounding a tax to the cent costs a divmod rather than a Decimal
+        multiplication and quantize.
+        
+        Args:
+            numerator (int): The dividend (e.g., an amount in cents times a rate's numerator).
+            denominator (int): The divisor; must be positive.
+            rounding (str, optional): The decimal rounding mode.
+        
+        Returns:
+            int: The rounded quotient.
+        
+        Raises:
+            ValueError: If the rounding mode is unknown.
+        """
+        quotient, remainder = divmod(numerator, denominator)  # Floors, so the remainder is never negative.
+        if not remainder:
+            return quotient
+        negative = numerator < 0
+        if rounding in _HALF_ROUNDINGS:
+            twice = remainder * 2
+            if twice != denominator:
+                return quotient + 1 if twice > denominator else quotient
+            if rounding == ROUND_HALF_EVEN:
+                return quotient + (quotient & 1)
+            away = rounding == ROUND_HALF_UP
+        elif rounding == ROUND_FLOOR:
+            return quotient
+        elif rounding == ROUND_CEILING:
+            return quotient + 1
+        elif rounding == ROUND_05UP:
+            toward_zero = quotient + 1 if negative else quotient
+            away = abs(toward_zero) % 5 == 0
+        elif rounding in (ROUND_UP, ROUND_DOWN):
+            away = rounding == ROUND_UP
+        else:
+            raise ValueError(f"Unknown rounding mode: {rounding!r}")
+        return quotient + (away != negative)  # Away from zero is up for positive amounts, down for negative ones.
+
+    def to_decimal(self):
+        """
+        Returns:
+            Decimal: The exact amount in dollars.
+        """
+        return Decimal(self.cents).scaleb(-2)
+
+    def __add__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents + other.cents)
+        if other == 0:
+            return self  # Lets sum() start from its default of 0.
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents - other.cents)
+        return NotImplemented
+
+    def __mul__(self, quantity):
+        if isinstance(quantity, int) and not isinstance(quantity, bool):
+            return Money(self.cents * quantity)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.cents == other.cents
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, Money):
+            return self.cents < other.cents
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __float__(self):
+        return self.cents / 100
+
+    def __format__(self, format_spec):
+        return format(float(self), format_spec) if format_spec else str(self)
+
+    def __str__(self):
+        sign = "-" if self.cents < 0 else ""
+        dollars, cents = divmod(abs(self.cents), 100)
+        return f"{sign}${dollars}.{cents:02d}"
+
+    def __repr__(self):
+        return f"Money('{self.to_decimal()}')"
+
+
+# CardValidator Class
+class CardValidator:
+    """
+    Validates payment card numbers, expiry dates and CVVs.
+    
+    Card numbers must pass the Luhn checksum, computed with precomputed digit tables, and have a length
+    their card network allows. The network is found by walking a trie of the issuer (BIN/IIN) prefixes
+    digit by digit; numbers no network claims are accepted at any length from 12 to 19 digits. Expiry
+    dates are read as MM/YY or MM/YYYY, and a card is valid through the end of its expiry month.
+    
+    validate_numbers checks many card numbers at once, as NumPy array operations when NumPy is installed.
+    
+    Attributes:
+        networks (list): The card networks, as dictionaries with 'name', 'prefixes' (digit strings or
+                         'low-high' ranges of equal length), 'lengths', and 'cvv_length'.
+    """
+    NETWORKS = [
+        {"name": "visa", "prefixes": ["4"], "lengths": (13, 16, 19), "cvv_length": 3},
+        {"name": "mastercard", "prefixes": ["51-55", "2221-2720"], "lengths": (16,), "cvv_length": 3},
+        {"name": "amex", "prefixes": ["34", "37"], "lengths": (15,), "cvv_length": 4},
+        {"name": "discover", "prefixes": ["6011", "644-649", "65"], "lengths": (16, 19), "cvv_length": 3},
+        {"name": "diners", "prefixes": ["300-305", "36", "38-39"], "lengths": (14, 16, 19), "cvv_length": 3},
+        {"name": "jcb", "prefixes": ["3528-3589"], "lengths": (16, 17, 18, 19), "cvv_length": 3},
+        {"name": "unionpay", "prefixes": ["62"], "lengths": (16, 17, 18, 19), "cvv_length": 3},
+    ]
+    UNKNOWN_NETWORK = {"name": None, "prefixes": [], "lengths": tuple(range(12, 20)), "cvv_length": 3}
+    MAX_LENGTH = 19
+    PREFIX_DIGITS = 6  # The most digits any prefix has.
+    LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)  # The digit sum of twice each digit.
+    _LUHN_PLAIN_BY_CHAR = dict(zip("0123456789", range(10)))
+    _LUHN_DOUBLED_BY_CHAR = dict(zip("0123456789", LUHN_DOUBLED))
+
+    def __init__(self, networks=None):
+        """
+        Initializes a CardValidator, building its prefix trie and, for batches, its prefix range table.
+        
+        Args:
+            networks (list, optional): The card networks to recognize. Defaults to NETWORKS.
+        
+        Raises:
+            ValueError: If two networks claim overlapping prefixes.
+        """
+        self.networks = networks or self.NETWORKS
+        self._trie = {}
+        ranges = []
+        for network in self.networks:
+            for prefix in network["prefixes"]:
+                low, _, high = prefix.partition("-")
+                high = high or low
+                for value in range(int(low), int(high) + 1):
+                    node = self._trie
+                    for digit in str(value).zfill(len(low)):
+                        node = node.setdefault(digit, {})
+                    node[None] = network
+                padding = self.PREFIX_DIGITS - len(low)
+                ranges.append((int(low) * 10 ** padding, (int(high) + 1) * 10 ** padding - 1, network))
+        ranges.sort(key=lambda prefix_range: prefix_range[0])
+        for (_, high, _), (low, _, _) in zip(ranges, ranges[1:]):
+            if low <= high:
+                raise ValueError("Card network prefixes must not overlap")
+        self._ranges = ranges
+
+    def identify(self, card_number):
+        """
+        Finds the card network that issued a card number, by its longest matching prefix.
+        
+        Args:
+            card_number (str): The card number, digits only.
+        
+        Returns:
+            dict: The card network, or UNKNOWN_NETWORK if no network claims the number.
+        """
+        network = self.UNKNOWN_NETWORK
+        node = self._trie
+        for digit in card_number[:self.PREFIX_DIGITS]:
+            node = node.get(digit)
+            if node is None:
+                break
+            network = node.get(None, network)
+        return network
+
+    @classmethod
+    def luhn_valid(cls, card_number):
+        """
+        Checks a card number's Luhn checksum.
+        
+        Args:
+            card_number (str): The card number, digits only.
+        
+        Returns:
+            bool: True if the checksum digit is right.
+        """
+        total = sum(map(cls._LUHN_PLAIN_BY_CHAR.__getitem__, card_number[::-2]))
+        total += sum(map(cls._LUHN_DOUBLED_BY_CHAR.__getitem__, card_number[-2::-2]))
+        return total % 10 == 0
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)  # Batches repeat the same few expiry dates over and over.
+    def parse_expiry(expiry_date):
+        """
+        Reads an expiry date written as MM/YY or MM/YYYY.
+        
+        Args:
+            expiry_date (str): The expiry date (e.g., '12/27' or '12/2027').
+        
+        Returns:
+            tuple: The (year, month) of the expiry date.
+        
+        Raises:
+            ValueError: If the date is not in either format or the month is not 1 to 12.
+        """
+        month, separator, year = expiry_date.strip().partition("/")
+        if (not separator or len(month) not in (1, 2) or len(year) not in (2, 4)
+                or not (month + year).isdigit() or not (month + year).isascii() or not 1 <= int(month) <= 12):
+            raise ValueError("Invalid expiry date")
+        return (2000 + int(year) if len(year) == 2 else int(year)), int(month)
+
+    def validate(self, details, today=None):
+        """
+        Validates one card's details.
+        
+        Args:
+            details (dict): A dictionary containing 'card_number', 'expiry_date', and 'cvv'.
+            today (datetime.date, optional): The date to check expiry against. Defaults to today.
+        
+        Returns:
+            dict: 'valid' (bool), 'network' (the network name, or None), and 'message' (why the card is
+                  invalid, or "Valid card").
+        """
+        card_number = self.normalize(details.get("card_number", ""))
+        if not self._number_valid(card_number):
+            return {"valid": False, "network": None, "message": "Invalid card number"}
+        network = self.identify(card_number)
+        cvv = details.get("cvv", "")
+        if len(cvv) != network["cvv_length"] or not cvv.isdigit():
+            return {"valid": False, "network": network["name"], "message": "Invalid CVV"}
+        try:
+            expires = self.parse_expiry(details.get("expiry_date", ""))
+        except ValueError as e:
+            return {"valid": False, "network": network["name"], "message": str(e)}
+        today = today or datetime.date.today()
+        if expires < (today.year, today.month):
+            return {"valid": False, "network": network["name"], "message": "Card has expired"}
+        return {"valid": True, "network": network["name"], "message": "Valid card"}
+
+    def validate_numbers(self, card_numbers):
+        """
+        Checks many card numbers at once for a valid Luhn checksum and a length their network allows.
+        
+        Args:
+            card_numbers (list): The card numbers, as strings of digits.
+        
+        Returns:
+            list: One bool per card number, in the same order.
+        """
+        card_numbers = [self.normalize(card_number) for card_number in card_numbers]
+        if np is not None and card_numbers and all(map(str.isascii, card_numbers)):
+            return self._validate_numbers_numpy(card_numbers)
+        return [self._number_valid(card_number) for card_number in card_numbers]
+
+    @staticmethod
+    def normalize(card_number):
+        """
+        Removes the spaces and dashes people type between groups of digits.
+        """
+        return card_number.replace(" ", "").replace("-", "")
+
+    def _number_valid(self, card_number):
+        """
+        Checks one card number's characters, Luhn checksum, and length for its network.
+        """
+        return (card_number.isdigit() and card_number.isascii() and self.luhn_valid(card_number)
+                and len(card_number) in self.identify(card_number)["lengths"])
+
+    def _validate_numbers_numpy(self, card_numbers):
+        """
+        validate_numbers, as array operations over a byte matrix holding one card number per row.
+        """
+        width = self.MAX_LENGTH
+        lengths = np.fromiter(map(len, card_numbers), dtype=np.int64, count=len(card_numbers))
+        rows = np.minimum(lengths, width).astype(np.int8)[:, None]
+        columns = np.arange(width, dtype=np.int8)
+        characters = np.array(card_numbers, dtype=f"S{width}").view(np.uint8).reshape(-1, width)
+        digits = np.where(columns < rows, characters - np.uint8(48), np.uint8(0))  # Zeros after each number.
+        valid = (digits <= 9).all(axis=1)  # Any other character wraps around to a byte above 9.
+
+        # Luhn: double every second digit counting back from the last. Trailing zeros add nothing.
+        doubled_table = np.zeros(256, dtype=np.uint8)
+        doubled_table[:10] = self.LUHN_DOUBLED
+        doubled = (rows - columns) % 2 == 0
+        valid &= np.where(doubled, doubled_table[digits], digits).sum(axis=1, dtype=np.uint16) % 10 == 0
+
+        # Network: look each number's first digits up in the sorted, non-overlapping prefix ranges.
+        prefixes = digits[:, :self.PREFIX_DIGITS].astype(np.int64) @ (10 ** np.arange(self.PREFIX_DIGITS - 1, -1, -1))
+        networks = self.networks + [self.UNKNOWN_NETWORK]
+        network_index = {id(network): index for index, network in enumerate(networks)}
+        lows = np.array([low for low, _, _ in self._ranges], dtype=np.int64)
+        highs = np.array([high for _, high, _ in self._ranges], dtype=np.int64)
+        range_networks = np.array([network_index[id(network)] for _, _, network in self._ranges], dtype=np.int64)
+        position = np.searchsorted(lows, prefixes, side="right") - 1
+        matched = (position >= 0) & (prefixes <= highs[np.maximum(position, 0)])
+        network = np.where(matched, range_networks[np.maximum(position, 0)], len(networks) - 1)
+
+        allowed_lengths = np.zeros((len(networks), width + 1), dtype=bool)
+        for index, entry in enumerate(networks):
+            allowed_lengths[index, list(entry["lengths"])] = True
+        valid &= (lengths <= width) & allowed_lengths[network, np.minimum(lengths, width)]
+        return valid.tolist()
+
+
+DEFAULT_CARD_VALIDATOR = CardValidator()
+
+
+# GatewayUnavailableError Class
+class GatewayUnavailableError(Exception):
+    """
+    Raised when a gateway's circuit breaker is open, so the payment is refused without calling the gateway.
+    """
+
+
+# TransientGatewayError Class
+class TransientGatewayError(Exception):
+    """
+    Raised by a gateway connection for a failure that is worth retrying, such as a busy or restarting server.
+    """
+
+
+# PaymentResult Class
+class PaymentResult(namedtuple("PaymentResult", ["status", "error_code", "transaction_id", "latency", "error"])):
+    """
+    The outcome of one payment, as a compact immutable tuple.
+    
+    Attributes:
+        status (str): SUCCESS, DECLINED or ERROR.
+        error_code (str): Why the payment did not succeed (e.g., 'declined', 'timeout'), or None.
+        transaction_id (str): The gateway's id for the transaction, or None.
+        latency (float): Seconds the gateway took to answer, or None if it was not reached.
+        error (Exception): The exception that stopped the payment, or None.
+    """
+    __slots__ = ()
+    SUCCESS = "success"
+    DECLINED = "declined"
+    ERROR = "error"
+    ERROR_CODES = (  # Checked in order, so subclasses come before their base classes.
+        (GatewayUnavailableError, "gateway_unavailable"),
+        (TimeoutError, "timeout"),
+        (ConnectionError, "connection_error"),
+        (TransientGatewayError, "gateway_error"),
+        (ValueError, "invalid_request"),
+    )
+    MESSAGES = {SUCCESS: "Payment successful, Order confirmed", DECLINED: "Payment failed, please try again"}
+
+    @classmethod
+    def from_response(cls, payment_response, latency=None):
+        """
+        Creates the result of a payment the gateway answered.
+        
+        Args:
+            payment_response (dict): The gateway's response, with a 'status' of 'success' or 'failure'.
+            latency (float, optional): Seconds the gateway took to answer.
+        """
+        if payment_response["status"] == "success":
+            return cls(cls.SUCCESS, None, payment_response.get("transaction_id"), latency, None)
+        return cls(cls.DECLINED, "declined", payment_response.get("transaction_id"), latency, None)
+
+    @classmethod
+    def from_error(cls, error):
+        """
+        Creates the result of a payment stopped by an exception.
+        """
+        for error_type, error_code in cls.ERROR_CODES:
+            if isinstance(error, error_type):
+                break
+        else:
+            error_code = "error"
+        return cls(cls.ERROR, error_code, None, None, error)
+
+    @property
+    def succeeded(self):
+        """
+        bool: True if the payment went through.
+        """
+        return self.status == self.SUCCESS
+
+    @property
+    def message(self):
+        """
+        str: The message process_payment returns for this result.
+        """
+        if self.status == self.ERROR:
+            return f"Error: {str(self.error)}"
+        return self.MESSAGES[self.status]
+
+
 # PaymentProcessing Class
 class PaymentProcessing:
     """
-    The PaymentProcessing class handles validation and processing of payments using different payment methods.
+    The PaymentProcessing class handles validation and processing of payments using different payment methods.
+    
+    Attributes:
+        gateways (GatewayRegistry): The registered payment gateways, keyed by payment method.
+        async_gateway (SimulatedGateway): An awaitable stand-in for the gateways used by process_payment_async,
+                                          or None to send asynchronous payments through the registered gateways.
+        idempotency_store (IdempotencyStore): The results of payments made with an idempotency key.
+        card_validator (CardValidator): Validates credit card details.
+        batcher (PaymentBatcher): Coalesces concurrent payments into batch requests, or None to send each alone.
+        metrics (PaymentMetrics): Stage latencies and result counts for each gateway.
+    """
+    def __init__(self, async_gateway=None, gateways=None, idempotency_store=None, card_validator=None,
+                 batcher=None, metrics=None):
+        """
+        Initializes the PaymentProcessing class with available payment gateways.
+        
+        Args:
+            async_gateway (optional): An object with an awaitable `authorize(method, details, amount)` that
+                                      process_payment_async uses in place of the registered gateways, e.g. to
+                                      simulate thousands of payments in flight. By default asynchronous
+                                      payments take the same path as blocking ones.
+            gateways (GatewayRegistry, optional): The payment gateways to use. Defaults to 'credit_card' and
+                                                  'paypal' gateways backed by in-process fake servers.
+            idempotency_store (IdempotencyStore, optional): Where results of keyed payments are kept.
+                                                            Defaults to an in-memory store.
+            card_validator (CardValidator, optional): Validates credit card details. Defaults to a shared one.
+            batcher (PaymentBatcher, optional): Coalesces concurrent payments into batch requests. Payments
+                                                are sent one by one if None.
+            metrics (PaymentMetrics, optional): Where stage latencies and result counts are recorded.
+                                                Defaults to a new PaymentMetrics.
+        """
+        self.gateways = gateways or GatewayRegistry.with_fake_servers("credit_card", "paypal")
+        self.async_gateway = async_gateway
+        self.idempotency_store = idempotency_store or IdempotencyStore()
+        self.card_validator = card_validator or DEFAULT_CARD_VALIDATOR
+        self.batcher = batcher
+        self.metrics = metrics or PaymentMetrics()
+
+    @property
+    def available_gateways(self):
+        """
+        list: The names of the supported payment gateways, such as 'credit_card' and 'paypal'.
+        """
+        return list(self.gateways)
+
+    def validate_payment_method(self, payment_method, payment_details):
+        """
+        Validates the selected payment method and its associated details.
+        
+        Args:
+            payment_method (str): The selected payment method (e.g., 'credit_card', 'paypal').
+            payment_details (dict): The details required for the payment method (e.g., card number, expiry date).
+        
+        Returns:
+            bool: True if the payment method and details are valid, otherwise raises ValueError.
+        
+        Raises:
+            ValueError: If the payment method is not supported or if the payment details are invalid.
+        """
+        # Check if the payment method is supported.
+        if payment_method not in self.gateways:
+            raise ValueError("Invalid payment method")
+
+        # Validate credit card details if the selected method is 'credit_card'.
+        if payment_method == "credit_card":
+            if not self.validate_credit_card(payment_details):
+                raise ValueError("Invalid credit card details")
+
+        # Validation passed.
+        return True
+
+    def validate_credit_card(self, details):
+        """
+        Validates the credit card details (e.g., card number, expiry date, CVV).
+        
+        The card number must pass the Luhn check and have a length its card network allows, the CVV
+        must have the network's length, and the card must not have expired.
+        
+        Args:
+            details (dict): A dictionary containing 'card_number', 'expiry_date', and 'cvv'.
+        
+        Returns:
+            bool: True if the card details are valid, False otherwise.
+        """
+        return self.card_validator.validate(details)["valid"]
+
+    def validate_credit_cards(self, card_numbers):
+        """
+        Checks many credit card numbers at once, e.g. for a bulk fraud pre-screen.
+        
+        Args:
+            card_numbers (list): The card numbers.
+        
+        Returns:
+            list: One bool per card number, True if it passes the Luhn check and has a valid length.
+        """
+        return self.card_validator.validate_numbers(card_numbers)
+
+    def process_payment(self, order, payment_method, payment_details, idempotency_key=None):
+        """
+        Processes the payment for an order, validating the payment method and interacting with the payment gateway.
+        
+        This is the message-returning form of authorize_payment; see there for idempotency keys.
+        
+        Args:
+            order (dict): The order details, including total amount (a Money object or an amount in dollars).
+            payment_method (str): The selected payment method.
+            payment_details (dict): The details required for the payment method.
+            idempotency_key (str, optional): A key identifying this payment attempt, unique per order.
+        
+        Returns:
+            str: A message indicating whether the payment was successful or failed.
+        """
+        return self.authorize_payment(order, payment_method, payment_details, idempotency_key).message
+
+    def authorize_payment(self, order, payment_method, payment_details, idempotency_key=None):
+        """
+        Processes the payment for an order and returns a structured result.
+        
+        Repeating a payment with the same idempotency key (a retry, or a second click on "Confirm Order")
+        returns the first payment's result instead of charging again. Concurrent calls with the same key
+        wait for the first one to finish. Errors are not kept, so a payment that failed with an error can
+        be retried under the same key. The key is bound to the payment's method, amount, and details, and
+        reusing it for a different payment gives an error result instead of the first payment's result.
+        
+        Args:
+            order (dict): The order details, including total amount (a Money object or an amount in dollars).
+            payment_method (str): The selected payment method.
+            payment_details (dict): The details required for the payment method.
+            idempotency_key (str, optional): A key identifying this payment attempt, unique per order.
+        
+        Returns:
+            PaymentResult: The outcome, with the gateway's transaction id and latency, or the error.
+        """
+        if idempotency_key is not None:
+            try:
+                return self.idempotency_store.run(
+                    idempotency_key,
+                    lambda: self.authorize_payment(order, payment_method, payment_details),
+                    keep=lambda result: result.status != PaymentResult.ERROR,
+                    fingerprint=self._request_fingerprint(order, payment_method, payment_details),
+                )
+            except ValueError as e:  # The key was already used for a different payment.
+                return PaymentResult.from_error(e)
+        gateway = payment_method if payment_method in self.gateways else PaymentMetrics.UNKNOWN_GATEWAY
+        marks = [time.perf_counter_ns()]  # The start, then the end of each stage in PaymentMetrics.STAGES.
+        try:
+            # Validate the payment method and details.
+            self.validate_payment_method(payment_method, payment_details)
+            
+            # Charge an exact number of cents, whatever type the order total was given in.
+            amount = Money.from_amount(order["total_amount"])
+            marks.append(time.perf_counter_ns())
+
+            # Send the payment to the gateway, timing the round trip.
+            payment_response = self.mock_payment_gateway(payment_method, payment_details, amount)
+            marks.append(time.perf_counter_ns())
+            result = PaymentResult.from_response(payment_response, (marks[2] - marks[1]) / 1e9)
+            marks.append(time.perf_counter_ns())
+
+        except Exception as e:
+            # Keep the validation or processing error; it is only formatted if a message is asked for.
+            result = PaymentResult.from_error(e)
+        self.metrics.record_payment(gateway, result.status, marks)
+        return result
+
+    @staticmethod
+    def _request_fingerprint(order, payment_method, payment_details):
+        """
+        Fingerprints a payment by its method, amount in cents, and details, for binding an idempotency key to it.
+        """
+        try:
+            amount = Money.from_amount(order["total_amount"]).cents
+        except Exception:
+            amount = repr(order.get("total_amount"))  # Fails validation later; still bind the key to it.
+        return IdempotencyStore.fingerprint(payment_method, amount, payment_details)
+
+    async def process_payment_async(self, order, payment_method, payment_details, idempotency_key=None):
+        """
+        Processes the payment for an order like process_payment, awaiting the gateway instead of blocking on it.
+        
+        Args:
+            order (dict): The order details, including total amount (a Money object or an amount in dollars).
+            payment_method (str): The selected payment method.
+            payment_details (dict): The details required for the payment method.
+            idempotency_key (str, optional): A key identifying this payment attempt, unique per order.
+        
+        Returns:
+            str: A message indicating whether the payment was successful or failed.
+        """
+        return (await self.authorize_payment_async(order, payment_method, payment_details, idempotency_key)).message
+
+    async def authorize_payment_async(self, order, payment_method, payment_details, idempotency_key=None):
+        """
+        Processes the payment for an order like authorize_payment, awaiting the gateway instead of blocking on it.
+        
+        By default the payment runs authorize_payment in a worker thread, so it goes through the same
+        registered gateway, connection pool, circuit breaker, retries, batcher, and idempotency store, and
+        gets the same answer as a blocking payment. With an async_gateway, the payment is sent to it
+        instead; the event loop is then free while the call is in flight, so one loop can drive thousands
+        of payments at once without a thread for each.
+        
+        Args:
+            order (dict): The order details, including total amount (a Money object or an amount in dollars).
+            payment_method (str): The selected payment method.
+            payment_details (dict): The details required for the payment method.
+            idempotency_key (str, optional): A key identifying this payment attempt, unique per order.
+        
+        Returns:
+            PaymentResult: The outcome, with the gateway's transaction id and latency, or the error.
+        
+        Raises:
+            ValueError: If an idempotency key is given along with an async_gateway, which bypasses the store.
+        """
+        if self.async_gateway is None:
+            return await asyncio.to_thread(self.authorize_payment, order, payment_method, payment_details,
+                                           idempotency_key)
+        if idempotency_key is not None:
+            raise ValueError("Idempotency keys are only supported by the registered gateways")
+        gateway = payment_method if payment_method in self.gateways else PaymentMetrics.UNKNOWN_GATEWAY
+        marks = [time.perf_counter_ns()]
+        try:
+            self.validate_payment_method(payment_method, payment_details)
+            amount = Money.from_amount(order["total_amount"])
+            marks.append(time.perf_counter_ns())
+            payment_response = await self.async_gateway.authorize(payment_method, payment_details, amount)
+            marks.append(time.perf_counter_ns())
+            result = PaymentResult.from_response(payment_response, (marks[2] - marks[1]) / 1e9)
+            marks.append(time.perf_counter_ns())
+
+        except Exception as e:
+            result = PaymentResult.from_error(e)
+        self.metrics.record_payment(gateway, result.status, marks)
+        return result
+
+    def mock_payment_gateway(self, method, details, amount):
+        """
+        Sends a payment to the registered gateway for its method, over one of the gateway's pooled connections.
+        
+        With a batcher, the payment waits briefly to be sent together with other payments to the same gateway.
+        
+        Args:
+            method (str): The payment method (e.g., 'credit_card').
+            details (dict): The payment details (e.g., card number).
+            amount (Money): The amount to be charged.
+        
+        Returns:
+            dict: The response from the payment gateway, indicating success or failure.
+        
+        Raises:
+            ValueError: If no gateway is registered for the method.
+            TimeoutError: If the gateway has no free connection or does not answer in time.
+        """
+        gateway = self.gateways.get(method)
+        if self.batcher is not None:
+            future = self.batcher.submit(gateway, details, amount)
+            return future.result(timeout=self.batcher.result_timeout(gateway))
+        return gateway.authorize(details, amount)
+
+
+# IdempotencyStore Class
+class IdempotencyStore:
+    """
+    Keeps the results of operations by idempotency key, so repeating an operation returns its first result.
+    
+    Results are kept in memory, most recently used last, up to max_entries; each expires ttl seconds
+    after it was stored. Lookups and inserts are O(1), and all access is guarded by a lock. When a
+    path is given, results are also written to a shelve file there and read back after a restart.
+    Expired results are swept from the file when it is opened and then every PURGE_INTERVAL of the
+    ttl, so the file only holds about that much more than one ttl's worth of results.
+    
+    A key can be bound to a fingerprint of the request it was first used for. Reusing the key for a
+    request with a different fingerprint raises ValueError instead of returning the other request's result.
+    
+    Attributes:
+        max_entries (int): The most results kept in memory.
+        ttl (float): Seconds a result is kept.
+        PURGE_INTERVAL (float): The share of the ttl between sweeps of expired results from disk.
+    """
+    _MISSING = object()
+    PURGE_INTERVAL = 0.5
+
+    def __init__(self, max_entries=10_000, ttl=24 * 60 * 60, path=None, clock=time.time):
+        """
+        Initializes an IdempotencyStore.
+        
+        Args:
+            max_entries (int, optional): The most results kept in memory.
+            ttl (float, optional): Seconds a result is kept.
+            path (str, optional): A file path to also keep results on disk.
+            clock (callable, optional): Returns the current time in seconds. Wall-clock time, so expiry
+                                        times stay meaningful across restarts.
+        
+        Raises:
+            ValueError: If max_entries is not positive.
+        """
+        if max_entries < 1:
+            raise ValueError("An idempotency store must hold at least one entry")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires at, fingerprint, result).
+        self._pending = {}  # key -> (threading.Event set when the owning call finishes, its fingerprint).
+        self._lock = threading.Lock()
+        self._disk = shelve.open(path) if path else None
+        self._next_purge = 0.0
+        if self._disk is not None:
+            with self._lock:
+                self._purge_disk()
+
+    @staticmethod
+    def fingerprint(*parts):
+        """
+        Hashes the parts of a request into a fingerprint to bind an idempotency key to.
+        
+        Args:
+            *parts: JSON-serializable values, such as the amount and payment details. Other values are
+                    hashed by their string form.
+        
+        Returns:
+            str: A hex digest that is equal for equal requests.
+        """
+        encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def get(self, key, default=None, fingerprint=None):
+        """
+        Returns the result stored under a key, or default if there is none or it has expired.
+        
+        Raises:
+            ValueError: If the key was stored for a request with a different fingerprint.
+        """
+        with self._lock:
+            result = self._lookup(key, fingerprint)
+        return default if result is self._MISSING else result
+
+    def put(self, key, result, fingerprint=None):
+        """
+        Stores a result under a key, replacing any earlier one.
+        """
+        with self._lock:
+            self._store(key, (self._clock() + self.ttl, fingerprint, result))
+
+    def run(self, key, operation, keep=None, fingerprint=None):
+        """
+        Runs an operation once per key, returning the stored result for repeated keys.
+        
+        If another caller is already running the operation for the key, waits for it and returns its
+        result, or runs the operation itself if that result was not kept.
+        
+        Args:
+            key (str): The idempotency key.
+            operation (callable): Takes no arguments and returns the result.
+            keep (callable, optional): Decides from a result whether to store it. Every result is stored if None.
+            fingerprint (str, optional): Identifies the request, binding the key to it. See fingerprint().
+        
+        Returns:
+            The operation's result, or the result stored for the key.
+        
+        Raises:
+            ValueError: If the key is stored or in flight for a request with a different fingerprint.
+        """
+        while True:
+            with self._lock:
+                result = self._lookup(key, fingerprint)
+                if result is not self._MISSING:
+                    return result
+                pending = self._pending.get(key)
+                if pending is None:
+                    done = threading.Event()
+                    self._pending[key] = (done, fingerprint)
+                    break
+                waiting_for, pending_fingerprint = pending
+                self._check_fingerprint(key, pending_fingerprint, fingerprint)
+            waiting_for.wait()
+
+        try:
+            result = operation()
+            if keep is None or keep(result):
+                self.put(key, result, fingerprint)
+            return result
+        finally:
+            with self._lock:
+                del self._pending[key]
+            done.set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def close(self):
+        """
+        Closes the on-disk store, if there is one.
+        """
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+    def _lookup(self, key, fingerprint=None):
+        """
+        Returns the live result for a key, or _MISSING, dropping it if it has expired. Call with the lock held.
+        
+        Raises:
+            ValueError: If the live result was stored for a request with a different fingerprint.
+        """
+        entry = self._entries.get(key)
+        if entry is None and self._disk is not None:
+            entry = self._disk.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            return self._MISSING
+        if entry[0] <= self._clock():
+            self._forget(key)
+            return self._MISSING
+        self._check_fingerprint(key, entry[1], fingerprint)
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    @staticmethod
+    def _check_fingerprint(key, stored, given):
+        """
+        Raises ValueError if a key is used for a different request than the one it is bound to.
+        """
+        if stored is not None and given is not None and stored != given:
+            raise ValueError(f"Idempotency key {key!r} was already used for a different request")
+
+    def _store(self, key, entry):
+        """
+        Stores an entry in memory and on disk. Call with the lock held.
+        """
+        self._remember(key, entry)
+        if self._disk is not None:
+            self._disk[key] = entry
+            if self._clock() >= self._next_purge:
+                self._purge_disk()
+            self._disk.sync()
+
+    def _purge_disk(self):
+        """
+        Deletes every expired entry from disk and schedules the next sweep. Call with the lock held.
+        """
+        now = self._clock()
+        for key in [key for key, entry in self._disk.items() if entry[0] <= now]:
+            del self._disk[key]
+        self._next_purge = now + self.ttl * self.PURGE_INTERVAL
+
+    def _remember(self, key, entry):
+        """
+        Stores an entry in memory, then evicts from the least recently used end while the entry there has
+        expired or the store holds too many. Entries evicted from memory stay on disk.
+        """
+        entries = self._entries
+        entries[key] = entry
+        entries.move_to_end(key)
+        now = self._clock()
+        while entries:
+            oldest_key, (expires, _, _) = next(iter(entries.items()))
+            if expires > now and len(entries) <= self.max_entries:
+                break
+            del entries[oldest_key]
+
+    def _forget(self, key):
+        """
+        Drops an entry from memory and disk.
+        """
+        self._entries.pop(key, None)
+        if self._disk is not None and key in self._disk:
+            del self._disk[key]
+
+
+# SimulatedGateway Class
+class SimulatedGateway:
+    """
+    A local, awaitable stand-in for a remote payment gateway.
+    
+    It answers like mock_payment_gateway, but only after a simulated network round trip, during which
+    the event loop is free to run other payments.
+    
+    Attributes:
+        latency (float): The base round-trip time in seconds.
+        jitter (float): The most extra time in seconds added at random to each round trip.
+        calls (int): The number of authorizations requested so far.
+    """
+    def __init__(self, latency=0.05, jitter=0.0, seed=None):
+        """
+        Initializes a SimulatedGateway.
+        
+        Args:
+            latency (float, optional): The base round-trip time in seconds.
+            jitter (float, optional): The most extra time in seconds added at random to each round trip.
+            seed (int, optional): Seeds the jitter, for repeatable runs.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._rng = random.Random(seed)
+
+    async def authorize(self, method, details, amount):
+        """
+        Authorizes a payment after the simulated round trip.
+        
+        Args:
+            method (str): The payment method (e.g., 'credit_card').
+            details (dict): The payment details (e.g., card number).
+            amount (Money): The amount to be charged.
+        
+        Returns:
+            dict: The gateway's response, indicating success or failure.
+        """
+        self.calls += 1
+        delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if method == "credit_card" and details.get("card_number") in DECLINED_CARD_NUMBERS:
+            return {"status": "failure", "message": "Card declined"}
+        return {"status": "success", "transaction_id": f"sim{self.calls}"}
+
+
+# FakeGatewayServer Class
+class FakeGatewayServer:
+    """
+    An in-process stand-in for a payment gateway's remote server, for tests and benchmarks.
+    
+    Opening a connection and answering a request can each be given a delay, and the server counts the
+    connections it has opened and the most requests it has had in flight at once.
+    
+    Attributes:
+        latency (float): Seconds taken to answer each request.
+        connect_latency (float): Seconds taken to open each connection.
+        connections_opened (int): The number of connections opened so far.
+        requests (int): The number of requests (round trips) answered or timed out so far.
+        authorizations (int): The number of payments answered so far; a batch request answers several.
+        peak_in_flight (int): The most requests in flight at the same time.
+        faults (deque): Exceptions to raise, one per request, before answering normally again.
+    """
+    def __init__(self, latency=0.0, connect_latency=0.0):
+        """
+        Initializes a FakeGatewayServer.
+        
+        Args:
+            latency (float, optional): Seconds taken to answer each request.
+            connect_latency (float, optional): Seconds taken to open each connection.
+        """
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.connections_opened = 0
+        self.requests = 0
+        self.authorizations = 0
+        self.peak_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.faults = deque()
+
+    def inject_faults(self, *errors):
+        """
+        Makes the next requests fail, one per error, by raising the given exceptions.
+        
+        Args:
+            *errors (Exception): The exceptions to raise, in order.
+        """
+        self.faults.extend(errors)
+
+    def connect(self):
+        """
+        Opens a new connection to the server.
+        
+        Returns:
+            FakeGatewayConnection: The open connection.
+        """
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        with self._lock:
+            self.connections_opened += 1
+        return FakeGatewayConnection(self)
+
+    def handle(self, method, details, amount, timeout=None):
+        """
+        Answers one payment request, declining the cards in DECLINED_CARD_NUMBERS.
+        
+        Raises:
+            TimeoutError: If the answer would take longer than the timeout.
+            Exception: The next injected fault, if there is one.
+        """
+        return self.handle_batch(method, [(details, amount)], timeout)[0]
+
+    def handle_batch(self, method, payments, timeout=None):
+        """
+        Answers a batch of payments in one request, taking the time of a single round trip.
+        
+        Args:
+            method (str): The payment method.
+            payments (list): (details, amount) pairs.
+            timeout (float, optional): Seconds to wait for the answer.
+        
+        Returns:
+            list: One response per payment, in the same order.
+        
+        Raises:
+            TimeoutError: If the answer would take longer than the timeout.
+            Exception: The next injected fault, if there is one.
+        """
+        with self._lock:
+            self.requests += 1
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            fault = self.faults.popleft() if self.faults else None
+        try:
+            if fault is not None:
+                raise fault
+            if timeout is not None and self.latency > timeout:
+                time.sleep(timeout)
+                raise TimeoutError(f"{method} gateway did not answer within {timeout}s")
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                first = self.authorizations + 1
+                self.authorizations += len(payments)
+        responses = []
+        for number, (details, amount) in enumerate(payments, first):
+            if method == "credit_card" and details.get("card_number") in DECLINED_CARD_NUMBERS:
+                responses.append({"status": "failure", "message": "Card declined"})
+            else:
+                responses.append({"status": "success", "transaction_id": f"fake{number}"})
+        return responses
+
+
+# FakeGatewayConnection Class
+class FakeGatewayConnection:
+    """
+    An open connection to a FakeGatewayServer.
+    
+    Attributes:
+        server (FakeGatewayServer): The server the connection is open to.
+        is_open (bool): False once the connection has been closed.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.is_open = True
+
+    def request(self, method, details, amount, timeout=None):
+        """
+        Sends one payment request over the connection and waits for the answer.
+        
+        Raises:
+            ConnectionError: If the connection has been closed.
+            TimeoutError: If the server does not answer within the timeout.
+        """
+        if not self.is_open:
+            raise ConnectionError("Connection is closed")
+        return self.server.handle(method, details, amount, timeout)
+
+    def request_batch(self, method, payments, timeout=None):
+        """
+        Sends a batch of (details, amount) payments in one request and waits for the answers.
+        
+        Raises:
+            ConnectionError: If the connection has been closed.
+            TimeoutError: If the server does not answer within the timeout.
+        """
+        if not self.is_open:
+            raise ConnectionError("Connection is closed")
+        return self.server.handle_batch(method, payments, timeout)
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.is_open = False
+
+
+# ConnectionPool Class
+class ConnectionPool:
+    """
+    A bounded pool of keep-alive connections to one gateway.
+    
+    At most max_size connections are checked out at once, which also caps the gateway's concurrent
+    requests. Released connections are kept open and handed out again, most recently used first, until
+    they have sat idle for longer than max_idle seconds.
+    
+    Attributes:
+        max_size (int): The most connections checked out at the same time.
+        max_idle (float): Seconds an idle connection is kept before it is closed rather than reused.
+    """
+    def __init__(self, connect, max_size=10, max_idle=30.0, clock=time.monotonic):
+        """
+        Initializes a ConnectionPool.
+        
+        Args:
+            connect (callable): Opens and returns a new connection.
+            max_size (int, optional): The most connections checked out at the same time.
+            max_idle (float, optional): Seconds an idle connection is kept before it is closed.
+            clock (callable, optional): Returns the current time in seconds.
+        
+        Raises:
+            ValueError: If max_size is not positive.
+        """
+        if max_size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self._connect = connect
+        self._clock = clock
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()  # (connection, time released); appends and pops are atomic.
+
+    def acquire(self, timeout=None):
+        """
+        Checks out a connection, reusing an idle one when there is one.
+        
+        Args:
+            timeout (float, optional): Seconds to wait for a free slot. Waits indefinitely if None.
+        
+        Returns:
+            The connection.
+        
+        Raises:
+            TimeoutError: If every connection stays checked out for the whole timeout.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No free gateway connection")
+        try:
+            now = self._clock()
+            while True:
+                try:
+                    connection, released = self._idle.pop()
+                except IndexError:
+                    return self._connect()
+                if now - released <= self.max_idle and connection.is_open:
+                    return connection
+                connection.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, reuse=True):
+        """
+        Returns a checked-out connection to the pool.
+        
+        Args:
+            connection: The connection from acquire.
+            reuse (bool, optional): False to close the connection, e.g. after a timeout left it in an unknown state.
+        """
+        if reuse and connection.is_open:
+            self._idle.append((connection, self._clock()))
+        else:
+            connection.close()
+        self._slots.release()
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        while self._idle:
+            self._idle.pop()[0].close()
+
+
+# CircuitBreaker Class
+class CircuitBreaker:
+    """
+    Stops calls to a failing gateway for a while, so a struggling backend is not buried in retries.
+    
+    The breaker starts closed and lets every call through. After failure_threshold failures in a row it
+    opens and refuses calls for reset_timeout seconds. It then goes half-open and lets up to
+    half_open_max_calls trial calls through: a success closes it again, a failure reopens it.
+    
+    Attributes:
+        state (str): CLOSED, OPEN or HALF_OPEN.
+        failure_threshold (int): Failures in a row that open the breaker.
+        reset_timeout (float): Seconds the breaker stays open before allowing trial calls.
+        half_open_max_calls (int): Trial calls allowed while half-open.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1, clock=time.monotonic):
+        """
+        Initializes a CircuitBreaker in the closed state.
+        
+        Args:
+            failure_threshold (int, optional): Failures in a row that open the breaker.
+            reset_timeout (float, optional): Seconds the breaker stays open before allowing trial calls.
+            half_open_max_calls (int, optional): Trial calls allowed while half-open.
+            clock (callable, optional): Returns the current time in seconds.
+        """
+        self.state = self.CLOSED
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Checks whether a call may go to the gateway now.
+        
+        Returns:
+            bool: True if the call may proceed, False if it should fail fast.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_calls = 0
+            if self.state == self.HALF_OPEN:
+                if self._trial_calls >= self.half_open_max_calls:
+                    return False
+                self._trial_calls += 1
+            return True
+
+    def record_success(self):
+        """
+        Records a call the gateway answered, closing the breaker.
+        """
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def release_trial(self):
+        """
+        Ends a call that neither succeeded nor failed in a way that counts, freeing its half-open trial slot.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._trial_calls > 0:
+                self._trial_calls -= 1
+
+    def record_failure(self):
+        """
+        Records a call the gateway failed, opening the breaker after too many in a row or a failed trial call.
+        """
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+
+
+# RetryPolicy Class
+class RetryPolicy:
+    """
+    Decides which gateway failures are retried and how long to wait before each retry.
+    
+    Only transient failures (timeouts, dropped connections and TransientGatewayError) are retried, and a
+    timeout waiting for the answer to a request that was sent is not: the gateway may already have acted
+    on it, and charging a card again is worse than reporting the timeout. The waits grow exponentially up
+    to max_delay and are drawn at random below that cap ("full jitter"), so clients that failed together
+    do not all retry at the same moment.
+    
+    Attributes:
+        max_attempts (int): The most calls made for one payment, including the first.
+        base_delay (float): The cap in seconds on the wait before the first retry.
+        max_delay (float): The cap in seconds on any wait.
+    """
+    TRANSIENT_ERRORS = (TimeoutError, ConnectionError, TransientGatewayError)
+    AMBIGUOUS_ERRORS = (TimeoutError,)  # Failures that leave it unknown whether a sent request was carried out.
+
+    def __init__(self, max_attempts=3, base_delay=0.05, max_delay=1.0, seed=None, sleep=time.sleep):
+        """
+        Initializes a RetryPolicy.
+        
+        Args:
+            max_attempts (int, optional): The most calls made for one payment, including the first.
+            base_delay (float, optional): The cap in seconds on the wait before the first retry.
+            max_delay (float, optional): The cap in seconds on any wait.
+            seed (int, optional): Seeds the jitter, for repeatable runs.
+            sleep (callable, optional): Waits for a number of seconds.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self._rng = random.Random(seed)
+
+    def is_transient(self, error):
+        """
+        Checks whether a failure is worth retrying.
+        """
+        return isinstance(error, self.TRANSIENT_ERRORS)
+
+    def is_safe_to_retry(self, error, sent):
+        """
+        Checks whether a transient failure can be retried without risking the request being carried out twice.
+        
+        Args:
+            error (BaseException): The failure.
+            sent (bool): Whether the request had been sent when it failed.
+        """
+        return not (sent and isinstance(error, self.AMBIGUOUS_ERRORS))
+
+    def delay(self, retry):
+        """
+        Returns the wait in seconds before a retry.
+        
+        Args:
+            retry (int): Which retry this is, starting from 0.
+        """
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+# PaymentGateway Class
+class PaymentGateway:
+    """
+    A payment gateway plugin: sends the payments for one payment method over its own connection pool.
+    
+    Transient failures are retried as the gateway's retry policy allows, and its circuit breaker makes
+    payments fail fast with GatewayUnavailableError while the gateway keeps failing.
+    
+    Attributes:
+        name (str): The payment method the gateway handles (e.g., 'credit_card').
+        pool (ConnectionPool): The gateway's keep-alive connections.
+        timeout (float): Seconds allowed both for getting a connection and for the gateway's answer.
+        breaker (CircuitBreaker): The gateway's circuit breaker.
+        retry (RetryPolicy): The gateway's retry policy.
+    """
+    def __init__(self, name, connect, max_connections=10, timeout=5.0, max_idle=30.0, breaker=None, retry=None):
+        """
+        Initializes a PaymentGateway.
+        
+        Args:
+            name (str): The payment method the gateway handles.
+            connect (callable): Opens a connection to the gateway; the connection must offer
+                                `request(method, details, amount, timeout)`, `close()` and `is_open`.
+            max_connections (int, optional): The most requests in flight to this gateway at once.
+            timeout (float, optional): Seconds allowed for getting a connection and for the answer.
+            max_idle (float, optional): Seconds an idle connection is kept open for reuse.
+            breaker (CircuitBreaker, optional): The gateway's circuit breaker. Defaults to a new one.
+            retry (RetryPolicy, optional): The gateway's retry policy. Defaults to a new one.
+        """
+        self.name = name
+        self.pool = ConnectionPool(connect, max_connections, max_idle)
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.retry = retry or RetryPolicy()
+
+    def authorize(self, details, amount):
+        """
+        Sends one payment to the gateway, retrying transient failures.
+        
+        Args:
+            details (dict): The payment details (e.g., card number).
+            amount (Money): The amount to be charged.
+        
+        Returns:
+            dict: The gateway's response, indicating success or failure.
+        
+        Raises:
+            GatewayUnavailableError: If the circuit breaker is open.
+            TimeoutError: If no connection frees up within the timeout on the last attempt, or the gateway
+                          does not answer within the timeout. The payment may then have been carried out,
+                          so it is not retried.
+        """
+        return self._call(lambda connection: connection.request(self.name, details, amount, self.timeout))
+
+    def max_duration(self):
+        """
+        Returns the longest authorize can take in seconds: every attempt may wait the timeout for a connection
+        and again for the answer, with the longest backoff between attempts.
+        """
+        attempts = self.retry.max_attempts
+        return attempts * 2 * self.timeout + (attempts - 1) * self.retry.max_delay
+
+    def authorize_batch(self, payments):
+        """
+        Sends a batch of payments to the gateway in one request, retrying transient failures.
+        
+        Args:
+            payments (list): (details, amount) pairs.
+        
+        Returns:
+            list: The gateway's response for each payment, in the same order.
+        
+        Raises:
+            GatewayUnavailableError: If the circuit breaker is open.
+            TimeoutError: If no connection frees up within the timeout on the last attempt, or the gateway
+                          does not answer within the timeout, which is not retried.
+        """
+        return self._call(lambda connection: connection.request_batch(self.name, payments, self.timeout))
+
+    def _call(self, request):
+        """
+        Makes a request over a pooled connection, with retries and the circuit breaker.
+        
+        Args:
+            request (callable): Takes a connection and makes the request over it.
+        """
+        for attempt in range(self.retry.max_attempts):
+            if not self.breaker.allow():
+                raise GatewayUnavailableError(f"{self.name} gateway is unavailable")
+            sent = False
+            try:
+                connection = self.pool.acquire(self.timeout)
+                sent = True
+                response = self._send(connection, request)
+            except BaseException as error:
+                if not self.retry.is_transient(error):
+                    # Says nothing about the gateway's health, but must not hold a half-open trial slot.
+                    self.breaker.release_trial()
+                    raise
+                self.breaker.record_failure()
+                if attempt + 1 == self.retry.max_attempts or not self.retry.is_safe_to_retry(error, sent):
+                    raise
+                self.retry.sleep(self.retry.delay(attempt))
+            else:
+                self.breaker.record_success()
+                return response
+
+    def _send(self, connection, request):
+        """
+        Makes a request over a connection taken from the pool, without retrying, and returns the connection.
+        """
+        try:
+            response = request(connection)
+        except BaseException:
+            self.pool.release(connection, reuse=False)
+            raise
+        self.pool.release(connection)
+        return response
+
+    def close(self):
+        """
+        Closes the gateway's idle connections.
+        """
+        self.pool.close()
+
+
+# PaymentBatcher Class
+class PaymentBatcher:
+    """
+    Coalesces concurrent payments to the same gateway into batch requests.
+    
+    Each gateway gets a collector thread. It waits for a payment, then keeps collecting until the batch
+    holds max_batch_size payments or max_wait seconds have passed since the first one, and hands the batch
+    to a thread pool to send, so the next batch is collected while this one is in flight. Gateways with
+    `authorize_batch` get the whole batch in one request; others get one `authorize` call per payment.
+    Each payment's future receives its own response, or the batch's error.
+    
+    Attributes:
+        max_batch_size (int): The most payments sent in one batch.
+        max_wait (float): The longest a payment waits in seconds for others to join its batch.
+    """
+    _STOP = object()
+    DEFAULT_TIMEOUT = 30.0  # Seconds to wait for a gateway that does not say how long it can take.
+
+    def __init__(self, max_batch_size=32, max_wait=0.005, max_workers=8):
+        """
+        Initializes a PaymentBatcher.
+        
+        Args:
+            max_batch_size (int, optional): The most payments sent in one batch.
+            max_wait (float, optional): The longest a payment waits in seconds for others to join its batch.
+            max_workers (int, optional): The most batches in flight at once, across all gateways.
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queues = {}  # Gateway -> queue.Queue of (gateway, details, amount, future).
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="payment-batch")
+
+    def submit(self, gateway, details, amount):
+        """
+        Queues a payment for the gateway's next batch.
+        
+        Args:
+            gateway: The gateway to pay through.
+            details (dict): The payment details (e.g., card number).
+            amount (Money): The amount to be charged.
+        
+        Returns:
+            Future: Resolves to the gateway's response for this payment.
+        
+        Raises:
+            RuntimeError: If the batcher has been closed.
+        """
+        future = Future()
+        with self._lock:
+            # Checked under the lock close() takes, so nothing is queued behind a collector's stop signal.
+            if self._closed:
+                raise RuntimeError("PaymentBatcher is closed")
+            pending = self._queues.get(gateway)
+            if pending is None:
+                pending = self._start_collector(gateway)
+            pending.put((gateway, details, amount, future))
+        return future
+
+    def result_timeout(self, gateway):
+        """
+        Returns how long to wait in seconds for a payment's future: the longest the gateway can take to
+        answer, plus the longest the payment waits for its batch to fill.
+        """
+        if hasattr(gateway, "max_duration"):
+            duration = gateway.max_duration()
+        else:
+            duration = getattr(gateway, "timeout", self.DEFAULT_TIMEOUT)
+        return duration + self.max_wait
+
+    def close(self):
+        """
+        Sends the payments already queued, then stops the collector threads and waits for in-flight batches.
+        Any payment still queued after that fails with RuntimeError, so no future is left unresolved.
+        """
+        with self._lock:
+            self._closed = True
+            for pending in self._queues.values():
+                pending.put(self._STOP)
+            collectors, self._collectors = self._collectors, []
+            queues, self._queues = list(self._queues.values()), {}
+        for collector in collectors:
+            collector.join()
+        self._executor.shutdown(wait=True)
+        for pending in queues:
+            while True:
+                try:
+                    payment = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if payment is not self._STOP:
+                    payment[3].set_exception(RuntimeError("PaymentBatcher is closed"))
+
+    def _start_collector(self, gateway):
+        """
+        Starts the collector thread for a gateway. Called with the lock held.
+        """
+        pending = self._queues[gateway] = queue.Queue()
+        collector = threading.Thread(target=self._collect, args=(pending,), daemon=True,
+                                     name=f"payment-batcher-{getattr(gateway, 'name', 'gateway')}")
+        collector.start()
+        self._collectors.append(collector)
+        return pending
+
+    def _collect(self, pending):
+        """
+        Gathers payments from a gateway's queue into batches until told to stop.
+        """
+        while True:
+            first = pending.get()
+            if first is self._STOP:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            stopping = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    payment = pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait()
+                except queue.Empty:
+                    break
+                if payment is self._STOP:
+                    stopping = True
+                    break
+                batch.append(payment)
+            try:
+                self._executor.submit(self._send, batch)
+            except RuntimeError as error:  # The executor has shut down.
+                for *_, future in batch:
+                    future.set_exception(error)
+                return
+            if stopping:
+                return
+
+    @staticmethod
+    def _send(batch):
+        """
+        Sends one batch and hands each payment's response, or its error, to its future.
+        """
+        gateway = batch[0][0]
+        if not hasattr(gateway, "authorize_batch"):
+            # One call per payment, so each payment succeeds or fails on its own.
+            for _, details, amount, future in batch:
+                try:
+                    future.set_result(gateway.authorize(details, amount))
+                except BaseException as error:
+                    future.set_exception(error)
+            return
+        try:
+            responses = gateway.authorize_batch([(details, amount) for _, details, amount, _ in batch])
+            if len(responses) != len(batch):
+                raise RuntimeError(f"{len(responses)} responses to a batch of {len(batch)} payments")
+        except BaseException as error:
+            for *_, future in batch:
+                future.set_exception(error)
+            return
+        for (*_, future), response in zip(batch, responses):
+            future.set_result(response)
+
+
+# GatewayRegistry Class
+class GatewayRegistry:
+    """
+    The payment gateways available to PaymentProcessing, keyed by the payment method each one handles.
+    
+    Any object with a `name` and an `authorize(details, amount)` method can be registered.
+    """
+    def __init__(self, gateways=()):
+        """
+        Initializes a GatewayRegistry.
+        
+        Args:
+            gateways (iterable, optional): The gateways to register.
+        """
+        self._gateways = {}
+        for gateway in gateways:
+            self.register(gateway)
+
+    @classmethod
+    def with_fake_servers(cls, *names, **gateway_options):
+        """
+        Creates a registry with one PaymentGateway per name, each backed by its own FakeGatewayServer.
+        
+        Args:
+            *names (str): The payment methods to register.
+            **gateway_options: Passed on to each PaymentGateway (e.g., max_connections, timeout).
+        
+        Returns:
+            GatewayRegistry: The new registry.
+        """
+        return cls(PaymentGateway(name, FakeGatewayServer().connect, **gateway_options) for name in names)
+
+    def register(self, gateway):
+        """
+        Registers a gateway, replacing any gateway already registered for its payment method.
+        """
+        self._gateways[gateway.name] = gateway
+
+    def unregister(self, name):
+        """
+        Removes the gateway for a payment method and closes it if it can be closed.
+        
+        Raises:
+            ValueError: If no gateway is registered for the method.
+        """
+        gateway = self.get(name)
+        del self._gateways[name]
+        if hasattr(gateway, "close"):
+            gateway.close()
+
+    def get(self, name):
+        """
+        Returns the gateway for a payment method.
+        
+        Raises:
+            ValueError: If no gateway is registered for the method.
+        """
+        try:
+            return self._gateways[name]
+        except KeyError:
+            raise ValueError("Invalid payment method") from None
+
+    def __contains__(self, name):
+        return name in self._gateways
+
+    def __iter__(self):
+        return iter(self._gateways)
+
+    def __len__(self):
+        return len(self._gateways)
+
+
+# LatencyHistogram Class
+class LatencyHistogram:
+    """
+    An HDR-style histogram of latencies in nanoseconds, with a fixed relative precision.
+    
+    Values below 64 ns get a bucket each. Above that, every power-of-two range is split into 32 equal
+    buckets, so a bucket is never wider than about 3% of the values in it, from nanoseconds up to
+    about 36 minutes (larger values land in the last bucket). Recording a value is a few integer
+    operations and a list increment.
+    
+    Attributes:
+        counts (list): The number of values recorded in each bucket.
+        total (int): The sum of the values recorded, in nanoseconds.
+    """
+    __slots__ = ("counts", "total")
+    MAX_BIT_LENGTH = 41  # Values of 2**41 ns and above share the last bucket.
+    BUCKET_COUNT = ((MAX_BIT_LENGTH - 6) << 5) + 64  # 64 single-value buckets, then 32 per power of two.
+
+    def __init__(self):
+        """
+        Initializes an empty LatencyHistogram.
+        """
+        self.counts = [0] * self.BUCKET_COUNT
+        self.total = 0
+
+    @staticmethod
+    def bucket_index(nanoseconds):
+        """
+        Returns the index of the bucket a value falls in.
+        """
+        if nanoseconds < 64:
+            return nanoseconds if nanoseconds > 0 else 0
+        shift = nanoseconds.bit_length() - 6
+        if shift < LatencyHistogram.MAX_BIT_LENGTH - 6:
+            return (shift << 5) + (nanoseconds >> shift)
+        return LatencyHistogram.BUCKET_COUNT - 1
+
+    @staticmethod
+    def bucket_upper_bound(index):
+        """
+        Returns the largest value that falls in a bucket.
+        """
+        if index < 64:
+            return index
+        shift = (index >> 5) - 1
+        return (((index & 31) | 32) + 1 << shift) - 1
+
+    def record(self, nanoseconds):
+        """
+        Records one latency.
+        
+        Args:
+            nanoseconds (int): The latency in nanoseconds.
+        """
+        self.counts[self.bucket_index(nanoseconds)] += 1
+        self.total += nanoseconds
+
+    def record_many(self, values):
+        """
+        Records many latencies at once. With NumPy, the buckets of all the values are found together,
+        at a small fraction of the cost of recording them one by one.
+        
+        Args:
+            values (list or numpy.ndarray): The latencies in nanoseconds.
+        """
+        if np is None:
+            counts, bucket_index = self.counts, self.bucket_index
+            for nanoseconds in values:
+                counts[bucket_index(nanoseconds)] += 1
+            self.total += sum(values)
+            return
+        values = np.asarray(values, dtype=np.int64)
+        array = np.maximum(values, 0)
+        shifts = np.frexp(array.astype(np.float64))[1] - 6  # frexp's exponent is the bit length for values >= 1.
+        indexes = np.where(array < 64, array, np.where(
+            shifts < self.MAX_BIT_LENGTH - 6, (shifts << 5) + (array >> np.maximum(shifts, 0)), self.BUCKET_COUNT - 1))
+        binned = np.bincount(indexes, minlength=self.BUCKET_COUNT)
+        counts = self.counts
+        for index in np.flatnonzero(binned).tolist():  # Latencies cluster, so few buckets are touched.
+            counts[index] += int(binned[index])
+        self.total += int(values.sum())
+
+    def merge(self, other):
+        """
+        Adds another histogram's values into this one.
+        """
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    @property
+    def count(self):
+        """
+        int: The number of values recorded.
+        """
+        return sum(self.counts)
+
+    def percentile(self, percent):
+        """
+        Returns the value below which a given percentage of the recorded values fall.
+        
+        Args:
+            percent (float): The percentile, from 0 to 100.
+        
+        Returns:
+            int: The upper bound of the bucket holding that value, in nanoseconds, or 0 if the histogram is empty.
+        """
+        count = self.count
+        if not count:
+            return 0
+        rank = max(1, -(-count * percent // 100))  # The 1-based rank of the value, rounded up.
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.bucket_upper_bound(index)
+        return self.bucket_upper_bound(len(self.counts) - 1)
+
+    def summary(self):
+        """
+        Summarizes the histogram.
+        
+        Returns:
+            dict: 'count', and 'mean', 'p50', 'p90', 'p99', 'p999' and 'max', in seconds.
+        """
+        count = self.count
+        summary = {"count": count, "mean": self.total / count / 1e9 if count else 0.0}
+        for label, percent in (("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9), ("max", 100)):
+            summary[label] = self.percentile(percent) / 1e9
+        return summary
+
+
+# PaymentMetrics Class
+class PaymentMetrics:
+    """
+    Latency histograms for each gateway and payment stage, and counts of successes, declines and errors.
+    
+    Each thread records into its own histograms and counters, so recording never takes a lock; a
+    snapshot adds the threads' figures together. PaymentProcessing records each payment with one
+    record_payment call, which counts the result and buffers the stage times to be bucketed in batches.
+    
+    Attributes:
+        STAGES (tuple): The payment stages record_payment times, in the order a payment goes through them.
+        FLUSH_SIZE (int): How many payments record_payment buffers per thread and gateway before
+                          adding their stage times to the histograms.
+        UNKNOWN_GATEWAY (str): Stands in for unsupported payment methods, so user input cannot add gateways.
+    """
+    STAGES = ("validate_payment_method", "gateway", "response_mapping")
+    UNKNOWN_GATEWAY = "unknown"
+    FLUSH_SIZE = 1024
+    _COMPLETE_MARKS = len(STAGES) + 1  # The marks of a payment that went through every stage.
+
+    def __init__(self):
+        """
+        Initializes an empty PaymentMetrics.
+        """
+        self._local = threading.local()
+        self._shards = []  # One (histograms, counters, record_payment state) triple per recording thread.
+        self._lock = threading.Lock()
+        self._flush_marks = self.FLUSH_SIZE * self._COMPLETE_MARKS
+
+    def observe(self, gateway, stage, nanoseconds):
+        """
+        Records how long one stage of a payment took.
+        
+        Args:
+            gateway (str): The gateway the payment went to.
+            stage (str): The stage of the payment.
+            nanoseconds (int): The time the stage took.
+        """
+        try:
+            histogram = self._local.histograms[gateway, stage]
+        except AttributeError:
+            histogram = self._add_shard()[0].setdefault((gateway, stage), LatencyHistogram())
+        except KeyError:
+            histogram = self._local.histograms[gateway, stage] = LatencyHistogram()
+        histogram.record(nanoseconds)
+
+    def count(self, gateway, status):
+        """
+        Counts one payment result.
+        
+        Args:
+            gateway (str): The gateway the payment went to.
+            status (str): The result's status: 'success', 'declined' or 'error'.
+        """
+        try:
+            counters = self._local.counters
+        except AttributeError:
+            counters = self._add_shard()[1]
+        statuses = counters.get(gateway)
+        if statuses is None:
+            statuses = counters[gateway] = {}
+        statuses[status] = statuses.get(status, 0) + 1
+
+    def record_payment(self, gateway, status, marks):
+        """
+        Records how long each stage of one payment took, and its result, in a single call.
+        
+        The result is counted straight away. The stage times are only buffered, per thread and gateway,
+        and every FLUSH_SIZE payments they are added to the histograms in one batch per stage, which
+        NumPy vectorizes when it is installed. A snapshot includes payments that are still buffered.
+        
+        Args:
+            gateway (str): The gateway the payment went to.
+            status (str): The result's status: 'success', 'declined' or 'error'.
+            marks (list): time.perf_counter_ns() readings at the start of the payment and at the end of
+                          each stage in STAGES it completed.
+        """
+        try:
+            bound = self._local.bound[gateway]
+        except (AttributeError, KeyError):
+            bound = self._bind(gateway)
+        statuses = bound[1]
+        statuses[status] = statuses.get(status, 0) + 1
+        if len(marks) == self._COMPLETE_MARKS:
+            completed = bound[2]
+            completed += marks  # Kept flat, so a batch converts to a NumPy array in one step.
+            if len(completed) >= self._flush_marks:
+                self._flush(bound)
+        else:
+            stopped = bound[3]
+            stopped.append(marks)
+            if len(stopped) >= self.FLUSH_SIZE:
+                self._flush(bound)
+
+    def snapshot(self):
+        """
+        Takes a consistent-enough copy of the metrics recorded so far by every thread.
+        
+        Returns:
+            dict: For each gateway, 'counters' (counts by status) and 'stages' (a LatencyHistogram summary
+                  by stage, in seconds).
+        """
+        histograms, counters = self._merged()
+        snapshot = {}
+        for (gateway, status), count in counters.items():
+            snapshot.setdefault(gateway, {"counters": {}, "stages": {}})["counters"][status] = count
+        for (gateway, stage), histogram in histograms.items():
+            snapshot.setdefault(gateway, {"counters": {}, "stages": {}})["stages"][stage] = histogram.summary()
+        return snapshot
+
+    def export_text(self):
+        """
+        Exports the metrics in the Prometheus text exposition format.
+        
+        Returns:
+            str: Stage latency summaries in seconds and result counters, one sample per line.
+        """
+        histograms, counters = self._merged()
+        lines = ["# TYPE payment_stage_latency_seconds summary"]
+        for (gateway, stage), histogram in sorted(histograms.items()):
+            labels = f'gateway="{gateway}",stage="{stage}"'
+            for quantile in (0.5, 0.9, 0.99, 0.999):
+                value = histogram.percentile(quantile * 100) / 1e9
+                lines.append(f'payment_stage_latency_seconds{{{labels},quantile="{quantile}"}} {value:.9f}')
+            lines.append(f"payment_stage_latency_seconds_sum{{{labels}}} {histogram.total / 1e9:.9f}")
+            lines.append(f"payment_stage_latency_seconds_count{{{labels}}} {histogram.count}")
+        lines.append("# TYPE payment_results_total counter")
+        for (gateway, status), count in sorted(counters.items()):
+            lines.append(f'payment_results_total{{gateway="{gateway}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+        with self._lock:
+            self._local = threading.local()
+            self._shards = []
+
+    def _add_shard(self):
+        """
+        Creates the calling thread's histograms and counters.
+        """
+        shard = ({}, {}, {})  # Histograms, counters, and record_payment state by gateway (see _bind).
+        self._local.histograms, self._local.counters, self._local.bound = shard
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def _bind(self, gateway):
+        """
+        Creates the calling thread's record_payment state for a gateway: its stage histograms in STAGES
+        order, its counts by status, the flattened marks of buffered payments that completed every
+        stage, and the marks of buffered payments that stopped early.
+        """
+        try:
+            histograms, counters, bound = self._local.histograms, self._local.counters, self._local.bound
+        except AttributeError:
+            histograms, counters, bound = self._add_shard()
+        bound[gateway] = [
+            tuple(histograms.setdefault((gateway, stage), LatencyHistogram()) for stage in self.STAGES),
+            counters.setdefault(gateway, {}),
+            [],
+            [],
+        ]
+        return bound[gateway]
+
+    @staticmethod
+    def _flush(bound):
+        """
+        Adds a gateway's buffered payments to its histograms.
+        """
+        histograms, _, completed, stopped = bound
+        # Swapped out first, so a snapshot taken meanwhile can miss these payments but never counts them twice.
+        bound[2], bound[3] = [], []
+        PaymentMetrics._record_marks(histograms, completed, stopped)
+
+    @staticmethod
+    def _record_marks(histograms, completed, stopped):
+        """
+        Adds the stage times of buffered payments to the histograms of their stages.
+        """
+        width = len(histograms) + 1
+        if completed and np is not None:
+            durations = np.diff(np.array(completed, dtype=np.int64).reshape(-1, width), axis=1)
+            for stage, histogram in enumerate(histograms):
+                histogram.record_many(durations[:, stage])
+        elif completed:
+            for stage, histogram in enumerate(histograms):
+                histogram.record_many([completed[i + 1] - completed[i] for i in range(stage, len(completed), width)])
+        for marks in stopped:
+            for histogram, started, ended in zip(histograms, marks, marks[1:]):
+                histogram.record(ended - started)
+
+    def _merged(self):
+        """
+        Adds every thread's histograms, buffered payments, and counters together.
+        """
+        with self._lock:
+            shards = list(self._shards)
+        histograms, counters = {}, {}
+        for shard_histograms, shard_counters, shard_bound in shards:
+            # Histograms are read before buffers; see record_payment.
+            for key, histogram in list(shard_histograms.items()):
+                if any(histogram.counts):  # Skip stages bound by record_payment but never reached.
+                    histograms.setdefault(key, LatencyHistogram()).merge(histogram)
+            for gateway, bound in list(shard_bound.items()):
+                buffered = tuple(LatencyHistogram() for _ in self.STAGES)
+                completed, stopped = list(bound[2]), list(bound[3])
+                del completed[len(completed) - len(completed) % self._COMPLETE_MARKS:]  # A payment being added.
+                self._record_marks(buffered, completed, stopped)
+                for stage, histogram in zip(self.STAGES, buffered):
+                    if any(histogram.counts):
+                        histograms.setdefault((gateway, stage), LatencyHistogram()).merge(histogram)
+            for gateway, statuses in list(shard_counters.items()):
+                for status, count in list(statuses.items()):
+                    counters[gateway, status] = counters.get((gateway, status), 0) + count
+        return histograms, counters
+
+
+# MetricsServer Class
+class MetricsServer:
+    """
+    Serves PaymentMetrics over HTTP on the local machine, from a background thread.
+    
+    GET /metrics returns the Prometheus text export, and GET /metrics.json returns the snapshot as JSON.
     
     Attributes:
-        available_gateways (list): A list of supported payment gateways such as 'credit_card' and 'paypal'.
+        metrics (PaymentMetrics): The metrics being served.
     """
-    def __init__(self):
-        """
-        Initializes the PaymentProcessing class with available payment gateways.
-        """
-        self.available_gateways = ["credit_card", "paypal"]
-
-    def validate_payment_method(self, payment_method, payment_details):
+    def __init__(self, metrics, host="127.0.0.1", port=0):
         """
-        Validates the selected payment method and its associated details.
+        Initializes a MetricsServer and binds its socket.
         
         Args:
-            payment_method (str): The selected payment method (e.g., 'credit_card', 'paypal').
-            payment_details (dict): The details required for the payment method (e.g., card number, expiry date).
-        
-        Returns:
-            bool: True if the payment method and details are valid, otherwise raises ValueError.
-        
-        Raises:
-            ValueError: If the payment method is not supported or if the payment details are invalid.
+            metrics (PaymentMetrics): The metrics to serve.
+            host (str, optional): The address to listen on. Defaults to the loopback address.
+            port (int, optional): The port to listen on. Defaults to any free port.
         """
-        # Check if the payment method is supported.
-        if payment_method not in self.available_gateways:
-            raise ValueError("Invalid payment method")
+        self.metrics = metrics
+        server = self
 
-        # Validate credit card details if the selected method is 'credit_card'.
-        if payment_method == "credit_card":
-            if not self.validate_credit_card(payment_details):
-                raise ValueError("Invalid credit card details")
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = server.metrics.export_text(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(server.metrics.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
 
-        # Validation passed.
-        return True
+            def log_message(self, format, *args):
+                pass  # Scrapes are frequent; keep them out of the application's output.
 
-    def validate_credit_card(self, details):
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
         """
-        Validates the credit card details (e.g., card number, expiry date, CVV).
-        
-        Args:
-            details (dict): A dictionary containing 'card_number', 'expiry_date', and 'cvv'.
+        str: The base URL the server listens on.
+        """
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Starts serving in a background thread.
         
         Returns:
-            bool: True if the card details are valid, False otherwise.
+            MetricsServer: This server, so it can be started where it is created.
         """
-        card_number = details.get("card_number", "")
-        expiry_date = details.get("expiry_date", "")
-        cvv = details.get("cvv", "")
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="payment-metrics")
+        self._thread.start()
+        return self
 
-        # Basic validation: Check if the card number is 16 digits and CVV is 3 digits.
-        if len(card_number) != 16 or len(cvv) != 3:
-            return False
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
 
-        # More advanced validations like the Luhn Algorithm for card number can be added here.
-        return True
 
-    def process_payment(self, order, payment_method, payment_details):
+# An expiry date a few years ahead, so the test cards never expire.
+CARD_EXPIRY = f"12/{datetime.date.today().year + 5}"
+
+
+# Unit tests for Money class
+class TestMoney(unittest.TestCase):
+    """
+    Unit tests for the Money class to ensure amounts are converted, added, and rounded exactly.
+    """
+    def test_from_amount(self):
         """
-        Processes the payment for an order, validating the payment method and interacting with the payment gateway.
-        
-        Args:
-            order (dict): The order details, including total amount.
-            payment_method (str): The selected payment method.
-            payment_details (dict): The details required for the payment method.
-        
-        Returns:
-            str: A message indicating whether the payment was successful or failed.
+        Test case for converting amounts of different types to cents.
         """
-        try:
-            # Validate the payment method and details.
-            self.validate_payment_method(payment_method, payment_details)
-            
-            # Simulate interaction with the payment gateway.
-            payment_response = self.mock_payment_gateway(payment_method, payment_details, order["total_amount"])
+        self.assertEqual(Money.from_amount(12.99).cents, 1299)
+        self.assertEqual(Money.from_amount("0.10").cents, 10)
+        self.assertEqual(Money.from_amount(5).cents, 500)
+        self.assertEqual(Money.from_amount(Decimal("19.999")).cents, 2000)
+        self.assertEqual(Money.from_amount(1.005).cents, 101)  # Read as the decimal 1.005, not the float below it.
+        with self.assertRaises(ValueError):
+            Money.from_amount("twelve")
 
-            # Return the appropriate message based on the payment gateway's response.
-            if payment_response["status"] == "success":
-                return "Payment successful, Order confirmed"
-            else:
-                return "Payment failed, please try again"
-
-        except Exception as e:
-            # Catch and return any validation or processing errors.
-            return f"Error: {str(e)}"
+    def test_sums_do_not_drift(self):
+        """
+        Test case for adding many amounts that cannot be represented exactly as binary floats.
+        """
+        total = sum(Money.from_amount(0.10) for _ in range(1000))
+        self.assertEqual(total, Money(10000))
+        self.assertEqual(str(total - Money(10050)), "-$0.50")
+        self.assertEqual(f"{Money(1299):.2f}", "12.99")
 
-    def mock_payment_gateway(self, method, details, amount):
+    def test_apply_rate_rounding(self):
         """
-        Simulates the interaction with a payment gateway for processing payments.
-        
-        Args:
-            method (str): The payment method (e.g., 'credit_card').
-            details (dict): The payment details (e.g., card number).
-            amount (float): The amount to be charged.
-        
-        Returns:
-            dict: A mock response from the payment gateway, indicating success or failure.
+        Test case for rounding a rate applied to an amount with different rounding modes.
         """
-        # Simulate card decline for a specific card number.
-        if method == "credit_card" and details["card_number"] == "1111222233334444":
-            return {"status": "failure", "message": "Card declined"}
+        self.assertEqual(Money(125).apply_rate("0.10"), Money(13))  # 12.5 cents rounds half up.
+        self.assertEqual(Money(125).apply_rate("0.10", rounding="ROUND_HALF_EVEN"), Money(12))
 
-        # Mock a successful transaction.
-        return {"status": "success", "transaction_id": "abc123"}
+    def test_round_ratio_matches_decimal(self):
+        """
+        Test case for integer rounding agreeing with Decimal.quantize in every rounding mode.
+        """
+        modes = (ROUND_05UP, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_DOWN, ROUND_HALF_EVEN,
+                 ROUND_HALF_UP, ROUND_UP)
+        for rounding in modes:
+            for numerator in range(-60, 61):
+                for denominator in (1, 4, 10, 20):
+                    expected = (Decimal(numerator) / denominator).quantize(Decimal(1), rounding=rounding)
+                    self.assertEqual(Money.round_ratio(numerator, denominator, rounding), int(expected),
+                                     (numerator, denominator, rounding))
+        with self.assertRaises(ValueError):
+            Money.round_ratio(1, 3, "ROUND_SIDEWAYS")
 
 
 # Unit tests for PaymentProcessing class
@@ -126,7 +2289,7 @@ class TestPaymentProcessing(unittest.TestCase):
         """
         Test case for successful validation of a valid payment method ('credit_card') with valid details.
         """
-        payment_details = {"card_number": "1234567812345678", "expiry_date": "12/25", "cvv": "123"}
+        payment_details = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
         result = self.payment_processing.validate_payment_method("credit_card", payment_details)
         self.assertTrue(result)
 
@@ -134,7 +2297,7 @@ class TestPaymentProcessing(unittest.TestCase):
         """
         Test case for validation failure due to an unsupported payment method ('bitcoin').
         """
-        payment_details = {"card_number": "1234567812345678", "expiry_date": "12/25", "cvv": "123"}
+        payment_details = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
         with self.assertRaises(ValueError) as context:
             self.payment_processing.validate_payment_method("bitcoin", payment_details)
         self.assertEqual(str(context.exception), "Invalid payment method")
@@ -143,16 +2306,51 @@ class TestPaymentProcessing(unittest.TestCase):
         """
         Test case for validation failure due to invalid credit card details (invalid card number and CVV).
         """
-        payment_details = {"card_number": "1234", "expiry_date": "12/25", "cvv": "12"}  # Invalid card number and CVV.
+        payment_details = {"card_number": "1234", "expiry_date": CARD_EXPIRY, "cvv": "12"}  # Invalid card number and CVV.
         result = self.payment_processing.validate_credit_card(payment_details)
         self.assertFalse(result)
 
+    def test_validate_credit_card_checks(self):
+        """
+        Test case for the Luhn check, network lengths and CVVs, and expiry dates.
+        """
+        validator = CardValidator()
+        today = datetime.date(2030, 6, 15)
+
+        def check(card_number, expiry_date="12/30", cvv="123"):
+            details = {"card_number": card_number, "expiry_date": expiry_date, "cvv": cvv}
+            return validator.validate(details, today=today)
+
+        self.assertEqual(check("4111 1111 1111 1111"), {"valid": True, "network": "visa", "message": "Valid card"})
+        self.assertEqual(check("4111111111111112")["message"], "Invalid card number")  # Fails the Luhn check.
+        self.assertEqual(check("5555555555554444")["network"], "mastercard")
+        self.assertEqual(check("2223003122003222")["network"], "mastercard")  # The newer 2-series range.
+        self.assertEqual(check("378282246310005", cvv="1234")["network"], "amex")
+        self.assertEqual(check("378282246310005")["message"], "Invalid CVV")  # Amex CVVs have 4 digits.
+        self.assertEqual(check("37828224631000")["message"], "Invalid card number")  # Passes Luhn, too short for Amex.
+        self.assertTrue(check("1111222233334444")["valid"])  # No network claims it; 16 digits is a valid length.
+        self.assertEqual(check("4111111111111111", expiry_date="05/30")["message"], "Card has expired")
+        self.assertTrue(check("4111111111111111", expiry_date="6/2030")["valid"])  # Valid through the month.
+        self.assertEqual(check("4111111111111111", expiry_date="13/30")["message"], "Invalid expiry date")
+
+    def test_validate_credit_cards_batch(self):
+        """
+        Test case for checking many card numbers at once, with and without NumPy.
+        """
+        card_numbers = ["4111111111111111", "4111111111111112", "378282246310005", "3782822463100050",
+                        "6011111111111117", "3530111333300000", "1234", "4111-1111-1111-1111", "4111x11111111111",
+                        "12345678903555555555", ""]
+        expected = [True, False, True, False, True, True, False, True, False, False, False]
+        self.assertEqual(self.payment_processing.validate_credit_cards(card_numbers), expected)
+        with mock.patch(__name__ + ".np", None):
+            self.assertEqual(self.payment_processing.validate_credit_cards(card_numbers), expected)
+
     def test_process_payment_success(self):
         """
         Test case for successful payment processing using the 'credit_card' method with valid details.
         """
         order = {"total_amount": 100.00}
-        payment_details = {"card_number": "1234567812345678", "expiry_date": "12/25", "cvv": "123"}
+        payment_details = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
 
         # Use mock to simulate a successful payment response from the gateway.
         with mock.patch.object(self.payment_processing, 'mock_payment_gateway', return_value={"status": "success"}):
@@ -164,7 +2362,7 @@ class TestPaymentProcessing(unittest.TestCase):
         Test case for payment failure due to a declined credit card.
         """
         order = {"total_amount": 100.00}
-        payment_details = {"card_number": "1111222233334444", "expiry_date": "12/25", "cvv": "123"}  # Simulate a declined card.
+        payment_details = {"card_number": "1111222233334444", "expiry_date": CARD_EXPIRY, "cvv": "123"}  # Simulate a declined card.
 
         # Use mock to simulate a failed payment response from the gateway.
         with mock.patch.object(self.payment_processing, 'mock_payment_gateway', return_value={"status": "failure"}):
@@ -176,12 +2374,646 @@ class TestPaymentProcessing(unittest.TestCase):
         Test case for payment processing failure due to an invalid payment method ('bitcoin').
         """
         order = {"total_amount": 100.00}
-        payment_details = {"card_number": "1234567812345678", "expiry_date": "12/25", "cvv": "123"}
+        payment_details = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
 
         # No need for mocking, the method will raise an error directly.
         result = self.payment_processing.process_payment(order, "bitcoin", payment_details)
         self.assertIn("Error: Invalid payment method", result)
 
+    def test_authorize_payment_results(self):
+        """
+        Test case for structured results carrying the status, error code, transaction id, and latency.
+        """
+        order = {"total_amount": 100.00}
+        payment_details = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+        result = self.payment_processing.authorize_payment(order, "credit_card", payment_details)
+        self.assertEqual((result.status, result.error_code), (PaymentResult.SUCCESS, None))
+        self.assertTrue(result.succeeded)
+        self.assertTrue(result.transaction_id.startswith("fake"))
+        self.assertGreaterEqual(result.latency, 0)
+        self.assertFalse(hasattr(result, "__dict__"))
+
+        declined = dict(payment_details, card_number="1111222233334444")
+        result = self.payment_processing.authorize_payment(order, "credit_card", declined)
+        self.assertEqual((result.status, result.error_code), (PaymentResult.DECLINED, "declined"))
+
+        result = self.payment_processing.authorize_payment(order, "bitcoin", payment_details)
+        self.assertEqual((result.status, result.error_code, result.latency), (PaymentResult.ERROR, "invalid_request", None))
+        self.assertIsInstance(result.error, ValueError)
+        self.assertEqual(result.message, "Error: Invalid payment method")
+
+        self.assertEqual(PaymentResult.from_error(GatewayUnavailableError("down")).error_code, "gateway_unavailable")
+        self.assertEqual(PaymentResult.from_error(KeyError("total_amount")).error_code, "error")
+
+    def test_process_payment_charges_exact_cents(self):
+        """
+        Test case for the gateway receiving the order total as an exact Money amount.
+        """
+        order = {"total_amount": 0.1 + 0.2}  # 0.30000000000000004 as a float.
+        payment_details = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+        with mock.patch.object(self.payment_processing, 'mock_payment_gateway',
+                               return_value={"status": "success"}) as gateway:
+            self.payment_processing.process_payment(order, "credit_card", payment_details)
+        gateway.assert_called_once_with("credit_card", payment_details, Money(30))
+
+    def test_process_payment_async(self):
+        """
+        Test case for the asynchronous payment path giving the same messages as the blocking one.
+        """
+        order = {"total_amount": 100.00}
+        valid = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+        declined = {"card_number": "1111222233334444", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+        processing = PaymentProcessing(async_gateway=SimulatedGateway(latency=0))
+
+        async def pay_all():
+            return await asyncio.gather(
+                processing.process_payment_async(order, "credit_card", valid),
+                processing.process_payment_async(order, "credit_card", declined),
+                processing.process_payment_async(order, "bitcoin", valid),
+            )
+
+        self.assertEqual(asyncio.run(pay_all()), [
+            "Payment successful, Order confirmed",
+            "Payment failed, please try again",
+            "Error: Invalid payment method",
+        ])
+        self.assertEqual(processing.async_gateway.calls, 2)  # Invalid payments never reach the gateway.
+
+    def test_process_payment_async_overlaps_gateway_calls(self):
+        """
+        Test case for many payments waiting on the gateway at once instead of one after another.
+        """
+        order = {"total_amount": 25}
+        payment_details = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+        processing = PaymentProcessing(async_gateway=SimulatedGateway(latency=0.05))
+
+        async def pay_many():
+            return await asyncio.gather(*(processing.process_payment_async(order, "paypal", payment_details)
+                                          for _ in range(500)))
+
+        start = time.perf_counter()
+        results = asyncio.run(pay_many())
+        self.assertEqual(results.count("Payment successful, Order confirmed"), 500)
+        self.assertLess(time.perf_counter() - start, 2.0)  # 500 round trips back to back would take 25 s.
+
+
+# Unit tests for IdempotencyStore class and idempotent payments
+class TestIdempotency(unittest.TestCase):
+    """
+    Unit tests for keeping payment results by idempotency key so that retried payments are not charged twice.
+    """
+    def setUp(self):
+        """
+        Sets up a PaymentProcessing instance with a fake credit card gateway and a manual clock.
+        """
+        self.now = 1000.0
+        self.store = IdempotencyStore(max_entries=3, ttl=60, clock=lambda: self.now)
+        self.server = FakeGatewayServer()
+        gateway = PaymentGateway("credit_card", self.server.connect, retry=RetryPolicy(max_attempts=1))
+        self.payment_processing = PaymentProcessing(gateways=GatewayRegistry([gateway]), idempotency_store=self.store)
+        self.order = {"total_amount": 20}
+        self.card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+    def pay(self, key):
+        """
+        Pays the test order with the test card under an idempotency key.
+        """
+        return self.payment_processing.process_payment(self.order, "credit_card", self.card, idempotency_key=key)
+
+    def test_repeated_key_is_charged_once(self):
+        """
+        Test case for a retried payment returning the first result without another gateway call.
+        """
+        self.assertEqual(self.pay("order-1"), "Payment successful, Order confirmed")
+        self.assertEqual(self.pay("order-1"), "Payment successful, Order confirmed")
+        self.assertEqual(self.server.requests, 1)
+        self.pay("order-2")
+        self.assertEqual(self.server.requests, 2)
+
+    def test_concurrent_callers_share_one_charge(self):
+        """
+        Test case for simultaneous payments with the same key reaching the gateway only once.
+        """
+        self.server.latency = 0.02
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.pay("double-click"))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["Payment successful, Order confirmed"] * 10)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_errors_are_not_kept(self):
+        """
+        Test case for a payment that failed with an error being retried under the same key.
+        """
+        self.server.inject_faults(ConnectionError("Connection reset"))
+        self.assertEqual(self.pay("order-1"), "Error: Connection reset")
+        self.assertEqual(self.pay("order-1"), "Payment successful, Order confirmed")
+        self.assertEqual(self.server.requests, 2)
+
+    def test_entries_expire_and_are_bounded(self):
+        """
+        Test case for results expiring after the TTL and the least recently used results being evicted.
+        """
+        for key in ("a", "b", "c"):
+            self.store.put(key, key.upper())
+        self.assertEqual(self.store.get("a"), "A")  # "a" is now the most recently used.
+        self.store.put("d", "D")
+        self.assertIsNone(self.store.get("b"))
+        self.assertEqual(len(self.store), 3)
+
+        self.now += 60
+        self.assertIsNone(self.store.get("a"))
+        self.store.put("e", "E")
+        self.assertEqual(len(self.store), 1)  # Every older entry has expired.
+
+    def test_disk_backend_survives_restart(self):
+        """
+        Test case for results kept on disk being found by a new store opened on the same file.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "idempotency")
+            store = IdempotencyStore(path=path)
+            store.put("order-1", "Payment successful, Order confirmed")
+            store.close()
+
+            reopened = IdempotencyStore(path=path)
+            self.assertEqual(reopened.get("order-1"), "Payment successful, Order confirmed")
+            reopened.close()
+
+    def test_key_is_bound_to_its_request(self):
+        """
+        Test case for an idempotency key reused for a different payment being rejected instead of answered.
+        """
+        self.assertEqual(self.pay("order-1"), "Payment successful, Order confirmed")
+        self.order = {"total_amount": 20.00}  # The same amount, given as a float.
+        self.assertEqual(self.pay("order-1"), "Payment successful, Order confirmed")
+        self.order = {"total_amount": 25}
+        self.assertEqual(self.pay("order-1"), "Error: Idempotency key 'order-1' was already used for a different request")
+        self.order = {"total_amount": 20}
+        self.card = dict(self.card, card_number="5555555555554444")
+        result = self.payment_processing.authorize_payment(self.order, "credit_card", self.card, "order-1")
+        self.assertEqual((result.status, result.error_code), (PaymentResult.ERROR, "invalid_request"))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_expired_entries_are_swept_from_disk(self):
+        """
+        Test case for expired results being deleted from the file, not only from memory.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "idempotency")
+            store = IdempotencyStore(ttl=60, path=path, clock=lambda: self.now)
+            for key in ("a", "b", "c"):
+                store.put(key, key.upper())
+            self.now += 61
+            store.put("d", "D")  # Past the sweep interval, so the expired keys go.
+            self.assertEqual(sorted(store._disk), ["d"])
+            store.close()
+
+            self.now += 61
+            reopened = IdempotencyStore(ttl=60, path=path, clock=lambda: self.now)
+            self.assertEqual(len(reopened._disk), 0)
+            reopened.close()
+
+
+# Unit tests for the gateway plugins and their connection pools
+class TestPaymentGateways(unittest.TestCase):
+    """
+    Unit tests for the gateway registry and pooled gateway connections, run against in-process fake servers.
+    """
+    def setUp(self):
+        """
+        Sets up a registry whose credit card gateway talks to a fake server.
+        """
+        self.server = FakeGatewayServer()
+        self.gateway = PaymentGateway("credit_card", self.server.connect, max_connections=2, timeout=1.0,
+                                      retry=RetryPolicy(max_attempts=1))  # Count each request exactly once.
+        self.payment_processing = PaymentProcessing(gateways=GatewayRegistry([self.gateway]))
+        self.order = {"total_amount": 20}
+        self.card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+    def test_connections_are_kept_alive(self):
+        """
+        Test case for back-to-back payments reusing one connection instead of opening one each.
+        """
+        for _ in range(20):
+            result = self.payment_processing.process_payment(self.order, "credit_card", self.card)
+            self.assertEqual(result, "Payment successful, Order confirmed")
+        self.assertEqual(self.server.requests, 20)
+        self.assertEqual(self.server.connections_opened, 1)
+
+    def test_concurrency_is_limited_per_gateway(self):
+        """
+        Test case for a gateway never having more requests in flight than its pool allows.
+        """
+        self.server.latency = 0.02
+        threads = [threading.Thread(target=self.payment_processing.process_payment,
+                                    args=(self.order, "credit_card", self.card)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.requests, 8)
+        self.assertEqual(self.server.peak_in_flight, 2)
+        self.assertLessEqual(self.server.connections_opened, 2)
+
+    def test_timeouts(self):
+        """
+        Test case for a slow gateway timing out and for waiting on a pool whose connections are all in use.
+        """
+        self.server.latency = 0.2
+        self.gateway.timeout = 0.01
+        result = self.payment_processing.process_payment(self.order, "credit_card", self.card)
+        self.assertTrue(result.startswith("Error: credit_card gateway did not answer"))
+
+        self.gateway.pool.acquire()
+        self.gateway.pool.acquire()
+        with self.assertRaises(TimeoutError):
+            self.gateway.pool.acquire(timeout=0.01)
+
+    def test_timed_out_connection_is_not_reused(self):
+        """
+        Test case for closing a connection that timed out rather than returning it to the pool.
+        """
+        self.server.latency = 0.05
+        self.gateway.timeout = 0.01
+        self.payment_processing.process_payment(self.order, "credit_card", self.card)
+        self.server.latency = 0
+        self.payment_processing.process_payment(self.order, "credit_card", self.card)
+        self.assertEqual(self.server.connections_opened, 2)
+
+    def test_idle_connections_expire(self):
+        """
+        Test case for an idle connection being closed instead of reused once it has idled too long.
+        """
+        now = [0.0]
+        pool = ConnectionPool(self.server.connect, max_size=1, max_idle=10, clock=lambda: now[0])
+        connection = pool.acquire()
+        pool.release(connection)
+        self.assertIs(pool.acquire(), connection)
+        pool.release(connection)
+        now[0] = 11.0
+        self.assertIsNot(pool.acquire(), connection)
+        self.assertFalse(connection.is_open)
+
+    def test_registry_plugins(self):
+        """
+        Test case for registering and removing a gateway plugin for a new payment method.
+        """
+        gift_cards = mock.Mock(spec=["name", "authorize"], **{"authorize.return_value": {"status": "success"}})
+        gift_cards.name = "gift_card"
+        self.payment_processing.gateways.register(gift_cards)
+        self.assertEqual(self.payment_processing.available_gateways, ["credit_card", "gift_card"])
+        result = self.payment_processing.process_payment(self.order, "gift_card", {"code": "GIFT-1"})
+        self.assertEqual(result, "Payment successful, Order confirmed")
+        gift_cards.authorize.assert_called_once_with({"code": "GIFT-1"}, Money(2000))
+
+        self.payment_processing.gateways.unregister("gift_card")
+        with self.assertRaises(ValueError):
+            self.payment_processing.validate_payment_method("gift_card", {})
+
+    def test_async_payments_use_the_registered_gateways(self):
+        """
+        Test case for asynchronous payments going through the same plugin and idempotency store as blocking ones.
+        """
+        gift_cards = mock.Mock(spec=["name", "authorize"], **{"authorize.return_value": {"status": "failure"}})
+        gift_cards.name = "gift_card"
+        self.payment_processing.gateways.register(gift_cards)
+        blocking = self.payment_processing.authorize_payment(self.order, "gift_card", {"code": "GIFT-1"})
+        awaited = asyncio.run(self.payment_processing.authorize_payment_async(self.order, "gift_card",
+                                                                              {"code": "GIFT-1"}))
+        self.assertEqual((blocking.status, awaited.status), (PaymentResult.DECLINED, PaymentResult.DECLINED))
+        self.assertEqual(gift_cards.authorize.call_count, 2)
+
+        first = self.payment_processing.authorize_payment(self.order, "credit_card", self.card, "order-1")
+        again = asyncio.run(self.payment_processing.authorize_payment_async(self.order, "credit_card", self.card,
+                                                                            "order-1"))
+        self.assertEqual(again, first)
+        self.assertEqual(self.server.authorizations, 1)
+
+
+# Unit tests for PaymentBatcher class
+class TestPaymentBatching(unittest.TestCase):
+    """
+    Unit tests for coalescing concurrent payments to one gateway into batch requests.
+    """
+    def setUp(self):
+        """
+        Sets up PaymentProcessing with a fake credit card gateway behind a PaymentBatcher.
+        """
+        self.server = FakeGatewayServer()
+        self.gateway = PaymentGateway("credit_card", self.server.connect, retry=RetryPolicy(max_attempts=1))
+        self.batcher = PaymentBatcher(max_batch_size=10, max_wait=0.05)
+        self.payment_processing = PaymentProcessing(gateways=GatewayRegistry([self.gateway]), batcher=self.batcher)
+        self.order = {"total_amount": 20}
+        self.card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+        self.declined = {"card_number": "1111222233334444", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+    def tearDown(self):
+        """
+        Stops the batcher's threads.
+        """
+        self.batcher.close()
+
+    def test_concurrent_payments_share_a_request(self):
+        """
+        Test case for payments made at the same time reaching the gateway as one batch, each with its own result.
+        """
+        results = [None] * 10
+
+        def pay(position):
+            details = self.declined if position == 3 else self.card
+            results[position] = self.payment_processing.process_payment(self.order, "credit_card", details)
+
+        threads = [threading.Thread(target=pay, args=(position,)) for position in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results[3], "Payment failed, please try again")
+        self.assertEqual(results.count("Payment successful, Order confirmed"), 9)
+        self.assertEqual(self.server.authorizations, 10)
+        self.assertLessEqual(self.server.requests, 2)  # Usually 1; 2 if a thread starts after the window closes.
+
+    def test_full_batches_are_sent_without_waiting(self):
+        """
+        Test case for a batch being sent as soon as it reaches the size limit.
+        """
+        self.batcher.max_batch_size = 3
+        self.batcher.max_wait = 10.0
+        futures = [self.batcher.submit(self.gateway, self.card, Money(100 * n)) for n in range(1, 7)]
+        responses = [future.result(timeout=1.0) for future in futures]
+        self.assertEqual([response["status"] for response in responses], ["success"] * 6)
+        self.assertEqual(len({response["transaction_id"] for response in responses}), 6)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_batch_errors_reach_every_caller(self):
+        """
+        Test case for a failed batch request failing each payment in it.
+        """
+        self.server.inject_faults(ConnectionError("Connection reset"))
+        futures = [self.batcher.submit(self.gateway, self.card, Money(100)) for _ in range(3)]
+        for future in futures:
+            with self.assertRaises(ConnectionError):
+                future.result(timeout=1.0)
+
+    def test_gateways_without_batch_support(self):
+        """
+        Test case for a gateway plugin without authorize_batch getting one call per payment.
+        """
+        wallet = mock.Mock(spec=["name", "authorize"], **{"authorize.return_value": {"status": "success"}})
+        wallet.name = "paypal"
+        futures = [self.batcher.submit(wallet, {}, Money(100)) for _ in range(4)]
+        self.assertEqual([future.result(timeout=1.0) for future in futures], [{"status": "success"}] * 4)
+        self.assertEqual(wallet.authorize.call_count, 4)
+
+    def test_per_payment_failures_stay_with_their_payment(self):
+        """
+        Test case for one failing payment in a mixed batch not failing the payments before or after it.
+        """
+        wallet = mock.Mock(spec=["name", "authorize"])
+        wallet.name = "paypal"
+        wallet.authorize.side_effect = [{"status": "success"}, ConnectionError("Connection reset"),
+                                        {"status": "failure"}]
+        self.batcher.max_wait = 10.0
+        self.batcher.max_batch_size = 3
+        futures = [self.batcher.submit(wallet, {}, Money(100)) for _ in range(3)]
+        self.assertEqual(futures[0].result(timeout=1.0), {"status": "success"})
+        with self.assertRaises(ConnectionError):
+            futures[1].result(timeout=1.0)
+        self.assertEqual(futures[2].result(timeout=1.0), {"status": "failure"})
+        self.assertEqual(wallet.authorize.call_count, 3)
+
+    def test_close_resolves_every_future(self):
+        """
+        Test case for payments queued before close being sent, and payments after close being refused.
+        """
+        self.batcher.max_wait = 10.0
+        futures = [self.batcher.submit(self.gateway, self.card, Money(100)) for _ in range(3)]
+        self.batcher.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual([future.result()["status"] for future in futures], ["success"] * 3)
+        with self.assertRaises(RuntimeError):
+            self.batcher.submit(self.gateway, self.card, Money(100))
+        self.assertEqual(self.batcher.result_timeout(self.gateway), 10.0 + 10.0)  # One attempt of 2 x 5 s.
+
+
+# Unit tests for LatencyHistogram, PaymentMetrics and MetricsServer classes
+class TestPaymentMetrics(unittest.TestCase):
+    """
+    Unit tests for the latency histograms, result counters, and metrics export.
+    """
+    def setUp(self):
+        """
+        Sets up PaymentProcessing with its own metrics.
+        """
+        self.payment_processing = PaymentProcessing()
+        self.metrics = self.payment_processing.metrics
+        self.order = {"total_amount": 20}
+        self.card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+    def test_histogram_precision(self):
+        """
+        Test case for percentiles staying within the histogram's relative precision.
+        """
+        histogram = LatencyHistogram()
+        for microseconds in range(1, 1001):
+            histogram.record(microseconds * 1000)
+        self.assertEqual(histogram.count, 1000)
+        for percent in (50, 90, 99, 100):
+            exact = percent * 10 * 1000
+            self.assertGreaterEqual(histogram.percentile(percent), exact)
+            self.assertLessEqual(histogram.percentile(percent), exact * 1.035)
+        for value in (0, 63, 64, 65, 1000, 123_456_789, 2 ** 50):
+            index = LatencyHistogram.bucket_index(value)
+            self.assertLess(index, LatencyHistogram.BUCKET_COUNT)
+            if value < 2 ** 41:
+                self.assertLessEqual(value, LatencyHistogram.bucket_upper_bound(index))
+
+    def test_record_many_matches_record(self):
+        """
+        Test case for recording latencies in a batch filling the same buckets as recording them one by one.
+        """
+        values = [-5, 0, 1, 63, 64, 65, 1000, 123_456_789, 2 ** 41 - 1, 2 ** 41, 2 ** 50] + list(range(0, 10 ** 7, 9973))
+        one_by_one = LatencyHistogram()
+        for value in values:
+            one_by_one.record(value)
+        for numpy_module in ((None,) if np is None else (np, None)):
+            with mock.patch(f"{__name__}.np", numpy_module):
+                batched = LatencyHistogram()
+                batched.record_many(values)
+            self.assertEqual(batched.counts, one_by_one.counts)
+            self.assertEqual(batched.total, one_by_one.total)
+
+    def test_buffered_payments_are_flushed_and_included_in_snapshots(self):
+        """
+        Test case for record_payment's buffered stage times showing up in snapshots before and after a flush.
+        """
+        count = PaymentMetrics.FLUSH_SIZE + 10
+        for i in range(count):
+            self.metrics.record_payment("credit_card", "success", [0, 1000, 1000 + i, 2000 + i])
+        self.metrics.record_payment("credit_card", "error", [0])
+        stages = self.metrics.snapshot()["credit_card"]["stages"]
+        self.assertEqual({stage: summary["count"] for stage, summary in stages.items()},
+                         dict.fromkeys(PaymentMetrics.STAGES, count))
+        self.assertEqual(self.metrics.snapshot()["credit_card"]["counters"], {"success": count, "error": 1})
+        self.assertEqual(len(self.metrics._local.bound["credit_card"][2]), 10 * 4)  # The rest were flushed.
+
+    def test_payments_are_counted_and_timed_per_stage(self):
+        """
+        Test case for stage latencies and success, decline, and error counts being recorded per gateway.
+        """
+        self.payment_processing.process_payment(self.order, "credit_card", self.card)
+        self.payment_processing.process_payment(self.order, "credit_card", dict(self.card, card_number="1111222233334444"))
+        self.payment_processing.process_payment(self.order, "credit_card", dict(self.card, cvv="1"))
+        self.payment_processing.process_payment(self.order, "bitcoin", self.card)
+
+        thread = threading.Thread(target=self.payment_processing.process_payment,
+                                  args=(self.order, "paypal", {}))
+        thread.start()
+        thread.join()
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["credit_card"]["counters"], {"success": 1, "declined": 1, "error": 1})
+        self.assertEqual(snapshot["unknown"]["counters"], {"error": 1})
+        self.assertEqual(snapshot["paypal"]["counters"], {"success": 1})  # Recorded on another thread.
+        stages = snapshot["credit_card"]["stages"]
+        self.assertEqual(set(stages), {"validate_payment_method", "gateway", "response_mapping"})
+        self.assertEqual(stages["gateway"]["count"], 2)  # The invalid card never reached the gateway.
+        self.assertGreater(stages["gateway"]["max"], 0)
+
+    def test_export_and_metrics_endpoint(self):
+        """
+        Test case for the text export and for serving it, and the JSON snapshot, over local HTTP.
+        """
+        self.payment_processing.process_payment(self.order, "credit_card", self.card)
+        text = self.metrics.export_text()
+        self.assertIn('payment_results_total{gateway="credit_card",status="success"} 1', text)
+        self.assertIn('payment_stage_latency_seconds_count{gateway="credit_card",stage="gateway"} 1', text)
+
+        server = MetricsServer(self.metrics).start()
+        try:
+            with urllib.request.urlopen(server.url + "/metrics", timeout=5) as response:
+                self.assertEqual(response.read().decode("utf-8"), text)
+            with urllib.request.urlopen(server.url + "/metrics.json", timeout=5) as response:
+                self.assertEqual(json.load(response)["credit_card"]["counters"], {"success": 1})
+        finally:
+            server.stop()
+
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot(), {})
+
+
+# Unit tests for gateway retries and circuit breakers
+class TestGatewayResilience(unittest.TestCase):
+    """
+    Unit tests for retrying transient gateway failures and failing fast while a gateway is down.
+    """
+    def setUp(self):
+        """
+        Sets up a credit card gateway with a fake server, a manual clock and recorded (not real) retry waits.
+        """
+        self.now = 0.0
+        self.waits = []
+        self.server = FakeGatewayServer()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=lambda: self.now)
+        self.gateway = PaymentGateway("credit_card", self.server.connect, breaker=self.breaker,
+                                      retry=RetryPolicy(max_attempts=3, seed=1, sleep=self.waits.append))
+        self.payment_processing = PaymentProcessing(gateways=GatewayRegistry([self.gateway]))
+        self.order = {"total_amount": 20}
+        self.card = {"card_number": "4111111111111111", "expiry_date": CARD_EXPIRY, "cvv": "123"}
+
+    def pay(self):
+        """
+        Pays the test order with the test card.
+        """
+        return self.payment_processing.process_payment(self.order, "credit_card", self.card)
+
+    def test_transient_failures_are_retried(self):
+        """
+        Test case for retrying dropped connections and busy servers with growing, jittered waits.
+        """
+        self.server.inject_faults(ConnectionError("Connection reset"), TransientGatewayError("Server busy"))
+        self.assertEqual(self.pay(), "Payment successful, Order confirmed")
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.waits), 2)
+        self.assertLessEqual(self.waits[0], 0.05)
+        self.assertLessEqual(self.waits[1], 0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_other_failures_are_not_retried(self):
+        """
+        Test case for declines and non-transient errors going straight back to the caller.
+        """
+        self.server.inject_faults(KeyError("card_number"))
+        self.assertEqual(self.pay(), "Error: 'card_number'")
+        self.card["card_number"] = "1111222233334444"
+        self.assertEqual(self.pay(), "Payment failed, please try again")
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(self.waits, [])
+
+    def test_answer_timeouts_are_not_retried(self):
+        """
+        Test case for a payment whose answer timed out not being sent again, since it may already have been charged,
+        while a timeout waiting for a free connection is retried.
+        """
+        self.server.inject_faults(TimeoutError("Gateway timed out"))
+        self.assertEqual(self.pay(), "Error: Gateway timed out")
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.waits, [])
+
+        with mock.patch.object(self.gateway.pool, "acquire", wraps=self.gateway.pool.acquire,
+                               side_effect=[TimeoutError("No free connection"), mock.DEFAULT]) as acquire:
+            self.assertEqual(self.pay(), "Payment successful, Order confirmed")
+        self.assertEqual(acquire.call_count, 2)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_circuit_opens_and_fails_fast(self):
+        """
+        Test case for the breaker opening after repeated failures and refusing payments without calling the gateway.
+        """
+        self.server.inject_faults(*[TimeoutError("Gateway timed out")] * 3)
+        for _ in range(3):
+            self.assertEqual(self.pay(), "Error: Gateway timed out")
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.pay(), "Error: credit_card gateway is unavailable")
+        self.assertEqual(self.server.requests, 3)  # The second payment never reached the gateway.
+
+    def test_circuit_half_open_trial(self):
+        """
+        Test case for a trial call after the reset timeout reopening the breaker on failure and closing it on success.
+        """
+        self.gateway.retry.max_attempts = 1
+        self.server.inject_faults(*[ConnectionError("Connection refused")] * 4)
+        for _ in range(3):
+            self.pay()
+        self.now = 10.0
+        self.assertEqual(self.pay(), "Error: Connection refused")  # The trial call fails, so the breaker reopens.
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.pay(), "Error: credit_card gateway is unavailable")
+
+        self.now = 20.0
+        self.assertEqual(self.pay(), "Payment successful, Order confirmed")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_non_transient_error_releases_half_open_trial(self):
+        """
+        Test case for a trial call failing with a non-transient error not leaving the breaker stuck half-open.
+        """
+        self.gateway.retry.max_attempts = 1
+        self.server.inject_faults(*[ConnectionError("Connection refused")] * 3, KeyError("card_number"))
+        for _ in range(3):
+            self.pay()
+        self.now = 10.0
+        self.assertEqual(self.pay(), "Error: 'card_number'")  # The trial call fails with a non-transient error.
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(self.pay(), "Payment successful, Order confirmed")  # The next trial is let through.
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
 
 if __name__ == "__main__":
     unittest.main()  # Run the unit tests.